@@ -0,0 +1,83 @@
+"""Micro-benchmark of callback data encoding and dispatch.
+
+Compares the legacy `{action}$%^{sha}` format, which is dispatched by
+testing `startswith` predicates of handlers in turn, with the compact
+base64url format dispatched by a dict lookup. The dispatch is measured
+with 2, 10 and 50 registered actions, the pressed button is the last one.
+
+Usage:
+    python bench/callback.py [--number 100000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import callback  # noqa: E402
+
+SHA = "57d968d4c4a8b3a8f0e0b2b3f2f6d1a2b3c4d5e6"
+
+
+def legacy_encode(action: str, sha: str) -> str:
+    return callback.SEP.join([action, sha])
+
+
+def legacy_decode(data: str) -> str:
+    return callback.SEP.join(data.split(callback.SEP)[1:])
+
+
+class Callback:
+    def __init__(self, data: str):
+        self.data = data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    def measure(label: str, stmt):
+        seconds = min(timeit.repeat(stmt, number=args.number, repeat=3))
+        print("%-32s %8.3f us" % (label, seconds / args.number * 1e6))
+
+    compact = callback.form_callback_query("build_commit", SHA)
+    legacy = legacy_encode("build_commit", SHA)
+    print("data length: legacy %d, compact %d" % (len(legacy), len(compact)))
+    measure("legacy encode", lambda: legacy_encode("build_commit", SHA))
+    measure(
+        "compact encode",
+        lambda: callback.form_callback_query("build_commit", SHA),
+    )
+    measure("legacy decode", lambda: legacy_decode(legacy))
+    measure("compact decode", lambda: callback.parse_callback_query(compact))
+
+    for actions in (2, 10, 50):
+        names = ["action%d" % i for i in range(actions - 1)]
+        names.append("build_commit")
+
+        # Handlers are tested in turn like telebot handlers with predicates
+        predicates = [
+            (lambda cb, name=name: cb.data.startswith(name), name)
+            for name in names
+        ]
+
+        def legacy_dispatch(cb=Callback(legacy)):
+            for predicate, _ in predicates:
+                if predicate(cb):
+                    return legacy_decode(cb.data)
+
+        dispatcher = callback.CallbackDispatcher()
+        for name in names:
+            dispatcher.handler(name)(lambda cb, data: data)
+
+        measure("legacy dispatch, %d actions" % actions, legacy_dispatch)
+        measure(
+            "compact dispatch, %d actions" % actions,
+            lambda cb=Callback(compact): dispatcher.dispatch(cb),
+        )
+
+
+if __name__ == "__main__":
+    main()
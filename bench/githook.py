@@ -0,0 +1,156 @@
+"""Load test of GitHub push webhooks with recorded or generated payloads.
+
+Signed `push` events are posted to a local `WebhookServer` with
+a `PushDispatcher` by several concurrent clients. Pushes are chained (the
+`before` of a push is the `after` of the previous one) and indexed into an
+in-memory `CommitIndex`, a burst handler counts posted messages instead of
+sending them. Results are printed as JSON.
+
+Usage:
+    python bench/githook.py [--payloads pushes.jsonl] [--count 2000]
+                            [--clients 16] [--commits 3] [--delay 0.2]
+
+A file of recorded payloads contains one `push` event payload (JSON) per
+line, they are signed with the bench secret before posting.
+"""
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from commitindex import CommitIndex  # noqa: E402
+from webhook import PushDispatcher, WebhookServer  # noqa: E402
+
+SECRET = "bench"
+
+
+def generate_payloads(count: int, commits: int) -> list:
+    """Generates chained pushes of `commits` commits to the main branch."""
+    payloads, before, serial = [], "0" * 40, 0
+    for _ in range(count):
+        pushed = []
+        for _ in range(commits):
+            serial += 1
+            sha = hashlib.sha1(str(serial).encode()).hexdigest()
+            pushed.append(
+                {
+                    "id": sha,
+                    "message": "feat: commit %d" % serial,
+                    "url": "https://github.com/o/r/commit/" + sha,
+                }
+            )
+        payloads.append(
+            {
+                "ref": "refs/heads/main",
+                "before": before,
+                "after": pushed[-1]["id"],
+                "forced": False,
+                "deleted": False,
+                "pusher": {"name": "bench"},
+                "repository": {"full_name": "o/r", "default_branch": "main"},
+                "commits": pushed,
+            }
+        )
+        before = pushed[-1]["id"]
+    return payloads
+
+
+def post_payloads(port: int, bodies: list, latencies: list, statuses: list):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for body in bodies:
+        signature = "sha256=" + hmac.new(
+            SECRET.encode(), body, hashlib.sha256
+        ).hexdigest()
+        headers = {
+            "X-GitHub-Event": "push",
+            "X-GitHub-Delivery": str(uuid.uuid4()),
+            "X-Hub-Signature-256": signature,
+            "Content-Type": "application/json",
+        }
+        start = time.perf_counter()
+        conn.request("POST", "/github", body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses.append(response.status)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payloads", help="a file with recorded payloads")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--commits", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.payloads:
+        with open(args.payloads) as file:
+            payloads = [json.loads(line) for line in file if line.strip()]
+    else:
+        payloads = generate_payloads(args.count, args.commits)
+    bodies = [json.dumps(payload).encode() for payload in payloads]
+
+    index = CommitIndex(":memory:")
+    messages = []
+
+    def handle_pushes(pushes):
+        for push in pushes:
+            index.add_newer(push.commits)
+        messages.append(sum(len(push.commits) for push in pushes))
+
+    dispatcher = PushDispatcher(handle_pushes, SECRET, delay=args.delay)
+    server = WebhookServer("127.0.0.1", 0)
+    server.route("/github", dispatcher)
+    server.start()
+
+    latencies, statuses = [], []
+    chunks = [bodies[i :: args.clients] for i in range(args.clients)]
+    threads = [
+        threading.Thread(
+            target=post_payloads,
+            args=(server.address[1], chunk, latencies, statuses),
+        )
+        for chunk in chunks
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    dispatcher.flush()
+    server.shutdown()
+
+    latencies.sort()
+    print(
+        json.dumps(
+            {
+                "payloads": len(bodies),
+                "accepted": statuses.count(200),
+                "rejected": len(statuses) - statuses.count(200),
+                "seconds": round(elapsed, 3),
+                "payloads_per_second": round(len(bodies) / elapsed, 1),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                "p99_ms": round(
+                    latencies[int(0.99 * (len(latencies) - 1))] * 1000, 2
+                ),
+                "messages": len(messages),
+                "indexed_commits": index.count(),
+                "stats": dispatcher.stats,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Benchmarks `/jinfo` job details against a local Jenkins stub.
+
+Compares the bulk JSON API request, the thread pool fallback and the cached
+result at 10, 100 and 1000 jobs.
+
+Usage:
+    python bench/jinfo.py [--latency 0.002]
+"""
+import argparse
+import os
+import sys
+import time
+
+from stubs import JenkinsStub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.002)
+    args = parser.parse_args()
+
+    with JenkinsStub(latency=args.latency) as stub:
+        os.environ.update(
+            TELEGRAM_CHAT_ID="0",
+            JENKINS_HOST=stub.url,
+            JENKINS_USERNAME="bench",
+            JENKINS_PASSWORD="bench",
+        )
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+        import jenkins
+
+        for jobs in (10, 100, 1000):
+            stub.jobs = jobs
+            # jenkinsapi keeps the jobs list of the first request
+            jenkins.get_jenkins().jobs_container = None
+            for name, fetch in (
+                ("bulk", jenkins._fetch_jobs),
+                ("pool", jenkins._inspect_jobs),
+            ):
+                stub.requests = 0
+                start = time.perf_counter()
+                fetch()
+                elapsed = time.perf_counter() - start
+                print(
+                    "%5d jobs  %-6s %8.1f ms  %5d requests"
+                    % (jobs, name, elapsed * 1000, stub.requests)
+                )
+            jenkins.jobs_cache.clear()
+            jenkins.get_job_details()
+            start = time.perf_counter()
+            jenkins.get_job_details()
+            elapsed = time.perf_counter() - start
+            print("%5d jobs  %-6s %8.3f ms" % (jobs, "cached", elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark of the cost of logging in a handler thread.
+
+Measures a record logged through the queue (`logs.setup_logging`) and
+directly by a `StreamHandler` with the JSON formatter, both writing to
+a slow stream (`--write-delay` seconds per record, e.g. a busy pipe or a
+disk), the overhead of `logs.instrument_handler` (INFO level) and a debug
+record dropped by sampling.
+
+Usage:
+    python bench/logs.py [--number 20000] [--write-delay 0.0001]
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import logs  # noqa: E402
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return len(text)
+
+
+def handler(message):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--write-delay", type=float, default=0.0001)
+    args = parser.parse_args()
+
+    def measure(stmt, number=args.number) -> float:
+        return min(timeit.repeat(stmt, number=number, repeat=3)) / number
+
+    logger = logging.getLogger("bench")
+    logger.propagate = False
+    direct = logging.StreamHandler(SlowStream(args.write_delay))
+    direct.setFormatter(logs.JSONFormatter())
+    logger.addHandler(direct)
+    blocking = measure(
+        lambda: logger.warning("failed", extra={"job": "x"}),
+        number=min(args.number, 2000),
+    )
+    logger.removeHandler(direct)
+    logger.propagate = True
+
+    queued = logs.setup_logging(
+        "INFO", 0.0, args.number * 3, stream=SlowStream(args.write_delay)
+    )
+    enqueued = measure(lambda: logger.warning("failed", extra={"job": "x"}))
+    instrumented = logs.instrument_handler(handler)
+    plain = measure(lambda: handler(None))
+    wrapped = measure(lambda: instrumented(None))
+    logging.getLogger().setLevel(logging.DEBUG)
+    dropped = measure(lambda: logger.debug("call", extra={"job": "x"}))
+    print("direct record (slow stream)  %8.3f us" % (blocking * 1e6))
+    print("queued record                %8.3f us" % (enqueued * 1e6))
+    print("sampled out debug record     %8.3f us" % (dropped * 1e6))
+    print("handler context overhead     %8.3f us" % ((wrapped - plain) * 1e6))
+    print("dropped on a full queue      %8d" % queued.dropped)
+
+
+if __name__ == "__main__":
+    main()
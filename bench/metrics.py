@@ -0,0 +1,52 @@
+"""Micro-benchmark of the overhead of the metrics instrumentation.
+
+Measures a call of an empty handler without and with
+`metrics.instrument_handler`, a `track_call` block (outbound calls) and
+the rendering of `/metrics` with 50 handlers.
+
+Usage:
+    python bench/metrics.py [--number 200000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import metrics  # noqa: E402
+
+
+def handler(message):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    def measure(stmt, number=args.number) -> float:
+        return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+    instrumented = metrics.instrument_handler(handler, "bench")
+
+    def track():
+        with metrics.track_call("bench", "GET"):
+            pass
+
+    plain = measure(lambda: handler(None))
+    wrapped = measure(lambda: instrumented(None))
+    tracked = measure(track)
+    for i in range(50):
+        metrics.instrument_handler(handler, "handler%d" % i)(None)
+    expose = measure(metrics.REGISTRY.expose, number=100)
+    print("plain handler call         %8.3f us" % (plain * 1e6))
+    print("instrumented handler call  %8.3f us" % (wrapped * 1e6))
+    print("handler overhead           %8.3f us" % ((wrapped - plain) * 1e6))
+    print("track_call block           %8.3f us" % (tracked * 1e6))
+    print("/metrics with 50 handlers  %8.3f ms" % (expose * 1e3))
+
+
+if __name__ == "__main__":
+    main()
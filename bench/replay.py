@@ -0,0 +1,271 @@
+"""Replays scripted updates through the real bot handlers against stubs.
+
+Local stubs of GitHub, Jenkins, OpenAI and Telegram (see `stubs`) are
+started, the bot is configured to use them and imported, and the updates of
+every scenario of a script are processed by a pool of workers, as in the
+webhook mode. Throughput, p50/p99 latency of updates, errors, requests to
+the stubs and memory are printed as JSON, which can be saved and compared
+across commits.
+
+A backend can be down during the replay (`--down jenkins --outage hang`),
+states of circuit breakers are reported, so it's seen that other commands
+stay fast and the down backend fails fast after a few timeouts.
+
+Usage:
+    python bench/replay.py [--script bench/scenarios.jsonl] [--workers 8]
+                           [--latency 0.02] [--error-rate 0]
+                           [--down jenkins] [--outage hang] [--timeout 2]
+                           [--output results.json]
+
+A script has one scenario step per line (JSON):
+    {"scenario": "commits", "text": "/commits 10", "count": 50}
+    {"scenario": "build", "callback": "build_commit", "count": 50}
+`{i}` in a text is replaced with a serial number of the update, a callback
+is pressed for commits of the GitHub stub in turn.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from stubs import GitHubStub, JenkinsStub, OpenAIStub, TelegramStub
+
+CHAT_ID = -100
+USER = {"id": 1, "is_bot": False, "first_name": "Bench"}
+
+_update_ids = count(1)
+
+
+def make_update(step: dict, i: int, shas: list) -> dict:
+    """Returns a Telegram update of the i-th repetition of a step."""
+    message = {
+        "message_id": i + 1,
+        "date": int(time.time()),
+        "chat": {"id": CHAT_ID, "type": "supergroup"},
+        "from": USER,
+    }
+    if "callback" in step:
+        from callback import form_callback_query
+
+        data = form_callback_query(step["callback"], shas[i % len(shas)])
+        return {
+            "update_id": next(_update_ids),
+            "callback_query": {
+                "id": str(i),
+                "from": USER,
+                "chat_instance": "bench",
+                "data": data,
+                "message": message,
+            },
+        }
+    text = step["text"].format(i=i)
+    message["text"] = text
+    message["entities"] = [
+        {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+    ]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def percentile(values: list, share: float) -> float:
+    values = sorted(values)
+    return values[int(share * (len(values) - 1))] if values else 0.0
+
+
+def get_max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure(stubs: dict, resources_path: str):
+    """Points the bot configuration to the stubs."""
+    os.environ.update(
+        TELEGRAM_TOKEN="0:bench",
+        TELEGRAM_CHAT_ID=str(CHAT_ID),
+        TELEGRAM_API_URL=stubs["telegram"].url,
+        # Updates are processed by the harness workers, not by polling
+        TELEGRAM_WEBHOOK_URL="https://bench.invalid/telegram",
+        GITHUB_TOKEN="bench",
+        GITHUB_API_URL=stubs["github"].url,
+        REPO_OWNER="noted",
+        REPO_NAME="bench",
+        JENKINS_HOST=stubs["jenkins"].url,
+        JENKINS_USERNAME="bench",
+        JENKINS_PASSWORD="bench",
+        CD_JOB="job0",
+        CI_JOB="job1",
+        BLUE_OCEAN_DASHBOARD_PATH="/blue",
+        OPENAI_KEY="bench",
+        OPENAI_API_BASE=stubs["openai"].url + "/v1",
+        CHAT_CACHE_PATH="",
+        PING_URL=stubs["telegram"].url + "/site",
+        METRICS_PORT="0",
+        RESOURCES_PATH=resources_path,
+    )
+
+
+def run_scenario(bot_module, updates: list, workers: int) -> dict:
+    from telebot import types
+
+    latencies, errors = [], []
+
+    def process(update: dict):
+        start = time.perf_counter()
+        try:
+            bot_module.bot.process_new_updates([types.Update.de_json(update)])
+        except Exception as error:
+            errors.append(repr(error))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(process, updates))
+    elapsed = time.perf_counter() - start
+    return {
+        "updates": len(updates),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_rss_mb": round(get_max_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--script",
+        default=os.path.join(os.path.dirname(__file__), "scenarios.jsonl"),
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--commits", type=int, default=250)
+    parser.add_argument("--message-size", type=int, default=50)
+    parser.add_argument(
+        "--issue-limit",
+        type=int,
+        help="issues a second GitHub accepts (a secondary rate limit)",
+    )
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--answer-words", type=int, default=50)
+    parser.add_argument(
+        "--flood-limits",
+        action="store_true",
+        help="keep the Telegram flood limits of the sender",
+    )
+    parser.add_argument(
+        "--down",
+        choices=["github", "jenkins", "openai"],
+        help="a backend which is down during the replay",
+    )
+    parser.add_argument(
+        "--outage", choices=["hang", "error", "refuse"], default="hang"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="seconds of backend timeouts (the bot defaults if empty)",
+    )
+    parser.add_argument("--output", help="a file to save the results")
+    args = parser.parse_args()
+
+    with open(args.script) as file:
+        steps = [json.loads(line) for line in file if line.strip()]
+
+    stub_options = {"latency": args.latency, "error_rate": args.error_rate}
+    stubs = {
+        "github": GitHubStub(
+            commits=args.commits,
+            message_size=args.message_size,
+            issue_limit=args.issue_limit,
+            **stub_options,
+        ),
+        "jenkins": JenkinsStub(jobs=args.jobs, **stub_options),
+        "openai": OpenAIStub(answer_words=args.answer_words, **stub_options),
+        # Telegram answers fast, its latency would hide the bot's one
+        "telegram": TelegramStub(),
+    }
+    for stub in stubs.values():
+        stub.start()
+    if args.down:
+        stubs[args.down].outage = args.outage
+        if args.outage == "refuse":
+            stubs[args.down].stop()
+
+    with tempfile.TemporaryDirectory() as resources_path:
+        configure(stubs, resources_path)
+        if args.timeout:
+            for name in ("GITHUB", "JENKINS", "OPENAI"):
+                os.environ[name + "_TIMEOUT"] = str(args.timeout)
+        sys.path.insert(
+            0, os.path.join(os.path.dirname(__file__), "../src")
+        )
+        rss_before = get_max_rss_mb()
+        import_start = time.perf_counter()
+        import bot as bot_module
+        import resilience
+        import sender
+
+        import_seconds = time.perf_counter() - import_start
+        if not args.flood_limits:
+            sender.GROUP_CHAT_RATE = sender.PRIVATE_CHAT_RATE = 1e9
+            sender.CHAT_BURST = 1e9
+            bot_module.sender._global = sender.TokenBucket(1e9, 1e9)
+
+        shas = stubs["github"].shas
+        results = {}
+        for step in steps:
+            updates = [
+                make_update(step, i, shas) for i in range(step["count"])
+            ]
+            for stub in stubs.values():
+                stub.requests = 0
+            result = run_scenario(bot_module, updates, args.workers)
+            result["stub_requests"] = {
+                name: stub.requests for name, stub in stubs.items()
+            }
+            result["circuits"] = {
+                breaker.name: breaker.state
+                for breaker in resilience.get_breakers()
+            }
+            results[step["scenario"]] = result
+
+    for stub in stubs.values():
+        stub.stop()
+    report = {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "options": vars(args),
+        "import_seconds": round(import_seconds, 3),
+        "rss_before_import_mb": round(rss_before, 1),
+        "scenarios": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
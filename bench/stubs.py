@@ -0,0 +1,415 @@
+"""Local stand-in HTTP servers of the services the bot talks to.
+
+There are stubs of the GitHub, Jenkins, OpenAI and Telegram APIs. Every
+stub runs a threaded HTTP server on a free local port in a background
+thread. The `latency` (seconds added to every response), `error_rate`
+(a share of requests answered with 500) and payload sizes are configurable,
+so benchmarks run offline and reproducibly. A stub can simulate an outage
+(`outage`): "hang" (requests aren't answered), "error" (every request is
+answered with 503) or "refuse" (the server is stopped).
+
+Usage:
+    with JenkinsStub(jobs=100, latency=0.01) as jenkins:
+        os.environ["JENKINS_HOST"] = jenkins.url
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+GRAPHQL_OBJECT_RE = re.compile(r'(\w+): object\(oid: "([0-9a-f]+)"\)')
+# Seconds a request waits for an answer in the "hang" outage
+HANG_SECONDS = 3600
+
+
+class StubServer:
+    """A base stub server, subclasses implement `handle`."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.outage = None
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:%d" % self._server.server_port
+
+    def start(self) -> "StubServer":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                stub.requests += 1
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if stub.outage == "hang":
+                    time.sleep(HANG_SECONDS)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if stub.outage == "error":
+                    status, headers, payload = 503, {}, {"error": "outage"}
+                elif stub.error_rate and random.random() < stub.error_rate:
+                    status, headers, payload = 500, {}, {"error": "stub"}
+                else:
+                    status, headers, payload = stub.handle(
+                        self.command, url.path, query, body, self.headers
+                    )
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode()
+                    headers.setdefault("Content-Type", "application/json")
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def handle(self, method, path, query, body, headers):
+        """Returns a response - (a status, headers, a dict or bytes)."""
+        raise NotImplementedError
+
+
+class JenkinsStub(StubServer):
+    """A Jenkins JSON API with `jobs` parameterized freestyle jobs.
+
+    A triggered build waits in the queue for `queue_seconds` and runs for
+    `build_seconds`.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 10,
+        queue_seconds: float = 0.0,
+        build_seconds: float = 1.0,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.jobs = jobs
+        self.queue_seconds = queue_seconds
+        self.build_seconds = build_seconds
+        # A job index -> triggered builds (the newest last)
+        self.builds = {}
+        self.triggered = 0
+        self._lock = threading.Lock()
+
+    def _build(self, job_url: str, build: dict, now: float) -> dict:
+        started = build["queued"] + self.queue_seconds
+        building = now < started + self.build_seconds
+        return {
+            "number": build["number"],
+            "url": "%s%d/" % (job_url, build["number"]),
+            "queueId": build["queueId"],
+            "building": building,
+            "result": None if building else "SUCCESS",
+            "timestamp": int(started * 1000),
+            "duration": 0 if building else int(self.build_seconds * 1000),
+            "estimatedDuration": int(self.build_seconds * 1000),
+        }
+
+    def _job(self, i: int) -> dict:
+        url = "%s/job/job%d/" % (self.url, i)
+        now = time.time()
+        triggered = self.builds.get(i, [])
+        queued = [
+            b for b in triggered if b["queued"] + self.queue_seconds > now
+        ]
+        builds = [
+            self._build(url, b, now)
+            for b in reversed(triggered)
+            if b not in queued
+        ]
+        if not triggered:
+            builds = [{"number": 1, "url": url + "1/", "building": False}]
+        return {
+            "name": "job%d" % i,
+            "fullName": "job%d" % i,
+            "url": url,
+            "description": "A stub job number %d" % i,
+            "color": "blue",
+            "inQueue": bool(queued),
+            "queueItem": {"id": queued[0]["queueId"]} if queued else None,
+            "lastBuild": builds[0] if builds else None,
+            "builds": builds,
+            "actions": [],
+            "property": [
+                {"parameterDefinitions": [{"name": "COMMIT_HASH"}]}
+            ],
+        }
+
+    def _trigger(self, i: int) -> int:
+        with self._lock:
+            self.triggered += 1
+            builds = self.builds.setdefault(i, [])
+            builds.append(
+                {
+                    "number": len(builds) + 2,
+                    "queueId": self.triggered,
+                    "queued": time.time(),
+                }
+            )
+            return self.triggered
+
+    def handle(self, method, path, query, body, headers):
+        # jenkinsapi requests `api/python`, but it accepts JSON as well
+        parts = path.strip("/").split("/")
+        if parts[:2] == ["queue", "api"]:
+            now = time.time()
+            return 200, {}, {
+                "items": [
+                    {"id": b["queueId"]}
+                    for builds in list(self.builds.values())
+                    for b in builds
+                    if b["queued"] + self.queue_seconds > now
+                ]
+            }
+        if parts[0] == "queue" and len(parts) >= 3:
+            return 200, {}, {"id": int(parts[2]), "task": {"name": "job"}}
+        if parts[0] != "job" and len(parts) != 2:
+            return 404, {}, {}
+        if parts[-1] in ("build", "buildWithParameters"):
+            queue_id = self._trigger(int(parts[1][3:]))
+            location = "%s/queue/item/%d/" % (self.url, queue_id)
+            return 201, {"Location": location}, b""
+        if parts[-1] not in ("json", "python"):
+            return 404, {}, {}
+        if len(parts) == 2:
+            return 200, {}, {"jobs": [self._job(i) for i in range(self.jobs)]}
+        job = self._job(int(parts[1][3:]))
+        if len(parts) == 4:
+            return 200, {}, job
+        build = next(
+            b for b in job["builds"] if str(b["number"]) == parts[2]
+        )
+        return 200, {}, dict({"result": "SUCCESS"}, **build)
+
+
+class GitHubStub(StubServer):
+    """A GitHub REST API with a repository of `commits` commits.
+
+    Lists of commits are paginated with `Link` headers and revalidated with
+    `ETag`s, created issues get sequential numbers. More than `issue_limit`
+    issues a second are rejected like by a secondary rate limit. GraphQL
+    queries of aliased commit objects are answered with generated details.
+    """
+
+    def __init__(
+        self,
+        commits: int = 250,
+        message_size: int = 50,
+        issue_limit: int = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.message_size = message_size
+        self.issue_limit = issue_limit
+        self.issues = 0
+        self.rate_limited = 0
+        self._issue_times = []
+        self._issue_lock = threading.Lock()
+        self.set_commits(commits)
+
+    def _is_issue_limited(self) -> bool:
+        if not self.issue_limit:
+            return False
+        with self._issue_lock:
+            now = time.monotonic()
+            self._issue_times = [t for t in self._issue_times if t > now - 1]
+            if len(self._issue_times) >= self.issue_limit:
+                self.rate_limited += 1
+                return True
+            self._issue_times.append(now)
+            return False
+
+    def set_commits(self, commits: int):
+        """Replaces the history, the first SHA is the newest commit."""
+        self.shas = [
+            hashlib.sha1(str(i).encode()).hexdigest()
+            for i in range(commits, 0, -1)
+        ]
+
+    def handle(self, method, path, query, body, headers):
+        parts = path.strip("/").split("/")
+        if method == "POST" and parts[-1] == "issues":
+            if self._is_issue_limited():
+                message = "You have exceeded a secondary rate limit."
+                return 403, {"Retry-After": "1"}, {"message": message}
+            with self._issue_lock:
+                self.issues += 1
+                number = self.issues
+            url = "https://github.com/%s/%s/issues/%d" % (
+                parts[1],
+                parts[2],
+                number,
+            )
+            return 201, {}, {"number": number, "html_url": url}
+        if method == "POST" and parts[-1] == "graphql":
+            return 200, {}, self._graphql(json.loads(body)["query"])
+        if parts[-1] != "commits":
+            return 404, {}, {"message": "Not Found"}
+        shas = self.shas
+        if query.get("sha") in shas:
+            shas = shas[shas.index(query["sha"]) :]
+        per_page = int(query.get("per_page", 30))
+        page = int(query.get("page", 1))
+        payload = json.dumps(
+            [
+                {
+                    "sha": sha,
+                    "commit": {
+                        "message": ("commit %s " % sha[:7]).ljust(
+                            self.message_size, "x"
+                        )
+                    },
+                    "html_url": "https://github.com/o/r/commit/" + sha,
+                }
+                for sha in shas[(page - 1) * per_page : page * per_page]
+            ]
+        ).encode()
+        etag = '"%s"' % hashlib.md5(payload).hexdigest()
+        if headers.get("If-None-Match") == etag:
+            return 304, {"ETag": etag}, b""
+        response_headers = {"ETag": etag, "Content-Type": "application/json"}
+        if page * per_page < len(shas):
+            next_query = dict(query, page=page + 1)
+            response_headers["Link"] = '<%s%s?%s>; rel="next"' % (
+                self.url,
+                path,
+                urlencode(next_query),
+            )
+        return 200, response_headers, payload
+
+
+    def _graphql(self, query: str) -> dict:
+        repository = {}
+        for alias, sha in GRAPHQL_OBJECT_RE.findall(query):
+            size = int(sha[:4], 16)
+            repository[alias] = {
+                "author": {"name": "Bench", "user": {"login": "bench"}},
+                "committedDate": "2023-03-01T12:00:00Z",
+                "additions": size % 500,
+                "deletions": size % 100,
+                "changedFilesIfAvailable": size % 20 + 1,
+                # Every 8th commit is still being checked
+                "statusCheckRollup": {
+                    "state": "PENDING" if size % 8 == 0 else "SUCCESS"
+                },
+            }
+        return {"data": {"repository": repository}}
+
+
+class OpenAIStub(StubServer):
+    """An OpenAI completions API which answers with `answer_words` words.
+
+    A streamed answer is sent as server-sent events, a word per event.
+    """
+
+    def __init__(self, answer_words: int = 50, **kwargs):
+        super().__init__(**kwargs)
+        self.answer_words = answer_words
+
+    def handle(self, method, path, query, body, headers):
+        if not path.endswith("/completions"):
+            return 404, {}, {"error": {"message": "Not Found"}}
+        request = json.loads(body or b"{}")
+        words = [" word%d" % i for i in range(self.answer_words)]
+        if not request.get("stream"):
+            return (
+                200,
+                {},
+                {
+                    "choices": [{"text": "".join(words), "index": 0}],
+                    "usage": {"total_tokens": self.answer_words * 2},
+                },
+            )
+        events = [
+            "data: %s\n\n" % json.dumps({"choices": [{"text": w, "index": 0}]})
+            for w in words
+        ]
+        events.append("data: [DONE]\n\n")
+        return (
+            200,
+            {"Content-Type": "text/event-stream"},
+            "".join(events).encode(),
+        )
+
+
+class TelegramStub(StubServer):
+    """A Telegram Bot API which accepts the methods the bot calls.
+
+    Sent messages get sequential ids and are counted in `calls` by
+    the method. `GET /site` answers as the website checked by `/ping`.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.message_id = 0
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _message(self, chat_id) -> dict:
+        with self._lock:
+            self.message_id += 1
+            message_id = self.message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "group"},
+            "text": "",
+        }
+
+    def handle(self, method, path, query, body, headers):
+        if path == "/site":
+            return 200, {"Content-Type": "text/html"}, b"<html></html>"
+        api_method = path.rsplit("/", 1)[-1]
+        with self._lock:
+            self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench"}
+        elif api_method in ("sendMessage", "editMessageText", "sendPhoto"):
+            result = self._message(query.get("chat_id"))
+            if api_method == "sendPhoto":
+                result["photo"] = [
+                    {
+                        "file_id": "photo%d" % result["message_id"],
+                        "file_unique_id": "u%d" % result["message_id"],
+                        "width": 1,
+                        "height": 1,
+                    }
+                ]
+        else:
+            result = True
+        return 200, {}, {"ok": True, "result": result}
@@ -0,0 +1,107 @@
+"""Measures memory per tenant and the cost of a tenant lookup.
+
+A registry of N tenants is built from their JSON representations, and its
+Python memory is measured with `tracemalloc`. Then a commit index of every
+tenant repository is opened (the only per-tenant state of the bot), and
+the RSS growth is measured too, since SQLite allocates outside the Python
+heap. A lookup of a tenant by a chat id is timed for registries of
+different sizes. Results are printed as JSON.
+
+Usage:
+    python bench/tenants.py [--tenants 1000] [--indexes 100]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+
+def get_rss_kb() -> int:
+    """Returns the current RSS in kilobytes (Linux)."""
+    with open("/proc/self/statm") as file:
+        pages = int(file.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def make_tenant_data(i: int) -> dict:
+    return {
+        "name": "project%d" % i,
+        "chat_id": -1000000000000 - i,
+        "repo": "team/project%d" % i,
+        "cd_job": "project%d/deploy" % i,
+        "ci_job": "project%d/test" % i,
+        "blue_ocean_path": "/blue/organizations/jenkins/project%d" % i,
+        "openai": {"temperature": 0.5},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--indexes", type=int, default=100)
+    args = parser.parse_args()
+
+    resources_path = tempfile.mkdtemp()
+    for name, value in {
+        "TELEGRAM_CHAT_ID": "-1",
+        "GITHUB_TOKEN": "bench",
+        "REPO_OWNER": "team",
+        "REPO_NAME": "default",
+        "RESOURCES_PATH": resources_path,
+    }.items():
+        os.environ.setdefault(name, value)
+
+    import github
+    from tenants import TenantRegistry, parse_tenant
+
+    data = [make_tenant_data(i) for i in range(args.tenants)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    registry = TenantRegistry(parse_tenant(item) for item in data)
+    after = tracemalloc.take_snapshot()
+    registry_bytes = sum(
+        stat.size_diff for stat in after.compare_to(before, "filename")
+    )
+    tracemalloc.stop()
+
+    rss_before = get_rss_kb()
+    tenants = list(registry)[: args.indexes]
+    for tenant in tenants:
+        github.get_index(tenant.repo).count()
+    index_kb = (get_rss_kb() - rss_before) / max(len(tenants), 1)
+
+    lookups = {}
+    for size in (1, 100, args.tenants):
+        small = TenantRegistry(list(registry)[:size])
+        chat_id = data[size - 1]["chat_id"]
+        number = 1000000
+        seconds = min(
+            timeit.repeat(
+                lambda: small.get(chat_id), number=number, repeat=3
+            )
+        )
+        lookups[size] = round(seconds / number * 1e9, 1)
+
+    print(
+        json.dumps(
+            {
+                "tenants": args.tenants,
+                "registry_bytes_per_tenant": round(
+                    registry_bytes / args.tenants
+                ),
+                "opened_indexes": len(tenants),
+                "index_rss_kb_per_tenant": round(index_kb, 1),
+                "lookup_ns_by_registry_size": lookups,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Load test of the webhook server with recorded or generated updates.
+
+Updates are posted to a local `WebhookServer` by several concurrent
+clients. An update rejected with 503 is retried, as Telegram does. The
+handler of the bot simulates work with a sleep. Results are printed as JSON.
+
+Usage:
+    python bench/webhook.py [--updates updates.jsonl] [--count 2000]
+                            [--clients 16] [--workers 8] [--handler-ms 5]
+
+A file of recorded updates contains one Telegram update (JSON) per line.
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from telebot import TeleBot  # noqa: E402
+
+from webhook import UpdateDispatcher, WebhookServer  # noqa: E402
+
+
+def generate_updates(count: int, duplicates: float = 0.05) -> list:
+    """Generates `/ping` message updates, a share of them are repeated."""
+    updates = []
+    for i in range(count):
+        update_id = i - 1 if i and i % int(1 / duplicates) == 0 else i
+        updates.append(
+            {
+                "update_id": update_id,
+                "message": {
+                    "message_id": i,
+                    "date": int(time.time()),
+                    "chat": {"id": -1, "type": "group"},
+                    "from": {"id": 1, "is_bot": False, "first_name": "B"},
+                    "text": "/ping",
+                    "entities": [
+                        {"type": "bot_command", "offset": 0, "length": 5}
+                    ],
+                },
+            }
+        )
+    return updates
+
+
+def post_updates(port: int, updates: list, retries: list):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for update in updates:
+        body = json.dumps(update)
+        while True:
+            conn.request("POST", "/telegram", body)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 503:
+                break
+            retries.append(1)
+            time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", help="a file with recorded updates")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--queue-size", type=int, default=100)
+    parser.add_argument("--handler-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    if args.updates:
+        with open(args.updates) as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+    else:
+        updates = generate_updates(args.count)
+
+    bot = TeleBot("0:bench", threaded=False)
+
+    @bot.message_handler(func=lambda message: True)
+    def handler(message):
+        time.sleep(args.handler_ms / 1000)
+
+    server = WebhookServer("127.0.0.1", 0)
+    dispatcher = UpdateDispatcher(
+        bot, workers=args.workers, queue_size=args.queue_size
+    )
+    server.route("/telegram", dispatcher)
+    server.start()
+
+    retries = []
+    chunks = [updates[i :: args.clients] for i in range(args.clients)]
+    threads = [
+        threading.Thread(
+            target=post_updates, args=(server.address[1], chunk, retries)
+        )
+        for chunk in chunks
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dispatcher.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    stats = dispatcher.get_stats()
+    print(
+        json.dumps(
+            {
+                "updates": len(updates),
+                "processed": stats["processed"],
+                "duplicate": stats["duplicate"],
+                "retried_503": len(retries),
+                "seconds": round(elapsed, 3),
+                "updates_per_second": round(stats["processed"] / elapsed, 1),
+                "p50_ms": round(stats["p50"] * 1000, 2),
+                "p99_ms": round(stats["p99"] * 1000, 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,91 @@
+import atexit
+import hashlib
+import json
+import logging
 import random as rand
+import threading
+import time
+from typing import Iterator, Mapping, Optional
 
 import openai
 
-from config import OPENAI_KEY
+from cache import RequestCoalescer, TTLCache
+from config import (
+    CHAT_CACHE_PATH,
+    CHAT_CACHE_SIZE,
+    CHAT_CACHE_TTL,
+    CHAT_CONTEXT_TOKENS,
+    CHAT_HISTORY_TTL,
+    CHAT_HISTORY_TURNS,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    CONVERSATIONS_DB_PATH,
+    OPENAI_API_BASE,
+    OPENAI_KEY,
+    OPENAI_TIMEOUT,
+)
+from conversation import ConversationMemory
+from metrics import track_call
+from resilience import CircuitBreaker, CircuitOpenError
+
+
+logger = logging.getLogger(__name__)
 
 
 openai.api_key = OPENAI_KEY
+if OPENAI_API_BASE:
+    openai.api_base = OPENAI_API_BASE
+
+COMPLETION_PARAMS = {
+    "model": "text-davinci-003",
+    "temperature": 0.5,
+    "max_tokens": 2000,
+    "top_p": 0.3,
+    "frequency_penalty": 0.5,
+    "presence_penalty": 0.0,
+    # Marv shouldn't continue the conversation for the user
+    "stop": ["\nYou:"],
+}
+
+# Errors of an unavailable OpenAI API, other errors (e.g. an invalid
+# request) mean it's up
+OPENAI_FAILURES = (
+    openai.error.APIConnectionError,
+    openai.error.APIError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+# Completions time out and fail fast while OpenAI is down, cached answers
+# are still served
+breaker = CircuitBreaker(
+    "openai", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+
+PREAMBLE = "Marv is a chatbot that reluctantly answers questions with sarcastic responses:\n\n"
+
+# Answers by cache keys of questions, see `get_cache_key`
+answers_cache = TTLCache(maxsize=CHAT_CACHE_SIZE, ttl=CHAT_CACHE_TTL)
+if CHAT_CACHE_PATH:
+    answers_cache.load(CHAT_CACHE_PATH)
+# Seconds new answers are collected before the cache file is rewritten
+CACHE_DUMP_DELAY = 30
+_dump_timer = None
+_dump_lock = threading.Lock()
+_in_flight = RequestCoalescer()
+_cache_stats = {
+    "hits": 0,
+    "coalesced": 0,
+    "misses": 0,
+    "uncached": 0,
+    "tokens_saved": 0,
+    "latency_saved": 0.0,
+}
+_stats_lock = threading.Lock()
+
+# Conversation histories of chats, see `get_memory`
+_memory = None
+_memory_lock = threading.Lock()
 
 MESSAGES = {
     "nobother": [
@@ -53,7 +133,12 @@ def get_message(messages_key: str) -> str:
     return MESSAGES[messages_key][msg_index]
 
 
-def get_answer(text: str) -> str:
+def get_answer(
+    text: str,
+    chat_id: int = None,
+    params: Mapping = None,
+    preamble: str = None,
+) -> str:
     """Gets resposnse text from OpenAI chatbot by input text.
 
     This function takes in a string of text and returns a sarcastic response
@@ -62,27 +147,303 @@ def get_answer(text: str) -> str:
     If an error occurs during the API call or if no input is provided,
     an appropriate message is returned instead of a response from Marv.
 
+    Responses are cached by the normalized question, identical questions
+    requested at the same time share one API call. If `chat_id` is passed,
+    Marv remembers the conversation in the chat, and while it goes on the
+    answer depends on it, so it isn't cached or shared (see
+    `_get_question_key`).
+
     Args:
         text: The input string to be used for generating the response from Marv.
+        chat_id: a chat id of the conversation.
+        params: overrides of `COMPLETION_PARAMS` (e.g. a model of a tenant).
+        preamble: a preamble of the prompt instead of `PREAMBLE`.
 
     Returns:
         A sarcastic response from Marv or an appropriate message if an error
         occurs or no input is provided."""
     if not text:
         return get_message("noinput")
-    prompt = "Marv is a chatbot that reluctantly answers questions with sarcastic responses:\n\n"
-    prompt += text + "\n"
+    params = get_completion_params(params)
+    prompt = get_prompt(text, chat_id, preamble)
+    key = _get_question_key(text, chat_id, preamble, params)
+    answer = answers_cache.get(key) if key else None
+    if answer is not None:
+        _count_cached(answer, "hits")
+        _remember(chat_id, text, answer["text"])
+        return answer["text"]
     try:
+        if key is None:
+            answer = _complete(prompt, key, params, chat_id)
+            is_shared = False
+        else:
+            answer, is_shared = _in_flight.call(
+                key, lambda: _complete(prompt, key, params, chat_id)
+            )
+    except CircuitOpenError as error:
+        logger.warning("OpenAI completion is skipped: %s", error)
+        return get_message("nobother")
+    except Exception:
+        logger.exception("OpenAI completion failed")
+        return get_message("nobother")
+    if is_shared:
+        _count_cached(answer, "coalesced")
+    _remember(chat_id, text, answer["text"])
+    return answer["text"]
+
+
+def stream_answer(
+    text: str,
+    chat_id: int = None,
+    params: Mapping = None,
+    preamble: str = None,
+) -> Iterator[str]:
+    """Streams resposnse text from OpenAI chatbot by input text.
+
+    The same as `get_answer`, but the response is requested with
+    `stream=True` and yielded by chunks as soon as tokens are generated.
+    A cached or a shared response is yielded at once.
+
+    Args:
+        text: The input string to be used for generating the response from Marv.
+        chat_id: a chat id of the conversation.
+        params: overrides of `COMPLETION_PARAMS` (e.g. a model of a tenant).
+        preamble: a preamble of the prompt instead of `PREAMBLE`.
+
+    Yields:
+        Chunks of a sarcastic response from Marv or an appropriate message
+        if an error occurs or no input is provided.
+    """
+    if not text:
+        yield get_message("noinput")
+        return
+    params = get_completion_params(params)
+    prompt = get_prompt(text, chat_id, preamble)
+    key = _get_question_key(text, chat_id, preamble, params)
+    answer = answers_cache.get(key) if key else None
+    if answer is not None:
+        _count_cached(answer, "hits")
+        _remember(chat_id, text, answer["text"])
+        yield answer["text"]
+        return
+    future, is_leader = (
+        _in_flight.acquire(key) if key else (None, True)
+    )
+    if not is_leader:
+        try:
+            answer = future.result()
+        except Exception:
+            yield get_message("nobother")
+            return
+        _count_cached(answer, "coalesced")
+        _remember(chat_id, text, answer["text"])
+        yield answer["text"]
+        return
+
+    chunks, start = [], time.perf_counter()
+    try:
+        with breaker.guard(OPENAI_FAILURES):
+            # The time to the first chunk is recorded
+            with track_call("openai", "completion_stream"):
+                response = openai.Completion.create(
+                    prompt=prompt,
+                    stream=True,
+                    request_timeout=OPENAI_TIMEOUT,
+                    **params,
+                )
+            for chunk in response:
+                chunks.append(chunk["choices"][0]["text"])
+                yield chunks[-1]
+    except GeneratorExit:
+        # The consumer stopped reading the answer, don't keep waiters
+        _release(key, error=RuntimeError("Cancelled"))
+        raise
+    except CircuitOpenError as error:
+        logger.warning("OpenAI completion stream is skipped: %s", error)
+        _release(key, error=error)
+        yield get_message("nobother")
+        return
+    except Exception as error:
+        logger.exception("OpenAI completion stream failed")
+        _release(key, error=error)
+        yield get_message("nobother")
+        return
+    answer = {
+        "text": "".join(chunks),
+        # Streamed responses have no usage, ~4 characters per token
+        "tokens": (len(prompt) + sum(map(len, chunks))) // 4,
+        "latency": time.perf_counter() - start,
+    }
+    _count_prompt(chat_id, prompt)
+    _cache_answer(key, answer)
+    _release(key, answer)
+    _remember(chat_id, text, answer["text"])
+
+
+def get_completion_params(params: Mapping = None) -> dict:
+    """Returns `COMPLETION_PARAMS` with overrides."""
+    return {**COMPLETION_PARAMS, **params} if params else COMPLETION_PARAMS
+
+
+def get_prompt(text: str, chat_id: int = None, preamble: str = None) -> str:
+    """Returns a prompt for Marv with the input text.
+
+    If `chat_id` is passed, the prompt contains the last turns of the chat
+    conversation within `CHAT_CONTEXT_TOKENS` tokens.
+    """
+    preamble = preamble or PREAMBLE
+    if chat_id is None:
+        return preamble + text + "\n"
+    return get_memory().build_prompt(
+        chat_id, preamble, text, CHAT_CONTEXT_TOKENS
+    )
+
+
+def get_memory() -> ConversationMemory:
+    """Returns conversation histories, opens them on the first call."""
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = ConversationMemory(
+                    CONVERSATIONS_DB_PATH,
+                    max_turns=CHAT_HISTORY_TURNS,
+                    ttl=CHAT_HISTORY_TTL,
+                )
+    return _memory
+
+
+def get_cache_key(
+    text: str, preamble: str = None, params: Mapping = None
+) -> str:
+    """Returns a cache key of a question and the completion parameters.
+
+    The key doesn't depend on a conversation history, so an answer is
+    cached only out of a conversation (see `_get_question_key`).
+    The question is normalized: the case and whitespaces are ignored.
+    """
+    normalized = " ".join(text.split()).casefold()
+    key = json.dumps(
+        [preamble or PREAMBLE, normalized, params or COMPLETION_PARAMS],
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _get_question_key(
+    text: str, chat_id: int, preamble: str, params: Mapping
+) -> Optional[str]:
+    """Returns a cache key of a question or None if it can't be cached.
+
+    An answer in a conversation depends on its history, so the questions of
+    a conversation which goes on aren't cached or shared: follow-up
+    questions always request a completion, but an answer to the same
+    question is never taken from another conversation. A conversation is
+    over after `CHAT_HISTORY_TTL` idle seconds or `/reset`, then a question
+    is cached again.
+    """
+    if chat_id is not None and get_memory().has_history(chat_id):
+        return None
+    return get_cache_key(text, preamble, params)
+
+
+def get_cache_stats() -> dict:
+    """Returns counters of the answers cache.
+
+    Counters: hits, coalesced (shared in-flight calls), misses (API calls
+    of cacheable questions), uncached (API calls of questions of
+    a conversation), a hit ratio of cacheable questions, saved tokens and saved
+    seconds of API calls.
+    """
+    with _stats_lock:
+        stats = dict(_cache_stats)
+    requests = stats["hits"] + stats["coalesced"] + stats["misses"]
+    stats["hit_ratio"] = (
+        (stats["hits"] + stats["coalesced"]) / requests if requests else 0.0
+    )
+    stats["size"] = len(answers_cache)
+    return stats
+
+
+def _complete(
+    prompt: str, key: Optional[str], params: Mapping, chat_id: int = None
+) -> dict:
+    """Requests a completion of the prompt and caches it by the key."""
+    start = time.perf_counter()
+    with breaker.guard(OPENAI_FAILURES), track_call("openai", "completion"):
         response = openai.Completion.create(
-            model="text-davinci-003",
-            prompt=prompt,
-            temperature=0.5,
-            max_tokens=2000,
-            top_p=0.3,
-            frequency_penalty=0.5,
-            presence_penalty=0.0,
+            prompt=prompt, request_timeout=OPENAI_TIMEOUT, **params
         )
-    except Exception as error:
-        print(error)
-        return get_message("nobother")
-    return response["choices"][0]["text"]
+    answer = {
+        "text": response["choices"][0]["text"],
+        "tokens": response["usage"]["total_tokens"],
+        "latency": time.perf_counter() - start,
+    }
+    _count_prompt(chat_id, prompt)
+    _cache_answer(key, answer)
+    return answer
+
+
+def _cache_answer(key: Optional[str], answer: dict):
+    if key is None:
+        with _stats_lock:
+            _cache_stats["uncached"] += 1
+        return
+    answers_cache.set(key, answer)
+    with _stats_lock:
+        _cache_stats["misses"] += 1
+    if CHAT_CACHE_PATH:
+        _schedule_dump()
+
+
+def _schedule_dump():
+    """Saves the answers cache to `CHAT_CACHE_PATH` in `CACHE_DUMP_DELAY`
+    seconds, so a burst of new answers rewrites the file once."""
+    global _dump_timer
+    with _dump_lock:
+        if _dump_timer is None:
+            _dump_timer = threading.Timer(CACHE_DUMP_DELAY, dump_cache)
+            _dump_timer.daemon = True
+            _dump_timer.start()
+
+
+def dump_cache():
+    """Saves the answers cache now, if new answers weren't saved yet."""
+    global _dump_timer
+    with _dump_lock:
+        timer, _dump_timer = _dump_timer, None
+    if timer is None:
+        return
+    timer.cancel()
+    try:
+        answers_cache.dump(CHAT_CACHE_PATH)
+    except OSError as error:
+        logger.warning("Saving the chat cache failed: %s", error)
+
+
+# Answers collected for the next dump aren't lost on exit
+atexit.register(dump_cache)
+
+
+def _release(key: Optional[str], answer: dict = None, error=None):
+    """Passes a streamed answer to waiters of the question, if any."""
+    if key is not None:
+        _in_flight.release(key, answer, error=error)
+
+
+def _count_prompt(chat_id: int, prompt: str):
+    """Counts tokens of a prompt sent to the API, cached answers aren't."""
+    if chat_id is not None:
+        get_memory().count_prompt(prompt)
+
+
+def _remember(chat_id: int, text: str, answer: str):
+    if chat_id is not None:
+        get_memory().add_turn(chat_id, text, answer)
+
+
+def _count_cached(answer: dict, counter: str):
+    with _stats_lock:
+        _cache_stats[counter] += 1
+        _cache_stats["tokens_saved"] += answer["tokens"]
+        _cache_stats["latency_saved"] += answer["latency"]
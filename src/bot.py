@@ -15,11 +15,15 @@ The bot can help with:
 Commands: 
 /commit - Display last commit
 /commits - Display N commits
+/find - Find commits by SHA or text
 /issue - Create an issue 
+/issues - Create several issues, one per line
 /ping - Ping the website
 /sinfo - Info about the server
 /jinfo - Info about Jenkins jobs
 /c - [/chat] Speak with AI 
+/reset - Start a new conversation with AI
+/stats - Latency and errors of the bot (admins)
 /help - Bot information  
 
 The bot uses:
@@ -30,21 +34,74 @@ The bot uses:
 
 """
 import functools
+import itertools
+import logging
 import os
-import requests
+import re
+import threading
+import time
+from typing import Iterable, List, Tuple
+from urllib.parse import urlparse
+
+# Startup time is measured from here to the start of polling
+STARTED_AT = time.perf_counter()
 
 import telebot
-from telebot import types
+from telebot import custom_filters, types
+from telebot.handler_backends import State, StatesGroup
 from telebot.util import extract_arguments
+from jenkinsapi.custom_exceptions import UnknownJob
+from requests import RequestException
 
-from aichat import get_answer
+import logs
+import metrics
+from aichat import (
+    get_answer,
+    get_cache_stats,
+    get_memory,
+    get_message,
+    stream_answer,
+)
 from config import (
     TELEGRAM_TOKEN,
+    TELEGRAM_API_URL,
     TELEGRAM_CHAT_ID as CHAT_ID,
+    TELEGRAM_NUM_THREADS,
+    TELEGRAM_WEBHOOK_URL,
+    TELEGRAM_ADMIN_IDS,
+    METRICS_HOST,
+    METRICS_PORT,
+    LOG_LEVEL,
+    LOG_DEBUG_SAMPLE_RATE,
+    LOG_QUEUE_SIZE,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    GITHUB_WEBHOOK_SECRET,
+    GITHUB_WEBHOOK_PATH,
+    GITHUB_PUSH_DELAY,
+    COMMITS_PAGING,
+    COMMITS_PER_MESSAGE,
+    PING_URL,
+    PING_INTERVAL,
+    PING_HISTORY,
+    PING_SLOW_THRESHOLD,
+    PING_ALERT_AFTER,
+    OPENAI_STREAM,
+    STATE_STORAGE,
+    STATES_DB_PATH,
+    DIALOG_TTL,
     CI_JOB,
     CD_JOB,
     BLUE_OCEAN_DASHBOARD_PATH,
+    REPO_OWNER,
+    REPO_NAME,
+    TENANTS_PATH,
+    BUILD_POLL_MIN_INTERVAL,
+    BUILD_POLL_MAX_INTERVAL,
     JENKINS_HOST,
+    MEDIA_DB_PATH,
+    SERVER_INFO_IMAGE_PATH,
     SERVER_INFO_1,
     SERVER_INFO_2,
     SERVER_INFO_3,
@@ -52,11 +109,63 @@ from config import (
     SERVER_INFO_5,
     SERVER_INFO_6,
 )
-from formatters import format_commit
-from github import get_commits, create_issue as create_issue_api
-from jenkins import build_job, get_job_details
-from callback import form_callback_query, get_data
+from buildwatch import BuildWatcher
+from formatters import (
+    format_commit,
+    format_health,
+    format_issue_results,
+    format_stats,
+)
+from media import MediaCache
+from resilience import CircuitOpenError, get_breakers
+from monitor import HealthMonitor
+from scheduler import BuildRequest, BuildScheduler
+from sender import Sender
+from states import create_state_storage
+from tenants import Tenant, TenantRegistry
+from webhook import Push, PushDispatcher, UpdateDispatcher, WebhookServer
+from github import (
+    session as github_session,
+    get_commits,
+    get_commit_details,
+    get_indexed_commits,
+    sync_commits,
+    index_pushed_commits,
+    create_issue as create_issue_api,
+    create_issues as create_issues_api,
+    find_commits as find_commits_api,
+)
+from jenkins import (
+    get_builds,
+    get_job_details,
+    get_job_status,
+    get_queue_ids,
+    invoke_job,
+)
+from callback import CallbackDispatcher, form_callback_query
+
+
+# Logs of all modules are JSON lines written by a background thread
+logs.setup_logging(LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE, LOG_QUEUE_SIZE)
+# Errors of telebot are logged as JSON too, not by its own handler
+telebot.logger.removeHandler(telebot.console_output_handler)
+logger = logging.getLogger(__name__)
 
+# Telegram limit of a message text length
+MESSAGE_MAX_LENGTH = 4096
+# A max number of paged commits, it's packed into 2 bytes of callback data
+MAX_PAGED_COMMITS = 0xFFFF
+# A max number of issues created by one `/issues`
+MAX_BULK_ISSUES = 100
+# A label of an issue in a line of `/issues`, e.g. `#bug`
+ISSUE_LABEL_RE = re.compile(r"(?<!\S)#([\w-]+)")
+# A length of a streamed answer message after which it's continued
+# in a new message
+STREAM_MESSAGE_LENGTH = 4000
+# Min seconds between edits of a streamed answer (group chats allow
+# 20 messages and edits per minute)
+STREAM_EDIT_INTERVAL = 3
+STREAM_PLACEHOLDER = "..."
 
 TEXT_MESSAGES = {
     "welcome": str(
@@ -72,11 +181,15 @@ TEXT_MESSAGES = {
         "Commands:\n"
         "/commit - Display last commit\n"
         "/commits - Display N commits\n"
+        "/find - Find commits by SHA or text\n"
         "/issue - Create an issue\n"
+        "/issues - Create several issues, one per line\n"
         "/ping - Ping the website\n"
         "/sinfo - Info about the server\n"
         "/jinfo - Info about Jenkins jobs\n"
         "/c - [/chat] Speak to AI\n"
+        "/reset - Start a new conversation with AI\n"
+        "/stats - Latency and errors of the bot (admins)\n"
         "/help - Bot information"
     ),
     "wrong_chat": str(
@@ -107,18 +220,101 @@ TEXT_MESSAGES = {
     ),
 }
 
+# A max length of a photo caption (without HTML tags)
+CAPTION_MAX_LENGTH = 1024
+
+# The server info is sent as a caption of the photo if it fits, in one request
+SERVER_INFO_AS_CAPTION = (
+    len(re.sub(r"<[^>]+>", "", TEXT_MESSAGES["server_info"]))
+    <= CAPTION_MAX_LENGTH
+)
+
 
 if "TELEGRAM_TOKEN" not in os.environ or "TELEGRAM_CHAT_ID" not in os.environ:
     raise AssertionError(
         "Please configure TELEGRAM_TOKEN and TELEGRAM_CHAT_ID as environment variables"
     )
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = (
+        TELEGRAM_API_URL.rstrip("/") + "/file/bot{0}/{1}"
+    )
+
+# Handlers are executed by a pool of worker threads, the polling thread only
+# receives updates. Blocking requests to GitHub, Jenkins and OpenAI run
+# concurrently and a long `/c` doesn't delay a `Build` button press.
+# In the webhook mode handlers are executed by the webhook workers.
+# Dialog states are kept in the memory or in an SQLite file shared by
+# several bot processes.
+bot = telebot.TeleBot(
+    TELEGRAM_TOKEN,
+    threaded=not TELEGRAM_WEBHOOK_URL,
+    num_threads=TELEGRAM_NUM_THREADS,
+    state_storage=create_state_storage(
+        STATE_STORAGE, STATES_DB_PATH, DIALOG_TTL
+    ),
+)
+bot.add_custom_filter(custom_filters.StateFilter(bot))
+# All requests to Telegram, GitHub, Jenkins and OpenAI are measured
+metrics.instrument_telegram()
+# All messages are sent through the sender to stay within the flood limits
+sender = Sender(bot)
+# Images are uploaded once, then sent by their Telegram file ids
+media_cache = MediaCache(MEDIA_DB_PATH)
+# Requested builds are followed in the background and their messages are
+# edited with the progress and the result
+build_watcher = BuildWatcher(
+    get_builds,
+    sender.edit_message_text,
+    min_interval=BUILD_POLL_MIN_INTERVAL,
+    max_interval=BUILD_POLL_MAX_INTERVAL,
+    fetch_queue=get_queue_ids,
+)
+# The website is checked in the background, `/ping` answers from the history
+health_monitor = HealthMonitor(
+    PING_URL,
+    interval=PING_INTERVAL,
+    size=PING_HISTORY,
+    slow_threshold=PING_SLOW_THRESHOLD,
+    alert_after=PING_ALERT_AFTER,
+    alert=lambda text: sender.send_message(CHAT_ID, text),
+)
+# Button presses are dispatched by an action of the callback data with
+# one lookup, see `callback`
+callbacks = CallbackDispatcher()
+bot.register_callback_query_handler(callbacks.dispatch, func=lambda cb: True)
+# Duplicate requests of a build are merged, requests to a busy job wait
+build_scheduler = BuildScheduler(
+    get_job_status, invoke_job, build_watcher, sender.edit_message_text
+)
+
+
+# The team chat configured by the environment variables
+DEFAULT_TENANT = Tenant(
+    "default",
+    CHAT_ID,
+    (REPO_OWNER, REPO_NAME),
+    CD_JOB,
+    CI_JOB,
+    BLUE_OCEAN_DASHBOARD_PATH or "",
+)
+# Team chats of several projects can be served by one bot, see `tenants`
+tenants = (
+    TenantRegistry.load(TENANTS_PATH, DEFAULT_TENANT)
+    if TENANTS_PATH
+    else TenantRegistry([DEFAULT_TENANT])
+)
 
 
 def is_api_group(chat_id: int) -> bool:
-    """Check is a chat id equals to the team group chat id."""
-    return chat_id == CHAT_ID
+    """Check is a chat id is a team group chat id of a tenant."""
+    return tenants.get(chat_id) is not None
+
+
+def get_tenant(chat_id: int) -> Tenant:
+    """Returns a tenant of a chat, the default one if the chat is unknown."""
+    return tenants.get(chat_id) or DEFAULT_TENANT
 
 
 def check_group_chat(fn):
@@ -132,24 +328,25 @@ def check_group_chat(fn):
         if is_api_group(message.chat.id):
             return fn(message, *args, **kwargs)
         else:
-            bot.send_message(message.chat.id, TEXT_MESSAGES["wrong_chat"])
+            sender.send_message(message.chat.id, TEXT_MESSAGES["wrong_chat"])
 
     return wrapper
 
 
 @bot.message_handler(commands=["start"])
 def welcome(message):
-    bot.send_message(message.chat.id, TEXT_MESSAGES["welcome"])
+    sender.send_message(message.chat.id, TEXT_MESSAGES["welcome"])
     if not is_api_group(message.chat.id):
-        bot.send_message(message.chat.id, TEXT_MESSAGES["wrong_chat"])
+        sender.send_message(message.chat.id, TEXT_MESSAGES["wrong_chat"])
 
 
 @bot.message_handler(commands=["ping"])
 @check_group_chat
 def ping_website(message):
-    """Checks the status code of the NoteD website."""
-    res = requests.get("https://welel-noted.site", timeout=7)
-    bot.send_message(message.chat.id, "Status code: " + str(res.status_code))
+    """Sends the state of the NoteD website from the health monitor."""
+    sender.send_message(
+        message.chat.id, format_health(health_monitor.get_report())
+    )
 
 
 @bot.message_handler(commands=["commit"])
@@ -169,13 +366,15 @@ def display_commits(message):
     """
     num_commits = extract_arguments(message.text)
     if not num_commits:
-        bot.send_message(message.chat.id, "Usage - /commits [number commits].")
+        sender.send_message(
+            message.chat.id, "Usage - /commits [number commits]."
+        )
         return
 
     try:
         num_commits = int(num_commits)
     except ValueError:
-        bot.send_message(message.chat.id, "Invalid value.")
+        sender.send_message(message.chat.id, "Invalid value.")
         return
 
     display_commits_handler(message, number=num_commits)
@@ -184,100 +383,464 @@ def display_commits(message):
 def display_commits_handler(message, number: int = 1):
     """Sends last commits with inline buttons.
 
-    Displays commit information - comment, hash.
+    If `COMMITS_PAGING` is set, the commits are shown in one message with
+    Prev/Next buttons, see `send_paged_commits`.
+
+    Args:
+        number: a number of commits.
+    """
+    tenant = get_tenant(message.chat.id)
+    try:
+        commits = get_commits(num=number, repo=tenant.repo)
+        if COMMITS_PAGING and number > COMMITS_PER_MESSAGE:
+            send_paged_commits(commits, number, tenant)
+        else:
+            send_commits(commits, tenant)
+    except Exception:
+        sender.send_message(
+            message.chat.id, "An error has occurred, try later."
+        )
+        logger.exception("Sending commits failed")
+
+
+def send_commits(commits: Iterable[dict], tenant: Tenant):
+    """Sends commits with inline buttons to the team chat.
+
+    Commits are packed by `COMMITS_PER_MESSAGE` into one message, which
+    has a row of buttons for each commit.
+    Displays commit information - comment, hash, author, date, diffstat
+    and CI status. Details of commits of a message are requested by one
+    query.
     Buttons:
         1. Starts a Jenkins job to build this commit in the prodaction.
         2. Starts a Jenkins job to test the project.
         3. Url to the GitHub commit.
 
     Args:
-        number: a number of commits.
+        commits: an iterable of dicts with commit info.
+        tenant: a tenant of the commits, they are sent to its chat.
     """
-    try:
-        commits = get_commits(num=number)
-    except Exception as error:
-        bot.send_message(message.chat.id, "An error has occurred, try later.")
-        print(error)
-    for i, commit in enumerate(commits):
-        commit_msg = format_commit(commit, nn=i + 1)
-        kb = types.InlineKeyboardMarkup(row_width=2)
+    # Commits are sent while the next pages are still downloading
+    group, sent = [], 0
+    for commit in commits:
+        group.append(commit)
+        if len(group) >= COMMITS_PER_MESSAGE:
+            _send_commits_group(group, sent, tenant)
+            sent += len(group)
+            group = []
+    if group:
+        _send_commits_group(group, sent, tenant)
+
+
+def _send_commits_group(commits: List[dict], sent: int, tenant: Tenant):
+    """Sends a group of commits with their details, `sent` commits before
+    them are already sent."""
+    details = get_commit_details(
+        [commit["sha"] for commit in commits], repo=tenant.repo
+    )
+    page = []
+    for i, commit in enumerate(commits, start=sent + 1):
+        commit_msg = format_page_commit(
+            commit, i, details.get(commit["sha"])
+        )
+        page_len = sum(len(msg) + 2 for _, msg, _ in page)
+        if page and page_len + len(commit_msg) > MESSAGE_MAX_LENGTH:
+            send_commits_page(page, tenant.chat_id)
+            page = []
+        page.append((i, commit_msg, commit))
+    if page:
+        send_commits_page(page, tenant.chat_id)
+
+
+def format_page_commit(
+    commit: dict, nn: int, details: dict = None, limit: int = None
+) -> str:
+    """Formats a commit of a page, a too long message of the commit is
+    truncated, so the commit fits into `limit` characters (a Telegram
+    message by default)."""
+    if limit is None:
+        limit = MESSAGE_MAX_LENGTH
+    commit_msg = format_commit(commit, nn=nn, details=details)
+    excess = len(commit_msg) - limit
+    if excess > 0:
+        comment = commit["comment"]
+        comment = comment[: max(len(comment) - excess - 1, 0)] + "…"
+        commit_msg = format_commit(
+            dict(commit, comment=comment), nn=nn, details=details
+        )
+    return commit_msg
+
+
+def send_paged_commits(commits: Iterable[dict], number: int, tenant: Tenant):
+    """Sends the first page of commits with Prev/Next buttons.
+
+    The page is sent as soon as its commits are read, older commits are
+    requested by `commits_page_handler` when their page is shown.
+
+    Args:
+        commits: commits from the newest, they are indexed while read.
+        number: a requested number of commits.
+        tenant: a tenant of the commits.
+    """
+    # One more commit shows whether there is the next page
+    page = list(itertools.islice(commits, COMMITS_PER_MESSAGE + 1))
+    if not page:
+        return
+    total = min(number, MAX_PAGED_COMMITS)
+    if len(page) <= COMMITS_PER_MESSAGE:
+        # The history is shorter than requested
+        total = len(page)
+    page = page[:COMMITS_PER_MESSAGE]
+    text, kb = format_commits_page(page, 0, total, tenant)
+    sender.send_message(
+        tenant.chat_id, text, parse_mode="HTML", reply_markup=kb
+    )
+
+
+def format_commits_page(
+    commits: List[dict], offset: int, total: int, tenant: Tenant
+) -> Tuple[str, types.InlineKeyboardMarkup]:
+    """Formats a page of commits and its buttons with Prev/Next buttons.
+
+    Commits which don't fit into a message are left to the next page.
+
+    Args:
+        commits: commits of the page.
+        offset: a number of newer commits before the page.
+        total: a number of all commits of the pages.
+        tenant: a tenant of the commits.
+
+    Returns:
+        A text and a keyboard of the message.
+    """
+    details = get_commit_details(
+        [commit["sha"] for commit in commits], repo=tenant.repo
+    )
+    header = "<b>Commits {}-{} of {}</b>"
+    # The length of the header with the longest numbers
+    header_len = page_len = len(header.format(total, total, total))
+    page = []
+    for i, commit in enumerate(commits, start=offset + 1):
+        commit_msg = format_page_commit(
+            commit,
+            i,
+            details.get(commit["sha"]),
+            limit=MESSAGE_MAX_LENGTH - header_len - 2,
+        )
+        page_len += len(commit_msg) + 2
+        if page and page_len > MESSAGE_MAX_LENGTH:
+            break
+        page.append((i, commit_msg, commit))
+    end = offset + len(page)
+    text = "\n\n".join(
+        [header.format(offset + 1, end, total)]
+        + [msg for _, msg, _ in page]
+    )
+    kb = get_commits_keyboard(page)
+    nav = []
+    if offset > 0:
+        data = "%04x%04x" % (max(offset - COMMITS_PER_MESSAGE, 0), total)
+        nav.append(
+            types.InlineKeyboardButton(
+                text="◀ Prev",
+                callback_data=form_callback_query("commits_page", data),
+            )
+        )
+    if end < total:
+        data = "%04x%04x" % (end, total)
+        nav.append(
+            types.InlineKeyboardButton(
+                text="Next ▶",
+                callback_data=form_callback_query("commits_page", data),
+            )
+        )
+    if nav:
+        kb.row(*nav)
+    return text, kb
+
+
+def get_commits_keyboard(page: List[tuple]) -> types.InlineKeyboardMarkup:
+    """Returns buttons of commits of a page, a row for each commit.
+
+    Args:
+        page: a list of tuples (a serial number, a formatted commit, commit).
+    """
+    kb = types.InlineKeyboardMarkup(row_width=3)
+    # Buttons are numbered only if there are several commits in the message
+    suffix = (lambda nn: f" {nn}") if len(page) > 1 else (lambda nn: "")
+    for nn, _, commit in page:
         data_build = form_callback_query("build_commit", commit["sha"])
         data_test = form_callback_query("build_test", commit["sha"])
         kb.add(
-            types.InlineKeyboardButton(text="Build", callback_data=data_build),
-            types.InlineKeyboardButton(text="Test", callback_data=data_test),
-            types.InlineKeyboardButton(text="Details", url=commit["url"]),
+            types.InlineKeyboardButton(
+                text="Build" + suffix(nn), callback_data=data_build
+            ),
+            types.InlineKeyboardButton(
+                text="Test" + suffix(nn), callback_data=data_test
+            ),
+            types.InlineKeyboardButton(
+                text="Details" + suffix(nn), url=commit["url"]
+            ),
         )
-        bot.send_message(
-            CHAT_ID, commit_msg, parse_mode="HTML", reply_markup=kb
+    return kb
+
+
+def send_commits_page(page: List[tuple], chat_id: int, header: str = None):
+    """Sends one message with several commits and their buttons.
+
+    Args:
+        page: a list of tuples (a serial number, a formatted commit, commit).
+        chat_id: a chat id.
+        header: a text before the commits (optional).
+    """
+    kb = get_commits_keyboard(page)
+    text = "\n\n".join(msg for _, msg, _ in page)
+    sender.send_message(
+        chat_id,
+        f"{header}\n\n{text}" if header else text,
+        parse_mode="HTML",
+        reply_markup=kb,
+    )
+
+
+def send_pushed_commits(pushes: List[Push]):
+    """Indexes commits of a burst of pushes and posts them in one message
+    to each chat of the repository.
+
+    The last `COMMITS_PER_MESSAGE` commits are shown with their buttons.
+    Pushes to repositories without tenants are skipped.
+    """
+    by_repo = {}
+    for push in pushes:
+        by_repo.setdefault(push.repo, []).append(push)
+    for repo, repo_pushes in by_repo.items():
+        repo_tenants = tenants.by_repo(repo) if repo else [DEFAULT_TENANT]
+        if repo_tenants:
+            send_repo_pushes(repo_tenants, repo_pushes)
+
+
+def send_repo_pushes(repo_tenants: List[Tenant], pushes: List[Push]):
+    """Indexes pushes to a repository and posts them to its tenants."""
+    repo = repo_tenants[0].repo
+    commits, seen = [], set()
+    for push in pushes:
+        index_pushed_commits(
+            push.before, push.commits, forced=push.forced, repo=repo
+        )
+    for push in reversed(pushes):
+        for commit in push.commits:
+            if commit["sha"] not in seen:
+                seen.add(commit["sha"])
+                commits.append(commit)
+    if not commits:
+        return
+    pushers = ", ".join(sorted({p.pusher for p in pushes if p.pusher}))
+    header = f"<b>{len(commits)} new commit(s)</b>"
+    header += f" pushed by {pushers}" if pushers else ""
+    if len(commits) > COMMITS_PER_MESSAGE:
+        header += f", the last {COMMITS_PER_MESSAGE} are shown"
+    commits = commits[:COMMITS_PER_MESSAGE]
+    details = get_commit_details(
+        [commit["sha"] for commit in commits], repo=repo
+    )
+    page, page_len = [], len(header)
+    for i, commit in enumerate(commits):
+        commit_msg = format_page_commit(
+            commit,
+            i + 1,
+            details.get(commit["sha"]),
+            limit=MESSAGE_MAX_LENGTH - len(header) - 2,
         )
+        page_len += len(commit_msg) + 2
+        if page and page_len > MESSAGE_MAX_LENGTH:
+            break
+        page.append((i + 1, commit_msg, commit))
+    for tenant in repo_tenants:
+        send_commits_page(page, tenant.chat_id, header=header)
 
 
-@bot.callback_query_handler(func=lambda cb: cb.data.startswith("build_commit"))
-def build_commit_handler(callback):
+@bot.message_handler(commands=["find"])
+@check_group_chat
+def find_commits(message):
+    """Finds commits by a SHA prefix or a text of the commit message.
+
+    Telegram usage:
+        /find 57d968d
+        /find fix icons
+    """
+    query = extract_arguments(message.text)
+    if not query:
+        sender.send_message(message.chat.id, "Usage - /find [sha or text].")
+        return
+    tenant = get_tenant(message.chat.id)
+    commits = find_commits_api(query, repo=tenant.repo)
+    if not commits:
+        sender.send_message(message.chat.id, "No commits found.")
+        return
+    send_commits(commits, tenant)
+
+
+@callbacks.handler("commits_page")
+def commits_page_handler(callback, data: str):
+    """Handles the Prev/Next buttons of paged commits, the message is
+    edited with the page.
+
+    Commits are taken from the index, older commits which aren't indexed
+    yet are requested. Newer commits pushed meanwhile shift the pages.
+    """
+    offset, total = int(data[:4], 16), int(data[4:8], 16)
+    tenant = get_tenant(callback.message.chat.id)
+    num = min(COMMITS_PER_MESSAGE, total - offset)
+    # One more commit shows whether there is the next page
+    wanted = min(num + 1, total - offset)
+    commits = get_indexed_commits(offset, wanted, repo=tenant.repo)
+    if len(commits) < wanted:
+        commits = list(
+            itertools.islice(
+                get_commits(num=offset + wanted, repo=tenant.repo),
+                offset,
+                None,
+            )
+        )
+    if not commits:
+        return
+    if len(commits) < wanted:
+        # The history is shorter than requested
+        total = offset + len(commits)
+    commits = commits[:num]
+    text, kb = format_commits_page(commits, offset, total, tenant)
+    sender.edit_message_text(
+        text,
+        callback.message.chat.id,
+        callback.message.message_id,
+        parse_mode="HTML",
+        reply_markup=kb,
+    )
+
+
+@callbacks.handler("build_commit")
+def build_commit_handler(callback, commit_hash: str):
     """Handles the `Build` button of a commit, starts the Jenkins job.
 
     If a `Build` button was pressed starts the Jenkins job that builds
     the provided commit to the prodaction.
     """
-    commit_hash = get_data(callback.data)
-    msg = build_job(CD_JOB, COMMIT_HASH=commit_hash)
-    msg = f"Build for {commit_hash} has requested." if msg == "build" else msg
-    kb = types.InlineKeyboardMarkup(row_width=1)
-    blue_ocean_url = JENKINS_HOST + BLUE_OCEAN_DASHBOARD_PATH
-    kb.add(types.InlineKeyboardButton(text="Blue Ocean", url=blue_ocean_url))
-    bot.send_message(CHAT_ID, msg, reply_markup=kb)
+    tenant = get_tenant(callback.message.chat.id)
+    request_build(
+        tenant, tenant.cd_job, commit_hash, f"Build for {commit_hash}"
+    )
 
 
-@bot.callback_query_handler(func=lambda cb: cb.data.startswith("build_test"))
-def build_test_handler(callback):
+@callbacks.handler("build_test")
+def build_test_handler(callback, commit_hash: str):
     """Handles the `Test` button of a commtt, starts the Jenkins job.
 
     If a `Test` button was pressed starts the Jenkins job that tests
     the provided commit for the prodaction.
     """
-    commit_hash = get_data(callback.data)
-    msg = build_job(CI_JOB, COMMIT_HASH=commit_hash)
-    msg = f"Tests for {commit_hash} has requested." if msg == "build" else msg
+    tenant = get_tenant(callback.message.chat.id)
+    request_build(
+        tenant, tenant.ci_job, commit_hash, f"Tests for {commit_hash}"
+    )
+
+
+def request_build(tenant: Tenant, job: str, commit_hash: str, title: str):
+    """Requests a build of a commit, see `scheduler`.
+
+    The message "{title} has requested." is edited with the build progress
+    and the result, see `buildwatch`. If the job is busy, the build waits
+    until the job is free.
+
+    Args:
+        tenant: a tenant which chat requested the build.
+        job: a job path.
+        commit_hash: a commit to build.
+        title: a title of the build, e.g. "Build for {commit_hash}".
+    """
+    chat_id = tenant.chat_id
+    blue_ocean_url = JENKINS_HOST + tenant.blue_ocean_path
+    blue_ocean = types.InlineKeyboardButton(
+        text="Blue Ocean", url=blue_ocean_url
+    )
     kb = types.InlineKeyboardMarkup(row_width=1)
-    blue_ocean_url = JENKINS_HOST + BLUE_OCEAN_DASHBOARD_PATH
-    kb.add(types.InlineKeyboardButton(text="Blue Ocean", url=blue_ocean_url))
-    bot.send_message(CHAT_ID, msg, reply_markup=kb)
+    kb.add(blue_ocean)
+    sent_msg = sender.send_message(
+        chat_id, f"{title} has requested.", reply_markup=kb
+    )
+    request = BuildRequest(
+        job, commit_hash, chat_id, sent_msg.message_id, title, [blue_ocean]
+    )
+    try:
+        status = build_scheduler.request(request)
+    except UnknownJob as error:
+        logger.warning("Unknown job: %s", error, extra={"job": job})
+        msg = "Unknown job path."
+    except CircuitOpenError as error:
+        logger.warning("Build is skipped: %s", error, extra={"job": job})
+        msg = "Jenkins is unavailable, try later."
+    except Exception:
+        logger.exception("Requesting a build failed", extra={"job": job})
+        msg = "An error has occurred, try later."
+    else:
+        if status == "started":
+            return
+        msg = {
+            "merged": f"{title} is already requested.",
+            "queued": f"{title} is queued, it starts when the job is free.",
+        }[status]
+    sender.edit_message_text(
+        msg, chat_id, sent_msg.message_id, reply_markup=kb
+    )
+
+
+class IssueStates(StatesGroup):
+    """States of the dialog for creating an issue."""
+
+    title = State()
+    body = State()
+    label = State()
 
 
 @bot.message_handler(commands=["issue"])
 @check_group_chat
 def create_issue(message):
-    """Starts dialog for creating an issue to the GitHub repository."""
-    sent_msg = bot.send_message(message.chat.id, "Write an issue title...")
-    bot.register_next_step_handler(sent_msg, process_issue_title_step)
+    """Starts dialog for creating an issue to the GitHub repository.
+
+    A step of the dialog is a state of the user in the chat, see `states`.
+    """
+    sender.send_message(message.chat.id, "Write an issue title...")
+    bot.set_state(message.from_user.id, IssueStates.title, message.chat.id)
 
 
+@bot.message_handler(state=IssueStates.title)
 def process_issue_title_step(message):
     title = message.text
     if not title:
-        bot.send_message(CHAT_ID, "Invalid title...")
+        sender.send_message(message.chat.id, "Invalid title...")
+        bot.delete_state(message.from_user.id, message.chat.id)
         return
     kb = types.ReplyKeyboardMarkup(
         one_time_keyboard=True, resize_keyboard=True
     )
     kb.add("Skip")
-    sent_msg = bot.send_message(
-        CHAT_ID,
+    sender.send_message(
+        message.chat.id,
         "Write the issue text...",
         reply_markup=kb,
         reply_to_message_id=message.message_id,
     )
-    bot.register_next_step_handler(sent_msg, process_issue_body_step, title)
+    bot.set_state(message.from_user.id, IssueStates.body, message.chat.id)
+    bot.add_data(message.from_user.id, message.chat.id, title=title)
 
 
-def process_issue_body_step(message, title):
+@bot.message_handler(state=IssueStates.body)
+def process_issue_body_step(message):
     kb = types.ReplyKeyboardMarkup(
         one_time_keyboard=True, resize_keyboard=True
     )
     kb.add("bug", "feat", "docs", "refactor", "devops", "check", "Skip")
-    sent_msg = bot.send_message(
-        CHAT_ID,
+    sender.send_message(
+        message.chat.id,
         "Choose the issue label...",
         reply_markup=kb,
         reply_to_message_id=message.message_id,
@@ -285,29 +848,112 @@ def process_issue_body_step(message, title):
     body = message.text
     if body == "Skip":
         body = ""
-    bot.register_next_step_handler(
-        sent_msg, process_issue_label_step, title, body
-    )
+    bot.set_state(message.from_user.id, IssueStates.label, message.chat.id)
+    bot.add_data(message.from_user.id, message.chat.id, body=body)
 
 
-def process_issue_label_step(message, title, body):
+@bot.message_handler(state=IssueStates.label)
+def process_issue_label_step(message):
+    with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
+        # None if the dialog has expired meanwhile or its data is lost
+        data = dict(data or {})
+    bot.delete_state(message.from_user.id, message.chat.id)
+    if "title" not in data or "body" not in data:
+        sender.send_message(
+            message.chat.id,
+            "The /issue dialog has expired, start it again with /issue.",
+            reply_markup=types.ReplyKeyboardRemove(),
+        )
+        return
+    title, body = data["title"], data["body"]
     # Remove the reply keyboard
-    bot.send_message(
-        CHAT_ID,
+    sender.send_message(
+        message.chat.id,
         "Creating the issue...",
         reply_markup=types.ReplyKeyboardRemove(),
     )
     label = message.text
     label = [] if label == "Skip" else [label]
-    issue_url = create_issue_api(title, body, label)
+    repo = get_tenant(message.chat.id).repo
+    issue_url = create_issue_api(title, body, label, repo=repo)
     if issue_url:
         kb = types.InlineKeyboardMarkup(row_width=1)
         kb.add(types.InlineKeyboardButton(text="Details", url=issue_url))
-        bot.send_message(
-            CHAT_ID, "The issue created successfully.", reply_markup=kb
+        sender.send_message(
+            message.chat.id,
+            "The issue created successfully.",
+            reply_markup=kb,
         )
     else:
-        bot.send_message(CHAT_ID, "The issue is not created.")
+        sender.send_message(message.chat.id, "The issue is not created.")
+
+
+def parse_issues(text: str) -> List[dict]:
+    """Parses issues of `/issues`, one per line.
+
+    A line is a title, an optional body after `|` and labels as hashtags,
+    e.g. `Fix icons | Icons are blurry #bug #ui`.
+
+    Returns:
+        A list of dicts with keys "title", "body" and "labels".
+    """
+    issues = []
+    for line in text.splitlines():
+        labels = ISSUE_LABEL_RE.findall(line)
+        title, _, body = ISSUE_LABEL_RE.sub("", line).partition("|")
+        title = " ".join(title.split())
+        if title:
+            issues.append(
+                {"title": title, "body": body.strip(), "labels": labels}
+            )
+    return issues
+
+
+@bot.message_handler(commands=["issues"])
+@check_group_chat
+def create_issues(message):
+    """Creates several issues at once and sends one summary.
+
+    Telegram usage:
+        /issues
+        Fix icons | Icons are blurry #bug
+        Describe the webhook mode #docs
+    """
+    issues = parse_issues(extract_arguments(message.text) or "")
+    if not issues:
+        sender.send_message(
+            message.chat.id,
+            "Usage - /issues and an issue per line: "
+            "title | text #label.",
+        )
+        return
+    if len(issues) > MAX_BULK_ISSUES:
+        sender.send_message(
+            message.chat.id, f"Up to {MAX_BULK_ISSUES} issues at once."
+        )
+        return
+    sent_msg = sender.send_message(
+        message.chat.id, f"Creating {len(issues)} issues..."
+    )
+    results = create_issues_api(
+        issues, repo=get_tenant(message.chat.id).repo
+    )
+    summary = format_issue_results(results)
+    chunks = telebot.util.smart_split(summary, MESSAGE_MAX_LENGTH)
+    sender.edit_message_text(
+        chunks[0],
+        message.chat.id,
+        sent_msg.message_id,
+        parse_mode="HTML",
+        disable_web_page_preview=True,
+    )
+    for chunk in chunks[1:]:
+        sender.send_message(
+            message.chat.id,
+            chunk,
+            parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
 
 
 # c: 1 - in EN, 2 - in RU [short from chat]
@@ -320,17 +966,102 @@ def chatbot(message):
         /chat [message]
     """
     text = extract_arguments(message.text)
-    ai_answer = get_answer(text)
-    bot.send_message(message.chat.id, ai_answer)
+    tenant = get_tenant(message.chat.id)
+    settings = {"params": tenant.openai_params, "preamble": tenant.preamble}
+    if OPENAI_STREAM:
+        send_streamed_answer(
+            message.chat.id, stream_answer(text, message.chat.id, **settings)
+        )
+    else:
+        sender.send_message(
+            message.chat.id, get_answer(text, message.chat.id, **settings)
+        )
+
+
+@bot.message_handler(commands=["reset"])
+@check_group_chat
+def reset_chat(message):
+    """Makes the chatbot forget the conversation of the chat.
+
+    Telegram usage:
+        /reset
+    """
+    get_memory().clear(message.chat.id)
+    sender.send_message(message.chat.id, "The conversation is forgotten.")
+
+
+def send_streamed_answer(chat_id: int, chunks: Iterable[str]):
+    """Sends an answer, which is edited in place while chunks arrive.
+
+    A placeholder message is sent at once and edited with the received
+    text no more often than every `STREAM_EDIT_INTERVAL` seconds (the first
+    chunk is shown at once). When the text gets close to the Telegram
+    message length limit, the answer is continued in a new message, which
+    is sent when its text arrives. If the answer is empty, the placeholder
+    is replaced with a refusal.
+
+    Telegram rejects an edit which doesn't change the text (surrounding
+    whitespaces are ignored), such edits are skipped.
+
+    Args:
+        chat_id: a chat to send the answer.
+        chunks: an iterable of answer text parts.
+    """
+    sent_msg = sender.send_message(chat_id, STREAM_PLACEHOLDER)
+    answer, shown, edited_at = "", STREAM_PLACEHOLDER, 0.0
+    for chunk in chunks:
+        answer += chunk
+        if len(answer) > STREAM_MESSAGE_LENGTH:
+            # Split by the last line or word break before the limit
+            cut = max(
+                answer.rfind("\n", 0, STREAM_MESSAGE_LENGTH),
+                answer.rfind(" ", 0, STREAM_MESSAGE_LENGTH),
+            )
+            cut = cut if cut > 0 else STREAM_MESSAGE_LENGTH
+            head = answer[:cut].strip()
+            if head and head != shown.strip():
+                sender.edit_message_text(head, chat_id, sent_msg.message_id)
+            answer = answer[cut:].lstrip()
+            sent_msg, shown = None, ""
+        if sent_msg is None:
+            if answer.strip():
+                sent_msg = sender.send_message(chat_id, answer)
+                shown, edited_at = answer, time.monotonic()
+        elif (
+            answer.strip()
+            and answer.strip() != shown.strip()
+            and time.monotonic() - edited_at >= STREAM_EDIT_INTERVAL
+        ):
+            sender.edit_message_text(answer, chat_id, sent_msg.message_id)
+            shown, edited_at = answer, time.monotonic()
+    if sent_msg is None:
+        return
+    if not answer.strip():
+        # Only the first message is sent without text
+        sender.edit_message_text(
+            get_message("nobother"), chat_id, sent_msg.message_id
+        )
+    elif answer.strip() != shown.strip():
+        sender.edit_message_text(answer, chat_id, sent_msg.message_id)
 
 
 @bot.message_handler(commands=["sinfo"])
 @check_group_chat
 def send_server_info(message):
     """Sends information about server data and infrastructure."""
-    image = open("imgs/infra.jpeg", "rb")
-    bot.send_photo(message.chat.id, image)
-    bot.send_message(
+    if SERVER_INFO_AS_CAPTION:
+        media_cache.send_photo(
+            sender.send_photo,
+            message.chat.id,
+            SERVER_INFO_IMAGE_PATH,
+            caption=TEXT_MESSAGES["server_info"],
+            parse_mode="HTML",
+        )
+        return
+    media_cache.send_photo(
+        sender.send_photo, message.chat.id, SERVER_INFO_IMAGE_PATH
+    )
+    sender.send_message(
         message.chat.id, TEXT_MESSAGES["server_info"], parse_mode="HTML"
     )
 
@@ -338,17 +1069,143 @@ def send_server_info(message):
 @bot.message_handler(commands=["jinfo"])
 @check_group_chat
 def send_jenkins_jobs_info(message):
-    """Sends information about jenkins jobs."""
-    jobs_info = get_job_details()
-    bot.send_message(message.chat.id, jobs_info)
+    """Sends information about jenkins jobs.
+
+    While Jenkins is unavailable, the last received information is sent.
+    """
+    try:
+        jobs_info = get_job_details()
+    except RequestException as error:
+        logger.warning("Jenkins jobs are unavailable: %s", error)
+        jobs_info = "Jenkins is unavailable, try later."
+    sender.send_message(message.chat.id, jobs_info)
 
 
 @bot.message_handler(commands=["help"])
 @check_group_chat
 def send_help_info(message):
     """Sends information about the bot - (description, commands)."""
-    bot.send_message(message.chat.id, TEXT_MESSAGES["help"])
+    sender.send_message(message.chat.id, TEXT_MESSAGES["help"])
 
 
-if __name__ == "__main__":
+@bot.message_handler(commands=["stats"])
+@check_group_chat
+def send_stats(message):
+    """Sends latency and errors of handlers and external calls."""
+    if TELEGRAM_ADMIN_IDS and message.from_user.id not in TELEGRAM_ADMIN_IDS:
+        sender.send_message(message.chat.id, "Only for admins.")
+        return
+    stats = format_stats(
+        metrics.summarize(metrics.HANDLER_SECONDS, metrics.HANDLER_ERRORS),
+        metrics.summarize(metrics.OUTBOUND_SECONDS, metrics.OUTBOUND_ERRORS),
+        {
+            "GitHub": github_session.get_stats(),
+            "Chat cache": get_cache_stats(),
+            "Chat memory": get_memory().get_stats(),
+            "Builds": dict(build_scheduler.stats, **build_watcher.stats),
+            **{
+                "Circuit " + breaker.name: breaker.get_stats()
+                for breaker in get_breakers()
+            },
+        },
+    )
+    sender.send_message(message.chat.id, stats)
+
+
+# Latency, errors and calls in flight of every handler are measured
+metrics.instrument_bot(bot)
+for action, handler in callbacks.handlers.items():
+    callbacks.handlers[action] = metrics.instrument_handler(handler)
+# Every update is logged with a correlation id, the chat and the command
+logs.instrument_bot(bot)
+
+
+def warm_up():
+    """Creates GitHub and Jenkins clients and connects in the background.
+
+    The bot starts polling without waiting for the warm-up, so a slow or
+    unavailable backend slows down only its own commands.
+    """
+    for name, warm_up_fn in (
+        ("GitHub", sync_commits),
+        ("Jenkins", get_job_details),
+    ):
+        threading.Thread(
+            target=warm_up_backend, args=(name, warm_up_fn), daemon=True
+        ).start()
+
+
+def warm_up_backend(name: str, warm_up_fn):
+    start = time.perf_counter()
+    try:
+        warm_up_fn()
+    except Exception as error:
+        logger.warning("%s warm-up failed: %s", name, error)
+        return
+    logger.info(
+        "%s is warmed up",
+        name,
+        extra={"duration_ms": round((time.perf_counter() - start) * 1000)},
+    )
+
+
+def log_started():
+    logger.info(
+        "Started",
+        extra={
+            "duration_ms": round((time.perf_counter() - STARTED_AT) * 1000, 1)
+        },
+    )
+
+
+def run_webhook():
+    """Receives updates by the webhook server instead of long polling."""
+    server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT)
+    dispatcher = UpdateDispatcher(
+        bot, secret_token=WEBHOOK_SECRET, workers=TELEGRAM_NUM_THREADS
+    )
+    server.route(urlparse(TELEGRAM_WEBHOOK_URL).path or "/", dispatcher)
+    route_github_pushes(server)
+    bot.set_webhook(
+        url=TELEGRAM_WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=TELEGRAM_NUM_THREADS,
+    )
+    log_started()
+    server.serve_forever()
+
+
+def route_github_pushes(server: WebhookServer):
+    """Receives GitHub push webhooks on the server if they are configured."""
+    if GITHUB_WEBHOOK_SECRET:
+        server.route(
+            GITHUB_WEBHOOK_PATH,
+            PushDispatcher(
+                send_pushed_commits,
+                GITHUB_WEBHOOK_SECRET,
+                delay=GITHUB_PUSH_DELAY,
+            ),
+        )
+
+
+def run_polling():
+    # Updates can't be polled while a webhook is set
+    bot.remove_webhook()
+    if GITHUB_WEBHOOK_SECRET:
+        # Only GitHub pushes are received by the webhook server
+        server = WebhookServer(WEBHOOK_HOST, WEBHOOK_PORT)
+        route_github_pushes(server)
+        server.start()
+    log_started()
     bot.infinity_polling()
+
+
+if __name__ == "__main__":
+    warm_up()
+    health_monitor.start()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+    if TELEGRAM_WEBHOOK_URL:
+        run_webhook()
+    else:
+        run_polling()
@@ -0,0 +1,336 @@
+"""A module with a watcher of Jenkins builds requested from the chat.
+
+The message of a requested build ("Build for ... has requested.") is edited
+in place while the build is queued, running and when it's finished, so
+nobody has to refresh Jenkins by hand.
+
+One background thread watches all builds. Every cycle it requests the last
+builds of all jobs with one Jenkins API call (see `jenkins.get_builds`) and
+finds a watched build by the id of its queue item. The polling interval is
+doubled, up to the max, while no build changes its state, and is reset to
+the min when a build is watched or changes its state. While a build hasn't
+started, the Jenkins queue is requested too: a build whose queue item is
+gone without a build (e.g. it was cancelled) is not watched anymore.
+
+Messages are edited by another thread, so waiting for the flood limits of
+a chat doesn't delay polling. Only the last text of a message is sent,
+intermediate texts which didn't make it in time are dropped.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from telebot import types
+
+
+logger = logging.getLogger(__name__)
+
+
+# A number of last builds of a job requested besides the watched ones
+BUILDS_PER_JOB = 5
+# Seconds after which a build is not watched anymore
+WATCH_TIMEOUT = 6 * 60 * 60
+# A width of the progress bar of a running build
+PROGRESS_WIDTH = 10
+# A number of polls in a row a queue item is gone without a build, after
+# which the build is considered cancelled. An item leaves the queue a bit
+# before its build is listed.
+MISSING_POLLS = 2
+
+# Returns the last `num` builds of all jobs by a job full name
+FetchBuilds = Callable[[int], Dict[str, List[dict]]]
+# Returns ids of the queue items
+FetchQueue = Callable[[], Set[int]]
+
+
+def format_duration(seconds: float) -> str:
+    """Formats seconds as `m:ss` (or `h:mm:ss`)."""
+    minutes, seconds = divmod(int(max(seconds, 0)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%d:%02d:%02d" % (hours, minutes, seconds)
+    return "%d:%02d" % (minutes, seconds)
+
+
+class Watch:
+    """A build requested from the chat and its message."""
+
+    def __init__(
+        self,
+        job: str,
+        queue_id: int,
+        chat_id: Optional[int],
+        message_id: Optional[int],
+        title: str,
+        buttons: Iterable[types.InlineKeyboardButton] = (),
+        on_finish: Callable[[], None] = None,
+    ):
+        self.job = job
+        self.queue_id = queue_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.title = title
+        self.buttons = list(buttons)
+        self.on_finish = on_finish
+        self.created = time.time()
+        # "queued", "running", "finished" or "cancelled"
+        self.state = "queued"
+        # A number of polls in a row the queue item is gone without a build
+        self.missing = 0
+        self.text = None
+
+
+class BuildWatcher:
+    """Follows requested Jenkins builds and edits their messages.
+
+    Attrs:
+        interval: seconds until the next poll.
+        stats: counters - polls, failed polls and message edits.
+    """
+
+    def __init__(
+        self,
+        fetch_builds: FetchBuilds,
+        edit_message: Callable,
+        min_interval: float = 2,
+        max_interval: float = 30,
+        fetch_queue: FetchQueue = None,
+    ):
+        """
+        Args:
+            fetch_builds: requests the last builds of all jobs.
+            edit_message: edits a message, has the signature of
+                          `TeleBot.edit_message_text`.
+            min_interval: min seconds between polls.
+            max_interval: max seconds between polls.
+            fetch_queue: requests ids of the queue items, without it a build
+                         which never started is watched until the timeout.
+        """
+        self.fetch_builds = fetch_builds
+        self.fetch_queue = fetch_queue
+        self.edit_message = edit_message
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.stats = {"polls": 0, "errors": 0, "edits": 0}
+        # (a job, a queue item id) -> a watch
+        self._watches: Dict[tuple, Watch] = {}
+        self._next_poll = 0.0
+        self._cond = threading.Condition()
+        # (a chat id, a message id) -> (a text, a markup) to send
+        self._edits = OrderedDict()
+        self._edits_cond = threading.Condition()
+        self._started = False
+
+    def watch(
+        self,
+        job: str,
+        queue_id: int,
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        title: str = "",
+        buttons: Iterable[types.InlineKeyboardButton] = (),
+        on_finish: Callable[[], None] = None,
+    ):
+        """Starts watching a build.
+
+        Args:
+            job: a job full name.
+            queue_id: an id of the queue item of the build.
+            chat_id: a chat of the build message.
+            message_id: the build message (None to watch without edits).
+            title: the first line of the message.
+            buttons: inline buttons kept under the message.
+            on_finish: called when the build is finished or not watched
+                       anymore.
+        """
+        watch = Watch(
+            job, queue_id, chat_id, message_id, title, buttons, on_finish
+        )
+        with self._cond:
+            self._watches[(job, queue_id)] = watch
+            self.interval = self.min_interval
+            self._next_poll = min(
+                self._next_poll, time.monotonic() + self.min_interval
+            )
+            if not self._started:
+                self._started = True
+                for target in (self._poll_loop, self._edit_loop):
+                    threading.Thread(target=target, daemon=True).start()
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+    def _poll_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    delay = self._next_poll - time.monotonic()
+                    if self._watches and delay <= 0:
+                        break
+                    self._cond.wait(delay if self._watches else None)
+            changed = self.poll()
+            with self._cond:
+                if changed:
+                    self.interval = self.min_interval
+                else:
+                    self.interval = min(self.interval * 2, self.max_interval)
+                self._next_poll = time.monotonic() + self.interval
+
+    def poll(self) -> bool:
+        """Checks all watched builds with one request.
+
+        Returns:
+            True if a build changed its state.
+        """
+        with self._cond:
+            watches = list(self._watches.values())
+        if not watches:
+            return False
+        # Enough builds to find all watched builds of a job
+        per_job = {}
+        for watch in watches:
+            per_job[watch.job] = per_job.get(watch.job, 0) + 1
+        self.stats["polls"] += 1
+        try:
+            # The queue is requested before the builds, so an item which
+            # has left it is found among the builds
+            queue_ids = None
+            if self.fetch_queue is not None and any(
+                watch.state == "queued" for watch in watches
+            ):
+                queue_ids = self.fetch_queue()
+            jobs = self.fetch_builds(BUILDS_PER_JOB + max(per_job.values()))
+        except Exception as error:
+            self.stats["errors"] += 1
+            logger.warning("Polling builds failed: %s", error)
+            return False
+
+        changed = False
+        finished = []
+        now = time.time()
+        for watch in watches:
+            build = next(
+                (
+                    build
+                    for build in jobs.get(watch.job, ())
+                    if build.get("queueId") == watch.queue_id
+                ),
+                None,
+            )
+            state = self._get_state(build)
+            if (
+                build is None
+                and queue_ids is not None
+                and watch.queue_id not in queue_ids
+            ):
+                watch.missing += 1
+                if watch.missing >= MISSING_POLLS:
+                    state = "cancelled"
+            else:
+                watch.missing = 0
+            changed = changed or state != watch.state
+            watch.state = state
+            if (
+                state in ("finished", "cancelled")
+                or now - watch.created > WATCH_TIMEOUT
+            ):
+                with self._cond:
+                    self._watches.pop((watch.job, watch.queue_id), None)
+                finished.append(watch)
+            if watch.message_id is not None:
+                self._update_message(watch, build, now)
+        for watch in finished:
+            if watch.on_finish is not None:
+                try:
+                    watch.on_finish()
+                except Exception:
+                    logger.exception(
+                        "A finish callback failed",
+                        extra={"job": watch.job, "queue_id": watch.queue_id},
+                    )
+        return changed
+
+    @staticmethod
+    def _get_state(build: Optional[dict]) -> str:
+        if build is None:
+            return "queued"
+        if build.get("building") or build.get("result") is None:
+            return "running"
+        return "finished"
+
+    def _update_message(self, watch: Watch, build: Optional[dict], now):
+        text = watch.title + "\n" + self.format_status(watch, build, now)
+        if text == watch.text:
+            return
+        watch.text = text
+        kb = types.InlineKeyboardMarkup(row_width=2)
+        buttons = list(watch.buttons)
+        if build and build.get("url"):
+            buttons.append(
+                types.InlineKeyboardButton(
+                    text="#%s" % build["number"], url=build["url"]
+                )
+            )
+        kb.add(*buttons)
+        with self._edits_cond:
+            self._edits[(watch.chat_id, watch.message_id)] = (text, kb)
+            self._edits_cond.notify()
+
+    @staticmethod
+    def format_status(watch: Watch, build: Optional[dict], now) -> str:
+        """Returns a line with the state of a build.
+
+        Example of output:
+            #12 running ▓▓▓▓░░░░░░ 40% (~3:20)
+        """
+        if build is None:
+            if watch.state == "cancelled":
+                return "The build was cancelled, see Jenkins."
+            if now - watch.created > WATCH_TIMEOUT:
+                return "The build hasn't started, see Jenkins."
+            return "Queued..."
+        number = "#%s" % build["number"]
+        started = build.get("timestamp", 0) / 1000 or now
+        if watch.state == "finished":
+            return "%s %s in %s" % (
+                number,
+                build["result"],
+                format_duration(build.get("duration", 0) / 1000),
+            )
+        if now - watch.created > WATCH_TIMEOUT:
+            return "%s is still running, see Jenkins." % number
+        estimated = (build.get("estimatedDuration") or -1) / 1000
+        if estimated <= 0:
+            return "%s running..." % number
+        # Rounded to tens of percents, so the message is edited at most
+        # `PROGRESS_WIDTH` times while the build is running
+        share = int((now - started) / estimated * PROGRESS_WIDTH)
+        share = min(share, PROGRESS_WIDTH - 1)
+        return "%s running %s %d%% (~%s)" % (
+            number,
+            "▓" * share + "░" * (PROGRESS_WIDTH - share),
+            share * 100 // PROGRESS_WIDTH,
+            format_duration(estimated),
+        )
+
+    def _edit_loop(self):
+        while True:
+            with self._edits_cond:
+                while not self._edits:
+                    self._edits_cond.wait()
+                (chat_id, message_id), (text, kb) = self._edits.popitem(
+                    last=False
+                )
+            try:
+                self.edit_message(text, chat_id, message_id, reply_markup=kb)
+                self.stats["edits"] += 1
+            except Exception as error:
+                logger.warning(
+                    "Editing a build message failed: %s",
+                    error,
+                    extra={"chat_id": chat_id, "message_id": message_id},
+                )
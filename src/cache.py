@@ -0,0 +1,154 @@
+"""A module with in-memory caches shared by the bot modules."""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """A thread-safe LRU cache which entries expire after `ttl` seconds.
+
+    When the cache is full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        """
+        Args:
+            maxsize: a max number of entries.
+            ttl: seconds an entry lives (forever if None).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # A key -> (an expiration time, a value)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns a value by the key or `default` if it's missing/expired."""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Stores a value, `ttl` overrides the cache ttl for the entry."""
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def dump(self, path: str):
+        """Saves not expired entries to a JSON file.
+
+        Keys and values should be JSON serializable, the file is replaced
+        atomically.
+        """
+        now, wall_now = time.monotonic(), time.time()
+        with self._lock:
+            items = [
+                [key, None if exp is None else wall_now + exp - now, value]
+                for key, (exp, value) in self._data.items()
+                if exp is None or exp > now
+            ]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._dump_lock:
+            with open(path + ".tmp", "w") as file:
+                json.dump(items, file)
+            os.replace(path + ".tmp", path)
+
+    def load(self, path: str):
+        """Loads not expired entries saved by `dump`, if the file exists."""
+        try:
+            with open(path) as file:
+                items = json.load(file)
+        except (OSError, ValueError):
+            return
+        now, wall_now = time.monotonic(), time.time()
+        with self._lock:
+            for key, wall_expires, value in items:
+                if wall_expires is None:
+                    self._data[key] = (None, value)
+                elif wall_expires > wall_now:
+                    self._data[key] = (now + wall_expires - wall_now, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+class RequestCoalescer:
+    """Shares one call between concurrent requests with the same key.
+
+    The first request of a key (the leader) makes the call, requests with
+    the same key that arrive while the call is in flight wait for its result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable) -> Tuple[Future, bool]:
+        """Returns a future of the call result and True if it's the leader.
+
+        The leader must pass the result to `release`.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def release(
+        self, key: Hashable, result: Any = None, error: Exception = None
+    ):
+        """Passes a result (or an error) of the leader call to the waiters."""
+        with self._lock:
+            future = self._calls.pop(key)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def call(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Calls `fn` or waits for the call in flight with the same key.
+
+        Returns:
+            A tuple (a result, True if the result is shared from another call).
+        """
+        future, is_leader = self.acquire(key)
+        if not is_leader:
+            return future.result(), True
+        try:
+            result = fn()
+        except Exception as error:
+            self.release(key, error=error)
+            raise
+        self.release(key, result)
+        return result, False
@@ -1,19 +1,72 @@
-"""A module for formatting callback data and queries."""
+"""A module for formatting callback data and queries.
 
+Telegram limits callback data of a button to 64 bytes. Callback data is
+packed into a compact binary form encoded with base64url:
+    1 byte - a version of the format,
+    1 byte - an action code (see `ACTIONS`),
+    data - a hex string packed into bytes (e.g. 20 bytes of a commit SHA).
+
+A callback query is dispatched to the handler of its action with one dict
+lookup, see `CallbackDispatcher`.
+
+Buttons of messages sent before the compact format have data
+`{action}$%^{data}`, it's still accepted.
+"""
+import base64
+import binascii
+from typing import Callable, Dict, Optional, Tuple
+
+from logs import bind
+
+# A separator of the legacy format
 SEP = "$%^"
+VERSION = 1
+# Action names by codes, a code of an action must never change
+ACTIONS = {
+    1: "build_commit",
+    2: "build_test",
+    3: "commits_page",
+}
+ACTION_CODES = {name: code for code, name in ACTIONS.items()}
 
 
 def form_callback_query(callback_name: str, data: str) -> str:
     """Formats data for use in a callback button.
 
     Args:
-        callback_name: The name of the callback to be used.
-        data: The data to be passed to the callback.
+        callback_name: The name of the callback to be used (an action
+            from `ACTIONS`).
+        data: The data to be passed to the callback (a hex string, e.g.
+            a SHA).
 
     Returns:
         str: A string formatted for use in a callback button.
     """
-    return SEP.join([callback_name, data])
+    raw = bytes((VERSION, ACTION_CODES[callback_name])) + bytes.fromhex(data)
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def parse_callback_query(callback_query: str) -> Optional[Tuple[str, str]]:
+    """Gets an action and data from a `callback_query`.
+
+    Args:
+        callback_query: A string representing a callback query.
+
+    Returns:
+        A tuple (an action, data) or None if the query is not recognized.
+    """
+    if SEP in callback_query:
+        action, _, data = callback_query.partition(SEP)
+        return action, data
+    try:
+        raw = base64.urlsafe_b64decode(
+            callback_query + "=" * (-len(callback_query) % 4)
+        )
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) < 2 or raw[0] != VERSION or raw[1] not in ACTIONS:
+        return None
+    return ACTIONS[raw[1]], raw[2:].hex()
 
 
 def get_data(callback_query: str) -> str:
@@ -25,5 +78,46 @@ def get_data(callback_query: str) -> str:
     Returns:
         str: The data associated with the callback query.
     """
-    data = callback_query.split(SEP)
-    return SEP.join(data[1:])
+    parsed = parse_callback_query(callback_query)
+    return parsed[1] if parsed else ""
+
+
+class CallbackDispatcher:
+    """Dispatches callback queries to handlers by an action.
+
+    Usage:
+        callbacks = CallbackDispatcher()
+
+        @callbacks.handler("build_commit")
+        def build_commit_handler(callback, commit_hash): ...
+
+        bot.register_callback_query_handler(
+            callbacks.dispatch, func=lambda cb: True
+        )
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, Callable] = {}
+
+    def handler(self, action: str):
+        """Registers a handler of an action.
+
+        A handler gets a callback query and its data.
+        """
+
+        def decorator(fn):
+            self.handlers[action] = fn
+            return fn
+
+        return decorator
+
+    def dispatch(self, callback):
+        """Calls the handler of the callback query action, if any."""
+        parsed = parse_callback_query(callback.data or "")
+        if parsed is None:
+            return
+        action, data = parsed
+        bind(action=action)
+        handler = self.handlers.get(action)
+        if handler is not None:
+            handler(callback, data)
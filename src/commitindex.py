@@ -0,0 +1,166 @@
+"""A module with a local persistent index of repository commits.
+
+Commits are stored in an SQLite database, so the index survives restarts
+and is queried without loading the whole history into memory. Every commit
+has a sequence number `seq`: newer commits have greater numbers. Commits
+newer than the newest indexed one are added with `add_newer`, history older
+than the oldest indexed one is backfilled with `add_older`.
+
+A commit is represented as a dict with keys "sha", "comment" and "url", as
+returned by `github.get_commits`.
+"""
+import os
+import sqlite3
+import threading
+from typing import Iterator, List, Optional
+
+
+# A number of rows read from the database at once while iterating commits
+FETCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    sha TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL UNIQUE,
+    comment TEXT NOT NULL,
+    url TEXT NOT NULL
+);
+"""
+
+
+class CommitIndex:
+    """A persistent index of commits of one repository."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: a path to the SQLite database file, `:memory:` is allowed.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def count(self) -> int:
+        """Returns a number of indexed commits."""
+        return self._query("SELECT COUNT(*) FROM commits")[0][0]
+
+    def newest_sha(self) -> Optional[str]:
+        """Returns the SHA of the newest indexed commit."""
+        rows = self._query("SELECT sha FROM commits ORDER BY seq DESC LIMIT 1")
+        return rows[0][0] if rows else None
+
+    def oldest_sha(self) -> Optional[str]:
+        """Returns the SHA of the oldest indexed commit."""
+        rows = self._query("SELECT sha FROM commits ORDER BY seq ASC LIMIT 1")
+        return rows[0][0] if rows else None
+
+    def add_newer(self, commits: List[dict]):
+        """Adds commits that are newer than all indexed commits.
+
+        Args:
+            commits: a list of commits ordered from the newest to the oldest.
+        """
+        with self._lock, self._conn:
+            top = self._conn.execute("SELECT MAX(seq) FROM commits")
+            top = top.fetchone()[0]
+            # Sequence numbers of backfilled commits can be 0 or negative
+            if top is None:
+                top = 0
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?)",
+                [
+                    (c["sha"], top + len(commits) - i, c["comment"], c["url"])
+                    for i, c in enumerate(commits)
+                ],
+            )
+
+    def add_older(self, commits: List[dict]):
+        """Adds commits that are older than all indexed commits.
+
+        Args:
+            commits: a list of commits ordered from the newest to the oldest.
+        """
+        with self._lock, self._conn:
+            bottom = self._conn.execute("SELECT MIN(seq) FROM commits")
+            bottom = bottom.fetchone()[0]
+            if bottom is None:
+                bottom = 1
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?)",
+                [
+                    (c["sha"], bottom - i - 1, c["comment"], c["url"])
+                    for i, c in enumerate(commits)
+                ],
+            )
+
+    def clear(self):
+        """Removes all commits from the index."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM commits")
+
+    def latest(self, num: int) -> Iterator[dict]:
+        """Iterates over the last `num` commits, from the newest.
+
+        Rows are read in chunks of `FETCH_SIZE`, so a large `num` doesn't
+        load all commits into memory.
+        """
+        last_seq = None
+        while num > 0:
+            limit = min(num, FETCH_SIZE)
+            if last_seq is None:
+                rows = self._query(
+                    "SELECT seq, sha, comment, url FROM commits "
+                    "ORDER BY seq DESC LIMIT ?",
+                    (limit,),
+                )
+            else:
+                rows = self._query(
+                    "SELECT seq, sha, comment, url FROM commits "
+                    "WHERE seq < ? ORDER BY seq DESC LIMIT ?",
+                    (last_seq, limit),
+                )
+            if not rows:
+                return
+            for row in rows:
+                yield _to_commit(row)
+            last_seq = rows[-1][0]
+            num -= len(rows)
+
+    def find_by_sha(self, prefix: str, limit: int = 10) -> List[dict]:
+        """Returns commits which SHA starts with `prefix`, from the newest."""
+        prefix = prefix.lower()
+        # SHA is a hex string, so all SHAs with the prefix are less than
+        # the prefix with appended "g", the range is resolved by the index.
+        return [
+            _to_commit(row)
+            for row in self._query(
+                "SELECT seq, sha, comment, url FROM commits "
+                "WHERE sha >= ? AND sha < ? ORDER BY seq DESC LIMIT ?",
+                (prefix, prefix + "g", limit),
+            )
+        ]
+
+    def search(self, text: str, limit: int = 10) -> List[dict]:
+        """Returns commits which message contains `text`, from the newest."""
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%")
+        pattern = "%" + pattern.replace("_", "\\_") + "%"
+        return [
+            _to_commit(row)
+            for row in self._query(
+                "SELECT seq, sha, comment, url FROM commits "
+                "WHERE comment LIKE ? ESCAPE '\\' ORDER BY seq DESC LIMIT ?",
+                (pattern, limit),
+            )
+        ]
+
+
+def _to_commit(row: tuple) -> dict:
+    _, sha, comment, url = row
+    return {"sha": sha, "comment": comment, "url": url}
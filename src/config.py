@@ -13,15 +13,96 @@ from dotenv import load_dotenv
 load_dotenv()
 
 BASE_PATH = Path(__file__).resolve().parent.parent
-RESOURCES_PATH = os.path.join(BASE_PATH, "resources/")
+RESOURCES_PATH = os.getenv(
+    "RESOURCES_PATH", os.path.join(BASE_PATH, "resources/")
+)
+# A local index of the repository commits (SQLite)
+COMMITS_DB_PATH = os.path.join(RESOURCES_PATH, "commits.sqlite3")
+# Telegram file ids of uploaded images (SQLite), so they aren't uploaded again
+MEDIA_DB_PATH = os.path.join(RESOURCES_PATH, "media.sqlite3")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+# A url of the Bot API server, e.g. a local `telegram-bot-api` server or
+# a stub (https://api.telegram.org if empty)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 # TELEGRAM_CHAT_ID (int)
 TELEGRAM_CHAT_ID = int(os.getenv("TELEGRAM_CHAT_ID"))
+# A number of worker threads that run handlers concurrently, so a slow
+# GitHub, Jenkins or OpenAI call doesn't block other commands.
+TELEGRAM_NUM_THREADS = int(os.getenv("TELEGRAM_NUM_THREADS", 8))
+# A public url of the webhook (e.g. https://bot.example.com/telegram),
+# if it is set, updates are received by the webhook server, not by polling
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# A storage of dialog states ("memory" or "sqlite") and seconds after which
+# an abandoned dialog (e.g. `/issue`) expires
+STATE_STORAGE = os.getenv("STATE_STORAGE", "memory")
+STATES_DB_PATH = os.path.join(RESOURCES_PATH, "states.sqlite3")
+DIALOG_TTL = int(os.getenv("DIALOG_TTL", 60 * 60))
+# Ids of users allowed to use admin commands (`/stats`), comma separated,
+# if empty, all members of the team chat are allowed
+TELEGRAM_ADMIN_IDS = [
+    int(user_id)
+    for user_id in os.getenv("TELEGRAM_ADMIN_IDS", "").split(",")
+    if user_id.strip()
+]
+# A local address of the `/metrics` endpoint (disabled if the port is 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+# Logs are JSON lines written to stderr by a background thread: a level,
+# a share of debug records which are kept (e.g. every outbound call) and
+# a max number of records waiting to be written (the rest are dropped)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.01))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# A number of commits packed into one message of `/commits`
+COMMITS_PER_MESSAGE = int(os.getenv("COMMITS_PER_MESSAGE", 5))
+# Show `/commits` in one message with Prev/Next buttons instead of sending
+# all commits in several messages
+COMMITS_PAGING = os.getenv("COMMITS_PAGING", "false").lower() == "true"
+# The website checked by `/ping` in the background: seconds between checks,
+# a number of checks kept in the history, seconds of a slow response and
+# a number of failed or slow checks in a row after which an alert is sent
+PING_URL = os.getenv("PING_URL", "https://welel-noted.site")
+PING_INTERVAL = int(os.getenv("PING_INTERVAL", 60))
+PING_HISTORY = int(os.getenv("PING_HISTORY", 24 * 60))
+PING_SLOW_THRESHOLD = float(os.getenv("PING_SLOW_THRESHOLD", 3))
+PING_ALERT_AFTER = int(os.getenv("PING_ALERT_AFTER", 3))
+
+# Seconds to wait for a backend to connect and to respond, and circuit
+# breakers: after a number of failed calls in a row the backend isn't
+# called for some seconds, calls fail fast with a cached or degraded answer
+GITHUB_TIMEOUT = float(os.getenv("GITHUB_TIMEOUT", 10))
+JENKINS_TIMEOUT = float(os.getenv("JENKINS_TIMEOUT", 10))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_GRAPHQL_URL = os.getenv(
+    "GITHUB_GRAPHQL_URL", GITHUB_API_URL + "/graphql"
+)
+# Commits are shown with an author, a date, a diffstat and a CI status,
+# which are requested by one GraphQL query and cached for this number of
+# commits (0 disables the details)
+COMMIT_DETAILS_CACHE_SIZE = int(os.getenv("COMMIT_DETAILS_CACHE_SIZE", 1000))
+# GitHub push webhooks (enabled if the secret is set) are received on this
+# path of the webhook server, pushes in `GITHUB_PUSH_DELAY` seconds are
+# posted in one message
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET")
+GITHUB_WEBHOOK_PATH = os.getenv("GITHUB_WEBHOOK_PATH", "/github")
+GITHUB_PUSH_DELAY = float(os.getenv("GITHUB_PUSH_DELAY", 5))
+# A max number of concurrent writes (e.g. issues of `/issues`), GitHub
+# limits concurrent content creation by secondary rate limits
+GITHUB_WRITE_CONCURRENCY = int(os.getenv("GITHUB_WRITE_CONCURRENCY", 4))
 REPO_OWNER = os.getenv("REPO_OWNER")
 REPO_NAME = os.getenv("REPO_NAME")
+# A JSON file with tenants - team chats of other projects with their
+# repositories, Jenkins jobs and OpenAI settings, see `tenants`
+TENANTS_PATH = os.getenv("TENANTS_PATH")
 
 JENKINS_HOST = os.getenv("JENKINS_HOST")
 JENKINS_USERNAME = os.getenv("JENKINS_USERNAME")
@@ -31,10 +112,34 @@ CD_JOB = os.getenv("CD_JOB")
 # A pipline with Docker, Django, HTTP, PostgreSQL tests.
 CI_JOB = os.getenv("CI_JOB")
 BLUE_OCEAN_DASHBOARD_PATH = os.getenv("BLUE_OCEAN_DASHBOARD_PATH")
+# Min and max seconds between polls of Jenkins for requested builds, the
+# interval grows from min to max while builds don't change their state
+BUILD_POLL_MIN_INTERVAL = float(os.getenv("BUILD_POLL_MIN_INTERVAL", 2))
+BUILD_POLL_MAX_INTERVAL = float(os.getenv("BUILD_POLL_MAX_INTERVAL", 30))
 
 OPENAI_KEY = os.getenv("OPENAI_KEY")
+# A url of the OpenAI API (the `openai` default if empty)
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")
+# Stream `/c` answers by editing the message while tokens are generated
+OPENAI_STREAM = os.getenv("OPENAI_STREAM", "true").lower() == "true"
+# A cache of `/c` answers: a max number of answers, seconds an answer lives
+# and a path to a JSON file to persist answers (not persisted if empty)
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", 256))
+CHAT_CACHE_TTL = int(os.getenv("CHAT_CACHE_TTL", 24 * 60 * 60))
+CHAT_CACHE_PATH = os.getenv(
+    "CHAT_CACHE_PATH", os.path.join(RESOURCES_PATH, "chat_cache.json")
+)
+# `/c` conversation memory: a number of last turns kept for a chat,
+# seconds after the last turn a conversation is over (questions are cached
+# only out of conversations) and a max number of tokens of a prompt with
+# the history
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", 20))
+CHAT_HISTORY_TTL = int(os.getenv("CHAT_HISTORY_TTL", 10 * 60))
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 1500))
+CONVERSATIONS_DB_PATH = os.path.join(RESOURCES_PATH, "conversations.sqlite3")
 
 # Server information for `sinfo` command
+SERVER_INFO_IMAGE_PATH = os.path.join(BASE_PATH, "imgs/infra.jpeg")
 SERVER_INFO_1 = os.getenv("SERVER_INFO_1")
 SERVER_INFO_2 = os.getenv("SERVER_INFO_2")
 SERVER_INFO_3 = os.getenv("SERVER_INFO_3")
@@ -0,0 +1,219 @@
+"""A module with per-chat conversation memory of the chatbot.
+
+Turns (a question and an answer) are stored in an SQLite database, so the
+history survives restarts. Only the last `max_turns` turns of a chat are
+kept, in memory they are loaded lazily on the first message of a chat into
+a bounded ring buffer, and only for the last `max_chats` active chats.
+A conversation idle for `ttl` seconds is over: its turns aren't used
+anymore, the next question starts a new conversation.
+
+A prompt is built from the preamble, as many last turns as fit into the
+token budget and the new question, older turns are dropped. Tokens are
+counted with `tiktoken` if it's installed, otherwise estimated.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Tuple
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS turns_chat_id ON turns (chat_id, id);
+"""
+
+_encoding = tiktoken.get_encoding("p50k_base") if tiktoken else None
+
+
+def count_tokens(text: str) -> int:
+    """Returns a number of tokens of a text for the `text-davinci-003` model.
+
+    Without `tiktoken` a number is estimated as ~4 characters per token.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+class ConversationMemory:
+    """Conversation histories of chats.
+
+    Attrs:
+        stats: prompt tokens counters - a number of prompts sent to the API
+               (see `count_prompt`), the total, the last and the max number
+               of prompt tokens.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_turns: int = 20,
+        max_chats: int = 100,
+        ttl: float = None,
+    ):
+        """
+        Args:
+            path: a path to the SQLite database file, `:memory:` is allowed.
+            max_turns: a number of last turns kept for a chat.
+            max_chats: a number of chats which histories are kept in memory.
+            ttl: seconds after the last turn a conversation is over (never
+                 if None).
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_turns = max_turns
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._histories = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "prompts": 0,
+            "prompt_tokens_total": 0,
+            "prompt_tokens_last": 0,
+            "prompt_tokens_max": 0,
+        }
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+            columns = [
+                row[1]
+                for row in self._conn.execute("PRAGMA table_info(turns)")
+            ]
+            if "created" not in columns:
+                # Turns saved before conversations expired are over
+                self._conn.execute(
+                    "ALTER TABLE turns "
+                    "ADD COLUMN created REAL NOT NULL DEFAULT 0"
+                )
+
+    def _get_history(self, chat_id: int) -> Deque[Tuple[str, str, float]]:
+        """Returns turns of a chat (a question, an answer, a time), loads
+        them on the first call."""
+        history = self._histories.get(chat_id)
+        if history is None:
+            rows = self._conn.execute(
+                "SELECT question, answer, created FROM turns "
+                "WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                (chat_id, self.max_turns),
+            ).fetchall()
+            history = deque(reversed(rows), maxlen=self.max_turns)
+            self._histories[chat_id] = history
+            if len(self._histories) > self.max_chats:
+                self._histories.popitem(last=False)
+        self._histories.move_to_end(chat_id)
+        return history
+
+    def _get_turns(self, chat_id: int) -> List[Tuple[str, str]]:
+        """Returns turns of the current conversation of a chat, must be
+        called under the lock."""
+        turns, later = [], time.time()
+        for question, answer, created in reversed(self._get_history(chat_id)):
+            if self.ttl is not None and later - created > self.ttl:
+                # An idle gap, older turns are of a previous conversation
+                break
+            turns.append((question, answer))
+            later = created
+        return turns[::-1]
+
+    def add_turn(self, chat_id: int, question: str, answer: str):
+        """Appends a turn to a chat history."""
+        created = time.time()
+        with self._lock:
+            self._get_history(chat_id).append((question, answer, created))
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO turns (chat_id, question, answer, created) "
+                    "VALUES (?, ?, ?, ?)",
+                    (chat_id, question, answer, created),
+                )
+                self._conn.execute(
+                    "DELETE FROM turns WHERE chat_id = ? AND id <= ("
+                    "SELECT id FROM turns WHERE chat_id = ? "
+                    "ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (chat_id, chat_id, self.max_turns),
+                )
+
+    def has_history(self, chat_id: int) -> bool:
+        """Checks if a chat has a conversation which isn't over."""
+        with self._lock:
+            return bool(self._get_turns(chat_id))
+
+    def clear(self, chat_id: int):
+        """Removes a chat history."""
+        with self._lock, self._conn:
+            self._histories.pop(chat_id, None)
+            self._conn.execute(
+                "DELETE FROM turns WHERE chat_id = ?", (chat_id,)
+            )
+
+    def build_prompt(
+        self, chat_id: int, preamble: str, question: str, budget: int
+    ) -> str:
+        """Builds a prompt with the last turns of the current conversation
+        of a chat within a budget.
+
+        Example of output:
+            {preamble}You: {question 1}
+            Marv: {answer 1}
+            You: {question}
+            Marv:
+
+        Args:
+            chat_id: a chat id.
+            preamble: a text at the beginning of the prompt.
+            question: a new question.
+            budget: a max number of tokens in the prompt (the preamble and
+                    the question are always included).
+
+        Returns:
+            A prompt for the completion.
+        """
+        tail = "You: %s\nMarv:" % question
+        tokens = count_tokens(preamble) + count_tokens(tail)
+        turns = []
+        with self._lock:
+            history = self._get_turns(chat_id)
+        for turn_question, turn_answer in reversed(history):
+            turn = "You: %s\nMarv: %s\n" % (
+                turn_question,
+                turn_answer.strip(),
+            )
+            turn_tokens = count_tokens(turn)
+            if tokens + turn_tokens > budget:
+                break
+            turns.append(turn)
+            tokens += turn_tokens
+        return preamble + "".join(reversed(turns)) + tail
+
+    def count_prompt(self, prompt: str):
+        """Counts tokens of a prompt which a completion was requested for."""
+        tokens = count_tokens(prompt)
+        with self._lock:
+            self.stats["prompts"] += 1
+            self.stats["prompt_tokens_total"] += tokens
+            self.stats["prompt_tokens_last"] = tokens
+            self.stats["prompt_tokens_max"] = max(
+                self.stats["prompt_tokens_max"], tokens
+            )
+
+    def get_stats(self) -> dict:
+        """Returns prompt tokens counters with an average per prompt."""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["prompt_tokens_avg"] = stats["prompt_tokens_total"] / (
+            stats["prompts"] or 1
+        )
+        return stats
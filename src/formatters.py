@@ -1,16 +1,32 @@
 """Utils for formatting messages."""
+import html
+import time
+from typing import Dict, List
 
 
-def format_commit(commit: dict, nn: int = None) -> str:
+# Icons of combined CI states of a commit
+CHECK_STATE_ICONS = {
+    "SUCCESS": "✅",
+    "FAILURE": "❌",
+    "ERROR": "❌",
+    "PENDING": "⏳",
+    "EXPECTED": "⏳",
+}
+
+
+def format_commit(commit: dict, nn: int = None, details: dict = None) -> str:
     """Formats commit to html string message.
 
     Example of output:
         [<b>1.</b> ] fix: fixed bugs with icons.
         <b>SHA</b>: 57d968d84591e1514d8b40f326e934602df39133
+        [welel, 2023-03-01 14:05 | 3 files +10 -2 | ✅ CI]
 
     Args:
         commit: a json representation of the commit.
         nn: a serial number of the commit (optional).
+        details: details of the commit from `github.get_commit_details`
+                 (optional).
 
     Returns:
         A formatted string of a commit.
@@ -19,4 +35,165 @@ def format_commit(commit: dict, nn: int = None) -> str:
     output += "{comment}\n<b>SHA</b>: {sha}".format(
         comment=commit["comment"], sha=commit["sha"]
     )
+    details = format_commit_details(details) if details else ""
+    if details:
+        output += "\n" + details
     return output
+
+
+def format_commit_details(details: dict) -> str:
+    """Formats an author, a date, a diffstat and a CI status of a commit."""
+    parts = []
+    author = html.escape(details.get("author") or "")
+    date = (details.get("date") or "")[:16].replace("T", " ")
+    if author or date:
+        parts.append(", ".join(part for part in (author, date) if part))
+    if details.get("additions") is not None:
+        files = details.get("files")
+        parts.append(
+            (f"{files} files " if files is not None else "")
+            + f"+{details['additions']} -{details['deletions']}"
+        )
+    status = details.get("status")
+    if status:
+        parts.append(f"{CHECK_STATE_ICONS.get(status, '')} CI".strip())
+    return " | ".join(parts)
+
+
+def format_duration(seconds: float) -> str:
+    """Formats seconds as `2d 3h`, `3h 15m` or `15m`."""
+    minutes = int(seconds) // 60
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+def format_health(report: dict) -> str:
+    """Formats a health report of the website to a message.
+
+    Example of output:
+        https://welel-noted.site - 200 OK, checked 12 s ago
+        Latency: p50 0.21 s, p95 0.48 s
+        DNS 4 ms, connect 21 ms, TLS 63 ms, first byte 118 ms
+        Uptime: 99.93% for 23h 59m (1440 checks)
+
+    Args:
+        report: a report of `HealthMonitor.get_report`.
+
+    Returns:
+        A formatted string of the report.
+    """
+    last = report["last"]
+    if last.ok:
+        status = f"{last.status} OK"
+    elif last.status is not None:
+        status = f"status code {last.status}"
+    else:
+        status = f"no response ({last.error})"
+    output = "{url} - {status}, checked {ago} s ago\n".format(
+        url=report["url"], status=status, ago=int(time.time() - last.time)
+    )
+    if report["p50"] is not None:
+        output += "Latency: p50 {:.2f} s, p95 {:.2f} s\n".format(
+            report["p50"], report["p95"]
+        )
+        phases = [
+            "{} {:.0f} ms".format(name, report[phase] * 1000)
+            for phase, name in (
+                ("dns", "DNS"),
+                ("connect", "connect"),
+                ("tls", "TLS"),
+                ("ttfb", "first byte"),
+            )
+            if report[phase] is not None
+        ]
+        output += ", ".join(phases) + "\n"
+    output += "Uptime: {:.2f}% for {} ({} checks)".format(
+        report["uptime"] * 100,
+        format_duration(report["period"]),
+        report["probes"],
+    )
+    return output
+
+
+def format_stats(
+    handlers: List[dict], outbound: List[dict], counters: Dict[str, dict]
+) -> str:
+    """Formats stats of handlers, external calls and counters to a message.
+
+    Example of output:
+        Handlers (calls, errors, avg, p95):
+        chatbot: 12, 0, 2.310 s, 4.800 s
+
+        External calls (calls, errors, avg, p95):
+        openai completion: 10, 1, 2.100 s, 4.700 s
+
+        GitHub: requests 120, not_modified 80, latency_avg 0.12
+
+    Args:
+        handlers: stats of handlers (see `metrics.summarize`).
+        outbound: stats of external calls (see `metrics.summarize`).
+        counters: a title -> a dict of counters.
+
+    Returns:
+        A formatted string of the stats.
+    """
+
+    def format_row(item: dict) -> str:
+        return "{}: {}, {}, {:.3f} s, {:.3f} s".format(
+            " ".join(item["labels"].values()),
+            item["calls"],
+            int(item["errors"]),
+            item["avg"],
+            item["p95"],
+        )
+
+    sections = []
+    for title, items in (
+        ("Handlers", handlers),
+        ("External calls", outbound),
+    ):
+        rows = [format_row(item) for item in items] or ["no calls yet"]
+        sections.append(
+            "%s (calls, errors, avg, p95):\n%s" % (title, "\n".join(rows))
+        )
+    for title, values in counters.items():
+        values = ", ".join(
+            "%s %s"
+            % (
+                name,
+                round(value, 2) if isinstance(value, (int, float)) else value,
+            )
+            for name, value in values.items()
+        )
+        sections.append("%s: %s" % (title, values))
+    return "\n\n".join(sections)
+
+
+def format_issue_results(results: list) -> str:
+    """Formats results of `/issues` to an html summary.
+
+    Example of output:
+        <b>Created 2 of 3 issues</b>
+        ✅ <a href="...">#12</a> Fix icons
+        ✅ <a href="...">#13</a> Add docs
+        ❌ Update deps - status 422
+
+    Args:
+        results: a list of `github.IssueResult`.
+    """
+    created = sum(1 for result in results if result.url)
+    lines = [f"<b>Created {created} of {len(results)} issues</b>"]
+    for result in results:
+        title = html.escape(result.title)
+        if result.url:
+            lines.append(
+                f'✅ <a href="{result.url}">#{result.number}</a> {title}'
+            )
+        else:
+            lines.append(f"❌ {title} - {html.escape(result.error)}")
+    return "\n".join(lines)
@@ -3,14 +3,64 @@
 The module requires that the `GITHUB_TOKEN`, `REPO_OWNER` and `REPO_NAME`
 environment variables are set. If these variables are not set, an
 AssertionError will be raised.
+
+Requests are made with a shared pooled `session`, which keeps connections
+alive and revalidates repeated GET requests with ETags, so a repeated
+`/commits` doesn't spend the GitHub rate limit. Use `session.get_stats()`
+to inspect latencies and a number of `304 Not Modified` responses.
+
+Details of commits (an author, a date, a diffstat and a CI status) are
+requested for many commits by one GraphQL query (`get_commit_details`) and
+cached by SHA.
+
+Functions take an optional `repo` - (an owner, a name) of a repository,
+the `REPO_OWNER/REPO_NAME` repository by default. All repositories share
+the session and the caches, a repository has its own commit index.
+
+Commits are served from a local persistent index (`get_index`), which is
+synced incrementally: only commits newer than the newest indexed one are
+requested. If GitHub push webhooks are configured, pushed commits are added
+to the index by `index_pushed_commits`, and the repository isn't requested
+while pushes follow each other (for `PUSH_SYNC_TTL` seconds at most).
 """
+import itertools
+import logging
 import os
+import re
+import threading
+import time
 
 import requests
 import json
-from typing import Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, NamedTuple, Optional, List, Tuple
+
+from cache import TTLCache
+from commitindex import CommitIndex
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    COMMITS_DB_PATH,
+    RESOURCES_PATH,
+    COMMIT_DETAILS_CACHE_SIZE,
+    GITHUB_API_URL,
+    GITHUB_GRAPHQL_URL,
+    GITHUB_TIMEOUT,
+    GITHUB_TOKEN,
+    GITHUB_WEBHOOK_SECRET,
+    GITHUB_WRITE_CONCURRENCY,
+    REPO_OWNER,
+    REPO_NAME,
+    TELEGRAM_NUM_THREADS,
+)
+from logs import run_in_context
+from metrics import instrument_session
+from resilience import CircuitBreaker, CircuitOpenError, backoff_delay
+from resilience import protect_session
+from session import ConditionalSession
 
-from config import GITHUB_TOKEN, REPO_OWNER, REPO_NAME
+
+logger = logging.getLogger(__name__)
 
 
 if (
@@ -30,41 +80,553 @@ HEADERS = {
     "X-GitHub-Api-Version": "2022-11-28",
 }
 
-LIST_COMMITS_API_URL = "https://api.github.com/repos/{owner}/{repo}/commits"
-CREATE_ISSUE_API_URL = "https://api.github.com/repos/{owner}/{repo}/issues"
+LIST_COMMITS_API_URL = GITHUB_API_URL + "/repos/{owner}/{repo}/commits"
+CREATE_ISSUE_API_URL = GITHUB_API_URL + "/repos/{owner}/{repo}/issues"
+
+# GitHub returns 100 commits per page at most
+PER_PAGE = 100
+# If the newest indexed commit is not found among this number of the last
+# commits, the index is rebuilt
+MAX_SYNC_COMMITS = 1000
+# Max seconds to wait for the GitHub rate limit reset
+MAX_RATE_LIMIT_WAIT = 60
+# A number of retries of a write rejected by a rate limit and the first
+# delay of a secondary rate limit without `Retry-After` (doubled each retry
+# with a jitter)
+MAX_WRITE_RETRIES = 5
+SECONDARY_RATE_LIMIT_DELAY = 1
+# Max seconds the index is trusted without requesting the repository when
+# it's updated by push webhooks (a push delivery could be lost)
+PUSH_SYNC_TTL = 60 * 60
+# A max number of commits requested by one GraphQL query
+DETAILS_PER_QUERY = 50
+# CI states after which the status of a commit doesn't change, details of
+# other commits (e.g. a running CI) are cached for `PENDING_DETAILS_TTL`
+TERMINAL_CHECK_STATES = {"SUCCESS", "FAILURE", "ERROR"}
+PENDING_DETAILS_TTL = 60
+COMMIT_DETAILS_FIELDS = """
+    author { name user { login } }
+    committedDate
+    additions
+    deletions
+    changedFilesIfAvailable
+    statusCheckRollup { state }
+"""
+SHA_PREFIX_RE = re.compile(r"[0-9a-fA-F]{4,40}")
+
+# (an owner, a name) of a repository
+Repo = Tuple[str, str]
+DEFAULT_REPO = (REPO_OWNER, REPO_NAME)
+
+session = ConditionalSession(pool_maxsize=TELEGRAM_NUM_THREADS)
+session.headers.update(HEADERS)
+instrument_session(session, "github")
+# Requests time out and fail fast while GitHub is down, commits are served
+# from the index meanwhile
+breaker = CircuitBreaker(
+    "github", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+protect_session(session, breaker, GITHUB_TIMEOUT)
+
+# Repositories by lowercased (an owner, a name), see `_get_repo`
+_repos = {}
+_repos_lock = threading.Lock()
+# Writes are paused by a secondary rate limit until this time (monotonic)
+_writes_paused_until = 0.0
+_write_lock = threading.Lock()
+# SHA -> details of a commit, see `get_commit_details`
+_details_cache = TTLCache(maxsize=max(COMMIT_DETAILS_CACHE_SIZE, 1))
+
+
+class _Repo:
+    """A commit index of a repository and the state of its sync."""
+
+    __slots__ = ("owner", "name", "path", "index", "sync_lock", "pushed_at")
+
+    def __init__(self, owner: str, name: str, path: str):
+        self.owner = owner
+        self.name = name
+        self.path = path
+        self.index = None
+        self.sync_lock = threading.Lock()
+        # A time a push webhook last added commits to the index, a sync
+        # with the repository doesn't mean following pushes will be received
+        self.pushed_at = None
+
+
+def _repo_key(repo: Repo = None) -> Tuple[str, str]:
+    # GitHub names are case insensitive
+    owner, name = repo or DEFAULT_REPO
+    return owner.lower(), name.lower()
 
 
-def get_commits(num: int = 3) -> Optional[List[dict]]:
-    """Makes API call to get last commits of a repository.
+def _get_repo(repo: Repo = None) -> _Repo:
+    owner, name = repo or DEFAULT_REPO
+    key = _repo_key(repo)
+    state = _repos.get(key)
+    if state is None:
+        with _repos_lock:
+            state = _repos.get(key)
+            if state is None:
+                path = COMMITS_DB_PATH
+                if key != _repo_key(DEFAULT_REPO):
+                    path = os.path.join(
+                        RESOURCES_PATH, "commits-%s-%s.sqlite3" % key
+                    )
+                state = _repos[key] = _Repo(owner, name, path)
+    return state
+
+
+def get_index(repo: Repo = None) -> CommitIndex:
+    """Returns the local commit index of a repository.
+
+    The index is opened on the first call.
+    """
+    state = _get_repo(repo)
+    if state.index is None:
+        with state.sync_lock:
+            if state.index is None:
+                state.index = CommitIndex(state.path)
+    return state.index
+
+
+def _get(
+    url: str, params: dict = None, wait: bool = True
+) -> requests.Response:
+    """Makes GET request to the GitHub API, waits out exceeded rate limits.
 
     Args:
-        num: number of commits.
+        url: an url of the API.
+        params: query parameters.
+        wait: whether to wait for the rate limit reset, otherwise a rate
+              limited request fails at once.
 
-    Returns:
-        list: return list of dicts with commit info
-              (keys - "sha", "comment", "url")
+    Raises:
+        requests.exceptions.RequestException: if the request failed or
+            the rate limit resets later than in `MAX_RATE_LIMIT_WAIT`.
     """
-    URL = LIST_COMMITS_API_URL.format(owner=REPO_OWNER, repo=REPO_NAME)
-    URL += f"?per_page={num}"
-    try:
-        response = requests.get(URL, headers=HEADERS)
-    except requests.exceptions.ConnectionError as erorr:
-        print(erorr)
-        return
-    commits = []
-    for commit in response.json():
-        commits.append(
+    while True:
+        response = session.get(url, params=params)
+        if wait and response.status_code in (403, 429):
+            delay = _get_rate_limit_delay(response)
+            if delay is not None and delay <= MAX_RATE_LIMIT_WAIT:
+                time.sleep(delay)
+                continue
+        response.raise_for_status()
+        return response
+
+
+def _get_rate_limit_delay(response: requests.Response) -> Optional[float]:
+    """Returns seconds to wait if the response is a rate limit error."""
+    if "Retry-After" in response.headers:
+        return float(response.headers["Retry-After"])
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = float(response.headers.get("X-RateLimit-Reset", 0))
+        return max(reset - time.time(), 0) + 1
+    return None
+
+
+def _iter_commit_pages(
+    per_page: int = PER_PAGE,
+    sha: str = None,
+    repo: Repo = None,
+    wait: bool = True,
+) -> Iterator[List[dict]]:
+    """Makes API calls to list commits of a repository page by page.
+
+    Pages are followed by `Link: rel="next"` headers, the next page is
+    requested only when the previous one is consumed.
+
+    Args:
+        per_page: a number of commits on a page (100 max).
+        sha: a SHA to start listing commits from (the default branch if None).
+        repo: (an owner, a name) of a repository.
+        wait: whether to wait for the rate limit reset (see `_get`).
+
+    Yields:
+        list: a page - a list of dicts with commit info, from the newest.
+    """
+    owner, name = repo or DEFAULT_REPO
+    URL = LIST_COMMITS_API_URL.format(owner=owner, repo=name)
+    params = {"per_page": per_page}
+    if sha:
+        params["sha"] = sha
+    while URL:
+        response = _get(URL, params=params, wait=wait)
+        yield [
             {
                 "sha": commit["sha"],
                 "comment": commit["commit"]["message"],
                 "url": commit["html_url"],
             }
+            for commit in response.json()
+        ]
+        # The next page url already contains query parameters
+        URL = response.links.get("next", {}).get("url")
+        params = None
+
+
+def sync_commits(num: int = 1, repo: Repo = None):
+    """Adds new commits of a repository to the local index.
+
+    Only commits newer than the newest indexed commit are requested. If the
+    index is empty, the last `num` commits are requested, one page at most,
+    older commits are streamed by `_backfill_commits`, so the first commits
+    are shown without waiting for the whole history. If the newest indexed
+    commit is no longer in the history (e.g. after a force push), the index
+    is rebuilt.
+
+    The sync lock is held while requesting, so a rate limited request fails
+    at once instead of waiting for the reset, and commits are served from
+    the index meanwhile.
+
+    Args:
+        num: a number of commits to request if the index is empty.
+        repo: (an owner, a name) of a repository.
+    """
+    state, index = _get_repo(repo), get_index(repo)
+    with state.sync_lock:
+        newest_sha = index.newest_sha()
+        per_page = PER_PAGE if newest_sha else max(1, min(num, PER_PAGE))
+        limit = MAX_SYNC_COMMITS if newest_sha else per_page
+        new_commits = []
+        found = False
+        pages = _iter_commit_pages(per_page=per_page, repo=repo, wait=False)
+        for commits in pages:
+            for commit in commits:
+                if commit["sha"] == newest_sha:
+                    found = True
+                    break
+                new_commits.append(commit)
+            if found or len(new_commits) >= limit:
+                break
+        if newest_sha and not found:
+            index.clear()
+        index.add_newer(new_commits)
+
+
+def _is_synced(repo: Repo = None) -> bool:
+    """Checks if the index is kept in sync by push webhooks."""
+    pushed_at = _get_repo(repo).pushed_at
+    return (
+        bool(GITHUB_WEBHOOK_SECRET)
+        and pushed_at is not None
+        and time.monotonic() - pushed_at < PUSH_SYNC_TTL
+    )
+
+
+def index_pushed_commits(
+    before: str, commits: List[dict], forced: bool = False, repo: Repo = None
+) -> bool:
+    """Adds commits of a push to the default branch to the local index.
+
+    Commits are added only if the push continues the newest indexed commit
+    (or the index is empty). Otherwise (e.g. a force push or a missed push)
+    the index is synced with the repository on the next request.
+
+    Args:
+        before: the SHA of the branch before the push.
+        commits: pushed commits ordered from the newest to the oldest.
+        forced: whether it was a force push.
+        repo: (an owner, a name) of a repository.
+
+    Returns:
+        True if the commits were added.
+    """
+    state, index = _get_repo(repo), get_index(repo)
+    with state.sync_lock:
+        newest_sha = index.newest_sha()
+        if forced or (newest_sha and newest_sha != before):
+            state.pushed_at = None
+            return False
+        index.add_newer(commits)
+        state.pushed_at = time.monotonic()
+        return True
+
+
+def _backfill_commits(num: int, repo: Repo = None) -> Iterator[dict]:
+    """Requests commits older than the oldest indexed one and indexes them.
+
+    Yields:
+        dict: up to `num` older commits, as soon as their page is received.
+    """
+    state, index = _get_repo(repo), get_index(repo)
+    oldest_sha = index.oldest_sha()
+    if not oldest_sha:
+        return
+    pages = _iter_commit_pages(sha=oldest_sha, repo=repo)
+    for i, commits in enumerate(pages):
+        # Listing from the oldest indexed commit includes the commit itself
+        commits = commits[1:] if i == 0 else commits
+        commits = commits[:num]
+        with state.sync_lock:
+            # Another thread could have already indexed these commits
+            if index.oldest_sha() == oldest_sha:
+                index.add_older(commits)
+        yield from commits
+        num -= len(commits)
+        if num <= 0 or not commits:
+            return
+        oldest_sha = commits[-1]["sha"]
+
+
+def get_commits(num: int = 3, repo: Repo = None) -> Iterator[dict]:
+    """Gets last commits of a repository, from the newest.
+
+    The local index is synced with the repository (usually one conditional
+    request), then indexed commits are yielded. If there are fewer than `num`
+    indexed commits, older commits are requested page by page and yielded
+    while the next pages are still downloading. If GitHub is unavailable,
+    only already indexed commits are yielded.
+
+    Args:
+        num: number of commits.
+        repo: (an owner, a name) of a repository.
+
+    Yields:
+        dict: commit info (keys - "sha", "comment", "url")
+    """
+    try:
+        if not _is_synced(repo):
+            sync_commits(num, repo=repo)
+    except requests.exceptions.RequestException as erorr:
+        logger.warning("Syncing commits failed: %s", erorr)
+    for commit in get_index(repo).latest(num):
+        yield commit
+        num -= 1
+    if num <= 0:
+        return
+    try:
+        yield from _backfill_commits(num, repo=repo)
+    except requests.exceptions.RequestException as erorr:
+        logger.warning("Backfilling commits failed: %s", erorr)
+
+
+def get_indexed_commits(
+    offset: int, num: int, repo: Repo = None
+) -> List[dict]:
+    """Returns indexed commits from the `offset`-th newest one.
+
+    GitHub isn't requested, e.g. the next page of `/commits` is served from
+    the commits indexed by `get_commits`.
+    """
+    latest = get_index(repo).latest(offset + num)
+    return list(itertools.islice(latest, offset, None))
+
+
+def find_commits(
+    query: str, limit: int = 10, repo: Repo = None
+) -> List[dict]:
+    """Finds indexed commits by a SHA prefix or a text of the message.
+
+    Args:
+        query: a SHA prefix (4 hex digits at least) or a text to search.
+        limit: a max number of found commits.
+        repo: (an owner, a name) of a repository.
+
+    Returns:
+        list: return list of dicts with commit info, from the newest.
+    """
+    try:
+        if not _is_synced(repo):
+            sync_commits(repo=repo)
+    except requests.exceptions.RequestException as erorr:
+        logger.warning("Syncing commits failed: %s", erorr)
+    index = get_index(repo)
+    commits = []
+    if SHA_PREFIX_RE.fullmatch(query):
+        commits = index.find_by_sha(query, limit=limit)
+    return commits or index.search(query, limit=limit)
+
+
+def _query_commit_details(
+    shas: List[str], repo: Repo = None
+) -> Dict[str, dict]:
+    """Requests details of commits by one GraphQL query.
+
+    Every commit is an aliased `object(oid: ...)` field of the repository.
+    """
+    fields = "\n".join(
+        'c%d: object(oid: "%s") { ... on Commit { %s } }'
+        % (i, sha, COMMIT_DETAILS_FIELDS)
+        for i, sha in enumerate(shas)
+    )
+    query = "query($owner: String!, $name: String!) {\n"
+    query += "repository(owner: $owner, name: $name) {\n%s\n}\n}" % fields
+    owner, name = repo or DEFAULT_REPO
+    response = session.post(
+        GITHUB_GRAPHQL_URL,
+        data=json.dumps(
+            {"query": query, "variables": {"owner": owner, "name": name}}
+        ),
+    )
+    response.raise_for_status()
+    repository = (response.json().get("data") or {}).get("repository") or {}
+    details = {}
+    for i, sha in enumerate(shas):
+        commit = repository.get("c%d" % i)
+        if not commit:
+            continue
+        author = commit.get("author") or {}
+        rollup = commit.get("statusCheckRollup") or {}
+        details[sha] = {
+            "author": (author.get("user") or {}).get("login")
+            or author.get("name"),
+            "date": commit.get("committedDate"),
+            "files": commit.get("changedFilesIfAvailable"),
+            "additions": commit.get("additions"),
+            "deletions": commit.get("deletions"),
+            "status": rollup.get("state"),
+        }
+    return details
+
+
+def get_commit_details(
+    shas: List[str], repo: Repo = None
+) -> Dict[str, dict]:
+    """Returns details of commits, requests only the uncached ones.
+
+    Details of commits never change except a CI status, so details are
+    cached by SHA, for `PENDING_DETAILS_TTL` seconds only if the CI of
+    a commit isn't finished. Commits which aren't
+    cached are requested by one GraphQL query (per `DETAILS_PER_QUERY`).
+    If GitHub is unavailable, only cached details are returned.
+
+    Args:
+        shas: SHAs of commits.
+        repo: (an owner, a name) of a repository.
+
+    Returns:
+        A dict SHA -> details - keys "author", "date" (ISO 8601), "files",
+        "additions", "deletions" and "status" (e.g. "SUCCESS", None if
+        there are no checks).
+    """
+    if not COMMIT_DETAILS_CACHE_SIZE:
+        return {}
+    details, missing = {}, []
+    for sha in shas:
+        cached = _details_cache.get(sha)
+        if cached is None:
+            missing.append(sha)
+        else:
+            details[sha] = cached
+    for start in range(0, len(missing), DETAILS_PER_QUERY):
+        try:
+            queried = _query_commit_details(
+                missing[start : start + DETAILS_PER_QUERY], repo=repo
+            )
+        except (requests.exceptions.RequestException, ValueError) as erorr:
+            logger.warning("Querying commit details failed: %s", erorr)
+            break
+        for sha, commit in queried.items():
+            if commit["status"] in TERMINAL_CHECK_STATES:
+                _details_cache.set(sha, commit)
+            else:
+                _details_cache.set(sha, commit, ttl=PENDING_DETAILS_TTL)
+        details.update(queried)
+    return details
+
+
+class IssueResult(NamedTuple):
+    """A result of creating an issue, `error` is set if it's not created."""
+
+    title: str
+    number: Optional[int] = None
+    url: Optional[str] = None
+    error: Optional[str] = None
+
+
+def _wait_writes():
+    """Waits while writes are paused by a secondary rate limit."""
+    delay = _writes_paused_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _pause_writes(delay: float):
+    """Pauses all writes, so concurrent writers back off together."""
+    global _writes_paused_until
+    with _write_lock:
+        _writes_paused_until = max(
+            _writes_paused_until, time.monotonic() + delay
+        )
+
+
+def _post(url: str, data: dict) -> dict:
+    """Makes POST request to the GitHub API, backs off from rate limits.
+
+    A request rejected by a (secondary) rate limit is retried after
+    `Retry-After` or the rate limit reset, otherwise after a jittered
+    exponential delay. Other failed requests aren't retried, since the write
+    could be done.
+
+    Returns:
+        A JSON response.
+
+    Raises:
+        requests.exceptions.RequestException: if the request failed or
+            was rejected by a rate limit `MAX_WRITE_RETRIES` times.
+    """
+    for attempt in range(MAX_WRITE_RETRIES + 1):
+        _wait_writes()
+        response = session.post(url, data=json.dumps(data))
+        if response.status_code not in (403, 429) or not _is_rate_limited(
+            response
+        ):
+            break
+        delay = _get_rate_limit_delay(response)
+        if delay is None:
+            delay = backoff_delay(
+                attempt, SECONDARY_RATE_LIMIT_DELAY, MAX_RATE_LIMIT_WAIT
+            )
+        if attempt == MAX_WRITE_RETRIES or delay > MAX_RATE_LIMIT_WAIT:
+            break
+        _pause_writes(delay)
+    response.raise_for_status()
+    return response.json()
+
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    """Checks if a 403/429 response is a rate limit, not a permission error."""
+    if response.status_code == 429 or "Retry-After" in response.headers:
+        return True
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        return True
+    try:
+        message = response.json().get("message", "")
+    except ValueError:
+        return False
+    return "rate limit" in message.lower()
+
+
+def _create_issue(
+    title: str, body: str = None, labels: list = None, repo: Repo = None
+) -> IssueResult:
+    owner, name = repo or DEFAULT_REPO
+    URL = CREATE_ISSUE_API_URL.format(owner=owner, repo=name)
+    data = {"title": title, "body": body, "labels": labels or []}
+    try:
+        issue = _post(URL, data)
+    except ValueError:
+        # Not a JSON response (`requests` JSON errors are ValueErrors too)
+        return IssueResult(title, error="invalid response")
+    except CircuitOpenError:
+        return IssueResult(title, error="GitHub is unavailable")
+    except requests.exceptions.RequestException as erorr:
+        logger.warning(
+            "Creating an issue failed: %s", erorr, extra={"title": title}
         )
-    return commits
+        status = getattr(erorr.response, "status_code", None)
+        return IssueResult(
+            title, error=f"status {status}" if status else "no connection"
+        )
+    if "html_url" not in issue:
+        return IssueResult(title, error=issue.get("message", "no url"))
+    return IssueResult(title, issue.get("number"), issue["html_url"])
 
 
 def create_issue(
-    title: str, body: str = None, labels: list = None
+    title: str, body: str = None, labels: list = None, repo: Repo = None
 ) -> Optional[str]:
     """Makes API call to create new issue.
 
@@ -72,15 +634,43 @@ def create_issue(
         title: a title of an issue.
         body: a text for an issue.
         labels: a list with tags (labels) for an issue.
+        repo: (an owner, a name) of a repository.
 
     Returns:
-        A url to the issue.
+        A url to the issue or None if it's not created.
     """
-    URL = CREATE_ISSUE_API_URL.format(owner=REPO_OWNER, repo=REPO_NAME)
-    data = json.dumps({"title": title, "body": body, "labels": labels})
-    try:
-        response = requests.post(URL, headers=HEADERS, data=data)
-    except requests.exceptions.ConnectionError as erorr:
-        print(erorr)
-        return
-    return response.json()["html_url"]
+    return _create_issue(title, body, labels, repo).url
+
+
+def create_issues(
+    issues: List[dict],
+    concurrency: int = GITHUB_WRITE_CONCURRENCY,
+    repo: Repo = None,
+) -> List[IssueResult]:
+    """Creates several issues concurrently.
+
+    At most `concurrency` requests are made at once. If a secondary rate
+    limit is exceeded, all writers pause and the rejected issue is retried.
+
+    Args:
+        issues: dicts with keys "title", "body" and "labels" (optional).
+        concurrency: a max number of concurrent requests.
+        repo: (an owner, a name) of a repository.
+
+    Returns:
+        Results in the order of issues.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(
+            executor.map(
+                run_in_context(
+                    lambda issue: _create_issue(
+                        issue["title"],
+                        issue.get("body"),
+                        issue.get("labels"),
+                        repo,
+                    )
+                ),
+                issues,
+            )
+        )
@@ -1,9 +1,31 @@
+import logging
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+from urllib.parse import quote
 
-from jenkinsapi.custom_exceptions import UnknownJob
+import requests
+from jenkinsapi.custom_exceptions import JenkinsAPIException, UnknownJob
 from jenkinsapi.jenkins import Jenkins
 
-from config import JENKINS_HOST, JENKINS_PASSWORD, JENKINS_USERNAME
+from cache import TTLCache
+from config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    JENKINS_HOST,
+    JENKINS_PASSWORD,
+    JENKINS_TIMEOUT,
+    JENKINS_USERNAME,
+)
+from logs import run_in_context
+from metrics import instrument_session
+from resilience import CircuitBreaker, protect_session
+
+
+logger = logging.getLogger(__name__)
 
 
 if (
@@ -17,46 +39,241 @@ if (
     )
 
 
-jenkins = Jenkins(
-    JENKINS_HOST, username=JENKINS_USERNAME, password=JENKINS_PASSWORD
+# Fields of all jobs requested by one Jenkins JSON API call
+JOBS_TREE = "jobs[name,description,color,lastBuild[building]]"
+# Fields of a job telling whether it's queued or running
+JOB_STATUS_TREE = "inQueue,queueItem[id],lastBuild[building,queueId]"
+# Fields of the queue items
+QUEUE_TREE = "items[id]"
+# Jenkins answers to a build trigger with a redirect to the queue item
+QUEUE_ITEM_RE = re.compile(r"/queue/item/(\d+)/?$")
+# Fields of builds of all jobs (and jobs in folders) requested by one
+# Jenkins JSON API call, `{0,%(num)d}` limits builds to the last `num`
+BUILD_FIELDS = (
+    "number,url,queueId,building,result,timestamp,duration,estimatedDuration"
+)
+BUILDS_TREE = (
+    "jobs[fullName,builds[%(fields)s]{0,%(num)d},"
+    "jobs[fullName,builds[%(fields)s]{0,%(num)d}]]"
+)
+# A number of threads inspecting jobs if the JSON API call fails
+JOBS_MAX_WORKERS = 8
+# Seconds the jobs details are cached
+JOBS_CACHE_TTL = 15
+
+# Jenkins client is created on the first use, because jenkinsapi requests
+# the server on creation, see `get_jenkins`
+_jenkins = None
+_jenkins_lock = threading.Lock()
+jobs_cache = TTLCache(maxsize=1, ttl=JOBS_CACHE_TTL)
+# (a time, details) of the last received jobs details, they are shown
+# while Jenkins is unavailable
+_last_details = None
+# Requests time out and fail fast while Jenkins is down
+breaker = CircuitBreaker(
+    "jenkins", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
 )
 
 
-def build_job(job: str, **kwargs):
-    """Makes request to Jenkins on build the job.
+def get_jenkins() -> Jenkins:
+    """Returns the Jenkins client, creates it on the first call."""
+    global _jenkins
+    if _jenkins is None:
+        with _jenkins_lock:
+            if _jenkins is None:
+                with breaker.guard(
+                    failures=(
+                        requests.exceptions.RequestException,
+                        JenkinsAPIException,
+                    )
+                ):
+                    jenkins = Jenkins(
+                        JENKINS_HOST,
+                        username=JENKINS_USERNAME,
+                        password=JENKINS_PASSWORD,
+                        timeout=JENKINS_TIMEOUT,
+                    )
+                instrument_session(jenkins.requester.session, "jenkins")
+                protect_session(
+                    jenkins.requester.session, breaker, JENKINS_TIMEOUT
+                )
+                _jenkins = jenkins
+    return _jenkins
+
+
+def get_job_url(job: str) -> str:
+    """Returns an url of a job by its path, e.g. "folder/job"."""
+    return get_jenkins().baseurl.rstrip("/") + "".join(
+        "/job/" + quote(name) for name in job.strip("/").split("/")
+    )
+
+
+def get_job_status(job: str) -> Optional[int]:
+    """Checks if a job is busy with one Jenkins JSON API call.
 
-    Attrs:
+    Args:
+        job: a job path.
+    Returns:
+        An id of the queue item of the queued or running build of the job
+        or None if the job is free (or Jenkins didn't tell the id, such
+        a build can't be followed).
+    Raises:
+        UnknownJob: the job doesn't exist.
+    """
+    response = get_jenkins().requester.get_url(
+        get_job_url(job) + "/api/json", params={"tree": JOB_STATUS_TREE}
+    )
+    if response.status_code == 404:
+        raise UnknownJob(job)
+    response.raise_for_status()
+    data = response.json()
+    if data.get("inQueue"):
+        return (data.get("queueItem") or {}).get("id")
+    last_build = data.get("lastBuild") or {}
+    if last_build.get("building"):
+        return last_build.get("queueId")
+    return None
+
+
+def invoke_job(job: str, **kwargs) -> Optional[int]:
+    """Triggers a build of a job with one Jenkins API call.
+
+    Args:
         job: a job path.
         kwargs: a job parameters.
     Returns:
-        Status information or the error/info message.
+        An id of the queue item of the build or None if Jenkins didn't
+        redirect to the queue item.
+    Raises:
+        UnknownJob: the job doesn't exist.
     """
-    try:
-        job = jenkins[job]
-    except UnknownJob as error:
-        print(error)
-        return "Unknown job path."
+    url = get_job_url(job) + ("/buildWithParameters" if kwargs else "/build")
+    response = get_jenkins().requester.post_url(
+        url, data=kwargs, allow_redirects=False
+    )
+    if response.status_code == 404:
+        raise UnknownJob(job)
+    if response.status_code not in (200, 201, 303):
+        raise JenkinsAPIException(
+            "Build of %s failed, status=%s" % (job, response.status_code)
+        )
+    match = QUEUE_ITEM_RE.search(response.headers.get("location", ""))
+    return int(match.group(1)) if match else None
+
 
-    if job.is_queued_or_running():
-        return "The job is currently building or queued."
+def get_builds(num: int) -> Dict[str, List[dict]]:
+    """Requests the last builds of all jobs with one Jenkins JSON API call.
 
+    Args:
+        num: a number of the last builds of a job.
+    Returns:
+        A dict - a job full name -> a list of builds (the newest first).
+    """
+    jenkins = get_jenkins()
+    response = jenkins.requester.get_and_confirm_status(
+        jenkins.baseurl.rstrip("/") + "/api/json",
+        params={"tree": BUILDS_TREE % {"fields": BUILD_FIELDS, "num": num}},
+    )
+    builds = {}
+    jobs = list(response.json()["jobs"])
+    for job in jobs:
+        # Jobs in folders are listed in `jobs` of a folder
+        jobs.extend(job.get("jobs") or ())
+        if "builds" in job:
+            builds[job["fullName"]] = job["builds"]
+    return builds
+
+
+def get_queue_ids() -> Set[int]:
+    """Requests ids of all items of the Jenkins queue with one API call."""
+    jenkins = get_jenkins()
+    response = jenkins.requester.get_and_confirm_status(
+        jenkins.baseurl.rstrip("/") + "/queue/api/json",
+        params={"tree": QUEUE_TREE},
+    )
+    return {item["id"] for item in response.json()["items"]}
+
+
+def get_job_details() -> str:
+    """Get job details of each job that is running on the Jenkins instance.
+
+    All jobs are requested at once from the Jenkins JSON API, if it fails,
+    the jobs are inspected concurrently with jenkinsapi. The details are
+    cached for `JOBS_CACHE_TTL` seconds. If Jenkins is unavailable, the
+    last received details are returned with a note.
+
+    Raises:
+        requests.exceptions.RequestException: if Jenkins is unavailable and
+            no details were received yet.
+    """
+    global _last_details
+    details = jobs_cache.get("details")
+    if details is None:
+        try:
+            details = "".join(_format_job(job) for job in _get_jobs())
+        except (requests.exceptions.RequestException, JenkinsAPIException):
+            if _last_details is None:
+                raise
+            received_at, details = _last_details
+            return "Jenkins is unavailable, jobs at %s:\n\n%s" % (
+                time.strftime("%H:%M:%S", time.localtime(received_at)),
+                details,
+            )
+        jobs_cache.set("details", details)
+        _last_details = (time.time(), details)
+    return details
+
+
+def _get_jobs() -> List[dict]:
     try:
-        job.invoke(build_params={**kwargs})
-    except ValueError as error:
-        if not error.args[0].startswith("Not a Queue URL"):
-            raise
-
-    return "build"
-
-
-def get_job_details():
-    """Get job details of each job that is running on the Jenkins instance"""
-    output = []
-    for _, job_instance in jenkins.get_jobs():
-        output.append(
-            "Job Name: %s\n" % job_instance.name
-            + "Job Description: %s\n" % (job_instance.get_description())
-            + "Is Job running: %s\n" % (job_instance.is_running())
-            + "Is Job enabled: %s\n\n" % (job_instance.is_enabled())
+        return _fetch_jobs()
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        # Jenkins is unreachable, inspecting jobs would wait again
+        raise
+    except Exception as error:
+        logger.warning("Fetching jobs failed, inspecting: %s", error)
+        return _inspect_jobs()
+
+
+def _fetch_jobs() -> List[dict]:
+    """Requests fields of all jobs with one Jenkins JSON API call."""
+    jenkins = get_jenkins()
+    response = jenkins.requester.get_and_confirm_status(
+        jenkins.baseurl.rstrip("/") + "/api/json", params={"tree": JOBS_TREE}
+    )
+    return [
+        {
+            "name": job["name"],
+            "description": job.get("description"),
+            "running": bool((job.get("lastBuild") or {}).get("building")),
+            "enabled": "disabled" not in (job.get("color") or ""),
+        }
+        for job in response.json()["jobs"]
+    ]
+
+
+def _inspect_jobs() -> List[dict]:
+    """Inspects all jobs with jenkinsapi in a bounded thread pool."""
+    with ThreadPoolExecutor(max_workers=JOBS_MAX_WORKERS) as executor:
+        return list(
+            executor.map(
+                run_in_context(
+                    lambda job: {
+                        "name": job.name,
+                        "description": job.get_description(),
+                        "running": job.is_running(),
+                        "enabled": job.is_enabled(),
+                    }
+                ),
+                (job_instance for _, job_instance in get_jenkins().get_jobs()),
+            )
         )
-    return "".join(output)
+
+
+def _format_job(job: dict) -> str:
+    return (
+        "Job Name: %s\n" % job["name"]
+        + "Job Description: %s\n" % job["description"]
+        + "Is Job running: %s\n" % job["running"]
+        + "Is Job enabled: %s\n\n" % job["enabled"]
+    )
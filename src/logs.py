@@ -0,0 +1,272 @@
+"""A module with structured non-blocking logging of the bot.
+
+Records are JSON lines. A handler thread only puts a record into a bounded
+queue (`QueueHandler`), a background thread (`QueueListener`) formats and
+writes it, so logging doesn't block handlers on the output. If the queue is
+full, records are dropped and counted.
+
+Every bot update gets a context - a correlation id, a chat, a user and
+a command (see `instrument_bot`), which is added to all records logged
+while it's processed, including calls to GitHub, Jenkins, OpenAI and
+Telegram (see `metrics.track_call`). The context is kept in a context
+variable, use `run_in_context` to pass it to worker threads.
+
+Debug records are sampled: only a `debug_sample_rate` share of updates
+logs them, so high-volume events (e.g. every outbound call) are cheap and
+the debug records of a sampled update are all kept. Debug records of
+libraries (`QUIET_LOGGERS`) aren't logged, they contain request bodies.
+
+Usage:
+    logger = logging.getLogger(__name__)
+    logger.warning("Jenkins is unavailable", extra={"job": job})
+"""
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from typing import Callable, Optional
+
+# A context of the update being processed - a dict of fields of records
+_context: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "log_context", default=None
+)
+
+# Attributes of every `LogRecord`, other attributes are `extra` fields
+_RECORD_ATTRS = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "context"}
+
+# Loggers of libraries which log at the INFO level at least
+QUIET_LOGGERS = ("urllib3", "openai", "jenkinsapi", "TeleBot")
+
+logger = logging.getLogger(__name__)
+
+
+def get_context() -> Optional[dict]:
+    """Returns the context of the current update or None."""
+    return _context.get()
+
+
+def bind(**fields):
+    """Adds fields to the context of the current update, if any."""
+    context = _context.get()
+    if context is not None:
+        context.update(fields)
+
+
+def run_in_context(fn: Callable) -> Callable:
+    """Wraps a function to run in a copy of the current context.
+
+    Context variables aren't passed to threads of a pool, a wrapped function
+    submitted to a pool logs with the context of the caller.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def add_upstream_time(seconds: float):
+    """Counts a call to an external service in the current context."""
+    context = _context.get()
+    if context is not None:
+        context["upstream_calls"] = context.get("upstream_calls", 0) + 1
+        context["upstream_ms"] = round(
+            context.get("upstream_ms", 0) + seconds * 1000, 2
+        )
+
+
+def _describe_update(obj) -> dict:
+    """Returns context fields of a message or a callback query."""
+    message = getattr(obj, "message", None)
+    if message is not None and hasattr(obj, "data"):
+        # A callback query, its action is bound by the dispatcher
+        return {
+            "chat_id": message.chat.id,
+            "user_id": obj.from_user.id,
+            "command": "callback",
+        }
+    text = getattr(obj, "text", None) or ""
+    chat = getattr(obj, "chat", None)
+    user = getattr(obj, "from_user", None)
+    return {
+        "chat_id": chat.id if chat else None,
+        "user_id": user.id if user else None,
+        "command": text.split(maxsplit=1)[0] if text[:1] == "/" else None,
+    }
+
+
+def instrument_handler(fn: Callable, name: str = None) -> Callable:
+    """Wraps a handler to process an update in a new log context.
+
+    A sampled debug record with the duration and the time of external calls
+    is logged for an update, an error record if the handler fails.
+    """
+    name = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(obj, *args, **kwargs):
+        context = {"request_id": uuid.uuid4().hex[:16], "handler": name}
+        try:
+            context.update(_describe_update(obj))
+        except AttributeError:
+            pass
+        token = _context.set(context)
+        start = time.perf_counter()
+        try:
+            return fn(obj, *args, **kwargs)
+        except Exception:
+            logger.exception(
+                "Handler failed",
+                extra={"duration_ms": _elapsed_ms(start)},
+            )
+            raise
+        finally:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Handled", extra={"duration_ms": _elapsed_ms(start)}
+                )
+            _context.reset(token)
+
+    return wrapper
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def instrument_bot(bot):
+    """Wraps all registered message and callback query handlers of a bot."""
+    for handlers in (
+        bot.message_handlers,
+        bot.edited_message_handlers,
+        bot.callback_query_handlers,
+    ):
+        for handler in handlers:
+            handler["function"] = instrument_handler(handler["function"])
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record with its context and `extra` fields as JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in (getattr(record, "context", None) or {}).items():
+            # Private fields (e.g. "_sampled") aren't logged
+            if not key.startswith("_"):
+                data[key] = value
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = "".join(
+                traceback.format_exception(*record.exc_info)
+            ).rstrip()
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps debug records of a share of updates, other records are kept.
+
+    An update is sampled on its first debug record, debug records outside
+    of updates are sampled one by one.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        context = _context.get()
+        if context is None:
+            return random.random() < self.rate
+        sampled = context.get("_sampled")
+        if sampled is None:
+            sampled = context["_sampled"] = random.random() < self.rate
+        return sampled
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """Puts records into a queue with the context of the caller.
+
+    Unlike `QueueHandler`, a record isn't formatted in the caller thread,
+    it's formatted by the listener. A record is dropped if the queue is full.
+    """
+
+    def __init__(self, queue_: queue.Queue):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = _context.get()
+        # A copy, the context is changed while the record is in the queue
+        record.context = dict(context) if context else None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+
+
+def setup_logging(
+    level: str = "INFO",
+    debug_sample_rate: float = 0.01,
+    queue_size: int = 10000,
+    stream=None,
+) -> ContextQueueHandler:
+    """Sends records of all loggers through a queue to a background writer.
+
+    Args:
+        level: a level of records (e.g. "INFO", "DEBUG").
+        debug_sample_rate: a share of debug records which are kept.
+        queue_size: a max number of records waiting to be written.
+        stream: a stream to write records to (stderr by default).
+
+    Returns:
+        The queue handler, its `dropped` is a number of dropped records.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JSONFormatter())
+    records = queue.Queue(maxsize=queue_size)
+    handler = ContextQueueHandler(records)
+    handler.addFilter(SamplingFilter(debug_sample_rate))
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        if isinstance(old, ContextQueueHandler):
+            root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name in QUIET_LOGGERS:
+        library_logger = logging.getLogger(name)
+        library_logger.setLevel(max(library_logger.level, logging.INFO))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return handler
@@ -0,0 +1,124 @@
+"""A module with a cache of Telegram file ids of uploaded media.
+
+A file uploaded to Telegram once gets a `file_id`, and the same file can be
+sent again by its `file_id` without uploading the bytes. File ids are kept in
+an SQLite database keyed by the SHA-256 of the file content, so they survive
+restarts, and a changed file (another hash) is uploaded again. Hashes of
+files are cached by their modification time and size, so a file isn't read
+again while it isn't changed.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    digest TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+"""
+
+
+class MediaCache:
+    """File ids of uploaded files, keyed by hashes of their content.
+
+    Attrs:
+        stats: a number of sends by a cached file id and of uploads.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: a path to the SQLite database file, `:memory:` is allowed.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # A path -> (mtime, size, a digest)
+        self._digests = {}
+        self._lock = threading.Lock()
+        # Uploads are serialized, so a new file is uploaded only once
+        self._upload_lock = threading.Lock()
+        self.stats = {"cached": 0, "uploaded": 0}
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def get_digest(self, path: str) -> str:
+        """Returns the SHA-256 of a file, reads it only if it's changed."""
+        stat = os.stat(path)
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        with open(path, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        self._digests[path] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM media WHERE digest = ?", (digest,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, digest: str, file_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (digest, file_id) "
+                "VALUES (?, ?)",
+                (digest, file_id),
+            )
+
+    def delete(self, digest: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM media WHERE digest = ?", (digest,)
+            )
+
+    def send_photo(
+        self, send_photo: Callable, chat_id: int, path: str, **kwargs
+    ):
+        """Sends a photo file by its cached file id or uploads it.
+
+        If Telegram rejects a cached file id (e.g. the bot token was
+        changed), the file is uploaded again.
+
+        Args:
+            send_photo: a function `(chat_id, photo, **kwargs)` returning
+                        a sent message, e.g. `Sender.send_photo`.
+            chat_id: a chat id.
+            path: a path to a photo file.
+            kwargs: the rest arguments of `send_photo` (e.g. a caption).
+
+        Returns:
+            The sent message.
+        """
+        digest = self.get_digest(path)
+        file_id = self.get(digest)
+        if file_id is not None:
+            try:
+                message = send_photo(chat_id, file_id, **kwargs)
+                self.stats["cached"] += 1
+                return message
+            except ApiTelegramException as error:
+                if error.error_code != 400:
+                    raise
+                self.delete(digest)
+        with self._upload_lock:
+            file_id = self.get(digest)
+            if file_id is not None:
+                self.stats["cached"] += 1
+                return send_photo(chat_id, file_id, **kwargs)
+            # Bytes, not a file object, so a retried request sends them again
+            with open(path, "rb") as file:
+                content = file.read()
+            digest = hashlib.sha256(content).hexdigest()
+            message = send_photo(chat_id, content, **kwargs)
+            self.set(digest, message.photo[-1].file_id)
+            self.stats["uploaded"] += 1
+        return message
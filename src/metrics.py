@@ -0,0 +1,446 @@
+"""A module with metrics of the bot in the Prometheus text format.
+
+Metrics are counters, gauges and histograms with labels, registered in
+`REGISTRY`. Handlers of the bot and outbound calls to GitHub, Jenkins,
+OpenAI and Telegram are instrumented with latency histograms, error
+counters and in-flight gauges (see `instrument_*`). Metrics are exposed by
+a local HTTP server on `/metrics` (see `start_http_server`) and summarized
+by the `/stats` command.
+
+Usage:
+    calls = Counter("calls_total", "Calls.", ["name"])
+    calls.labels(name="x").inc()
+"""
+import bisect
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from logs import add_upstream_time
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Registry:
+    """A collection of metrics exposed together."""
+
+    def __init__(self):
+        self.metrics: List["Metric"] = []
+
+    def register(self, metric: "Metric"):
+        self.metrics.append(metric)
+
+    def expose(self) -> str:
+        """Returns all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"'
+        % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+
+
+class Metric:
+    """A base metric, a child metric is kept for each set of labels."""
+
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Registry = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """Returns the child metric of the label values."""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def items(self) -> List[Tuple[Dict[str, str], object]]:
+        """Returns pairs (labels, a child metric)."""
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), c) for key, c in children]
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, child in sorted(self._children.copy().items()):
+            lines.extend(
+                self._collect_child(
+                    _format_labels(self.labelnames, key), key, child
+                )
+            )
+        return lines
+
+    def _collect_child(self, labels: str, key: tuple, child) -> List[str]:
+        return ["%s%s %s" % (self.name, labels, _format_value(child.value))]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # Observations of each bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, share: float) -> float:
+        """Estimates a quantile by linear interpolation in its bucket."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return math.nan
+        rank, seen, lower = share * count, 0, 0.0
+        for upper, bucket_count in zip(self.buckets, counts):
+            if seen + bucket_count >= rank and bucket_count:
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+
+class Counter(Metric):
+    """A value that only goes up, e.g. a number of errors."""
+
+    kind = "counter"
+    _new_child = staticmethod(_CounterChild)
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, e.g. a number of calls in flight."""
+
+    kind = "gauge"
+    _new_child = staticmethod(_GaugeChild)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+
+class Histogram(Metric):
+    """Observations counted in buckets, e.g. latencies."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _collect_child(self, labels: str, key: tuple, child) -> List[str]:
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines, cumulative = [], 0
+        for upper, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            bucket_labels = _format_labels(
+                self.labelnames + ("le",), key + (_format_value(upper),)
+            )
+            lines.append(
+                "%s_bucket%s %d" % (self.name, bucket_labels, cumulative)
+            )
+        lines.append("%s_sum%s %r" % (self.name, labels, total))
+        lines.append("%s_count%s %d" % (self.name, labels, count))
+        return lines
+
+
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Latency of bot handlers.", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total",
+    "Exceptions raised by bot handlers.",
+    ["handler"],
+)
+HANDLERS_IN_FLIGHT = Gauge(
+    "bot_handlers_in_flight", "Bot handlers being executed.", ["handler"]
+)
+OUTBOUND_SECONDS = Histogram(
+    "bot_outbound_seconds",
+    "Latency of calls to external services.",
+    ["service", "method"],
+)
+OUTBOUND_ERRORS = Counter(
+    "bot_outbound_errors_total",
+    "Failed calls (exceptions and 5xx) to external services.",
+    ["service", "method"],
+)
+OUTBOUND_IN_FLIGHT = Gauge(
+    "bot_outbound_in_flight",
+    "Calls to external services in flight.",
+    ["service"],
+)
+
+
+def summarize(histogram: Histogram, errors: Counter) -> List[dict]:
+    """Returns stats of each set of labels of a latency histogram.
+
+    Returns:
+        A list of dicts - labels, calls, errors, average and p95 latency
+        in seconds, sorted by the total time, the biggest first.
+    """
+    error_counts = {
+        tuple(sorted(labels.items())): child.value
+        for labels, child in errors.items()
+    }
+    stats = []
+    for labels, child in histogram.items():
+        if not child.count:
+            continue
+        stats.append(
+            {
+                "labels": labels,
+                "calls": child.count,
+                "errors": error_counts.get(tuple(sorted(labels.items())), 0),
+                "total": child.sum,
+                "avg": child.sum / child.count,
+                "p95": child.quantile(0.95),
+            }
+        )
+    return sorted(stats, key=lambda item: item["total"], reverse=True)
+
+
+def instrument_handler(fn: Callable, name: str = None) -> Callable:
+    """Wraps a handler to record its latency, errors and calls in flight."""
+    name = name or fn.__name__
+    seconds = HANDLER_SECONDS.labels(handler=name)
+    errors = HANDLER_ERRORS.labels(handler=name)
+    in_flight = HANDLERS_IN_FLIGHT.labels(handler=name)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - start)
+            in_flight.dec()
+
+    return wrapper
+
+
+def instrument_bot(bot):
+    """Wraps all registered message and callback query handlers of a bot."""
+    for handlers in (
+        bot.message_handlers,
+        bot.edited_message_handlers,
+        bot.callback_query_handlers,
+    ):
+        for handler in handlers:
+            handler["function"] = instrument_handler(handler["function"])
+
+
+# (a service, a method) -> child metrics of outbound calls
+_outbound_children = {}
+
+
+@contextmanager
+def track_call(service: str, method: str):
+    """Records latency, errors and calls in flight of an outbound call.
+
+    The time of the call is added to the log context of the update, a failed
+    call is logged as a warning and every call as a sampled debug record.
+    """
+    children = _outbound_children.get((service, method))
+    if children is None:
+        children = _outbound_children[(service, method)] = (
+            OUTBOUND_IN_FLIGHT.labels(service=service),
+            OUTBOUND_SECONDS.labels(service=service, method=method),
+            OUTBOUND_ERRORS.labels(service=service, method=method),
+        )
+    in_flight, seconds, errors = children
+    in_flight.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        errors.inc()
+        logger.warning(
+            "%s %s failed: %s",
+            service,
+            method,
+            error,
+            extra=_call_fields(service, method, start),
+        )
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        seconds.observe(elapsed)
+        in_flight.dec()
+        add_upstream_time(elapsed)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s %s",
+                service,
+                method,
+                extra=_call_fields(service, method, start),
+            )
+
+
+def _call_fields(service: str, method: str, start: float) -> dict:
+    return {
+        "service": service,
+        "method": method,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def instrument_session(session, service: str):
+    """Records every request sent by a `requests.Session`.
+
+    Requests are labeled by the HTTP method, 5xx responses are errors.
+    """
+    send = session.send
+
+    def instrumented_send(request, **kwargs):
+        with track_call(service, request.method):
+            response = send(request, **kwargs)
+        if response.status_code >= 500:
+            OUTBOUND_ERRORS.labels(
+                service=service, method=request.method
+            ).inc()
+        return response
+
+    session.send = instrumented_send
+
+
+def instrument_telegram():
+    """Records every Telegram Bot API request, labeled by the API method."""
+    from telebot import apihelper
+
+    def send_request(method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        with track_call("telegram", api_method):
+            response = apihelper._get_req_session().request(
+                method, url, **kwargs
+            )
+        if response.status_code >= 500:
+            OUTBOUND_ERRORS.labels(
+                service="telegram", method=api_method
+            ).inc()
+        return response
+
+    apihelper.CUSTOM_REQUEST_SENDER = send_request
+
+
+def start_http_server(host: str, port: int, registry: Registry = REGISTRY):
+    """Serves metrics on `http://{host}:{port}/metrics` in a thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.expose().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,318 @@
+"""A module with a background health monitor of the website.
+
+The monitor requests the website every `interval` seconds in a background
+thread. A probe measures the phases of a request - DNS resolution, TCP
+connect, TLS handshake and time to the first byte. Probes are kept in
+a fixed-size ring buffer, so `/ping` is answered at once from the history
+with percentiles of latency and uptime, and memory doesn't grow.
+
+The connection is kept alive between probes (the site is checked the way
+a returning visitor sees it), and every `reconnect_every` probe opens a new
+connection, so DNS, connect and TLS timings stay measured. If the server has
+closed the kept-alive connection between probes, the request is sent once
+more on a new connection, only the second attempt is recorded.
+
+An alert is sent when the site fails or is slow in `alert_after` probes in
+a row, and when it recovers.
+"""
+import http.client
+import logging
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+# A number of probes after which a new connection is opened
+RECONNECT_EVERY = 10
+# Errors of a kept-alive connection closed by the server before it got
+# a request, the request is sent again on a new connection
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class Sample(NamedTuple):
+    """A result of a probe, timings are in seconds (None if the phase
+    wasn't done, e.g. the connection was reused)."""
+
+    time: float
+    status: Optional[int]
+    dns: Optional[float]
+    connect: Optional[float]
+    tls: Optional[float]
+    ttfb: Optional[float]
+    total: float
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and self.status < 400
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    """Returns a percentile of values (nearest rank) or None."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(share * (len(values) - 1))]
+
+
+class HealthMonitor:
+    """Probes a website on a schedule and keeps the latency history.
+
+    Attrs:
+        state: "up", "slow" or "down" - the state of the last alert.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        interval: float = 60,
+        size: int = 1440,
+        timeout: float = 7,
+        slow_threshold: float = 3,
+        alert_after: int = 3,
+        alert: Callable[[str], None] = None,
+        reconnect_every: int = RECONNECT_EVERY,
+    ):
+        """
+        Args:
+            url: a website url.
+            interval: seconds between probes.
+            size: a number of probes kept in the history.
+            timeout: seconds to wait for the connection and the response.
+            slow_threshold: seconds of a request after which it's slow.
+            alert_after: a number of failed or slow probes in a row after
+                         which an alert is sent.
+            alert: sends an alert text to the team.
+            reconnect_every: a number of probes after which a new
+                             connection is opened.
+        """
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname
+        self.https = parsed.scheme == "https"
+        self.port = parsed.port or (443 if self.https else 80)
+        self.path = (parsed.path or "/") + (
+            "?" + parsed.query if parsed.query else ""
+        )
+        self.interval = interval
+        self.timeout = timeout
+        self.slow_threshold = slow_threshold
+        self.alert_after = alert_after
+        self.alert = alert
+        self.reconnect_every = reconnect_every
+        self.samples = deque(maxlen=size)
+        self.state = "up"
+        self._conn = None
+        self._conn_probes = 0
+        self._ssl_context = ssl.create_default_context()
+        # Guards the history and the state
+        self._lock = threading.Lock()
+        # Guards the connection, `/ping` doesn't wait for a probe
+        self._probe_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        """Starts probing in a background thread."""
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.probe()
+            except Exception:
+                logger.exception("A health check failed")
+            self._stop.wait(self.interval)
+
+    def _resolve(self) -> tuple:
+        """Resolves the host within the timeout, returns an address info.
+
+        `getaddrinfo` has no timeout, it's called in a daemon thread, which
+        is left behind if the resolver hangs.
+        """
+        result = {}
+
+        def resolve():
+            try:
+                result["info"] = socket.getaddrinfo(
+                    self.host, self.port, type=socket.SOCK_STREAM
+                )[0]
+            except OSError as error:
+                result["error"] = error
+
+        thread = threading.Thread(target=resolve, daemon=True)
+        thread.start()
+        thread.join(self.timeout)
+        if thread.is_alive():
+            raise socket.timeout("DNS resolution timed out")
+        if "error" in result:
+            raise result["error"]
+        return result["info"]
+
+    def _connect(self):
+        """Opens a connection, returns DNS, connect and TLS timings."""
+        start = time.perf_counter()
+        family, _, _, _, address = self._resolve()
+        resolved = time.perf_counter()
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+            connected = time.perf_counter()
+            if self.https:
+                sock = self._ssl_context.wrap_socket(
+                    sock, server_hostname=self.host
+                )
+        except Exception:
+            sock.close()
+            raise
+        tls = time.perf_counter() - connected if self.https else None
+        self._conn = http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout
+        )
+        self._conn.sock = sock
+        self._conn_probes = 0
+        return resolved - start, connected - resolved, tls
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def probe(self) -> Sample:
+        """Requests the website once and records the result."""
+        with self._probe_lock:
+            if self._conn_probes >= self.reconnect_every:
+                self._close()
+            reused = self._conn is not None
+            sample, failure = self._request()
+            if (
+                reused
+                and sample.ttfb is None
+                and isinstance(failure, STALE_CONNECTION_ERRORS)
+            ):
+                sample, failure = self._request()
+        with self._lock:
+            self.samples.append(sample)
+            text = self._check_state()
+        if text is not None and self.alert is not None:
+            try:
+                self.alert(text)
+            except Exception as error:
+                logger.warning("Sending an alert failed: %s", error)
+        return sample
+
+    def _request(self) -> Tuple[Sample, Optional[Exception]]:
+        """Requests the website, returns a sample and an error, if any."""
+        start = time.perf_counter()
+        dns = connect = tls = ttfb = None
+        status = error = failure = None
+        try:
+            if self._conn is None:
+                dns, connect, tls = self._connect()
+            self._conn_probes += 1
+            sent = time.perf_counter()
+            self._conn.request(
+                "GET", self.path, headers={"User-Agent": "noted-bot"}
+            )
+            response = self._conn.getresponse()
+            ttfb = time.perf_counter() - sent
+            response.read()
+            status = response.status
+            if response.will_close:
+                self._close()
+        except (OSError, http.client.HTTPException) as exc:
+            error = str(exc) or exc.__class__.__name__
+            failure = exc
+            self._close()
+        sample = Sample(
+            time.time(),
+            status,
+            dns,
+            connect,
+            tls,
+            ttfb,
+            time.perf_counter() - start,
+            error,
+        )
+        return sample, failure
+
+    def _check_state(self) -> Optional[str]:
+        """Updates the state by the last probes, returns an alert text."""
+        last = list(self.samples)[-self.alert_after :]
+        if len(last) == self.alert_after and not any(s.ok for s in last):
+            state = "down"
+        elif len(last) == self.alert_after and all(
+            s.ok and s.total >= self.slow_threshold for s in last
+        ):
+            state = "slow"
+        elif last[-1].ok and (
+            self.state == "down" or last[-1].total < self.slow_threshold
+        ):
+            state = "up"
+        else:
+            state = self.state
+        if state == self.state:
+            return None
+        previous, self.state = self.state, state
+        if state == "down":
+            return "%s is down: %s" % (self.url, self._describe(last[-1]))
+        if state == "slow":
+            return "%s is slow: %.2f s" % (self.url, last[-1].total)
+        return "%s is up again (was %s)" % (self.url, previous)
+
+    @staticmethod
+    def _describe(sample: Sample) -> str:
+        if sample.status is not None:
+            return "status code %d" % sample.status
+        return sample.error or "no response"
+
+    def get_report(self) -> dict:
+        """Returns the state of the website from the history.
+
+        If there are no probes yet, the website is probed at once.
+
+        Returns:
+            A dict - the last sample, a number of probes, uptime (a share
+            of successful probes), seconds the history covers, p50 and p95
+            of request times and p50 of phases (in seconds).
+        """
+        if not self.samples:
+            self.probe()
+        with self._lock:
+            samples = list(self.samples)
+        ok = [sample for sample in samples if sample.ok]
+        totals = [sample.total for sample in ok]
+        report = {
+            "url": self.url,
+            "state": self.state,
+            "last": samples[-1],
+            "probes": len(samples),
+            "uptime": len(ok) / len(samples),
+            "period": samples[-1].time - samples[0].time,
+            "p50": percentile(totals, 0.5),
+            "p95": percentile(totals, 0.95),
+        }
+        for phase in ("dns", "connect", "tls", "ttfb"):
+            report[phase] = percentile(
+                [
+                    getattr(sample, phase)
+                    for sample in ok
+                    if getattr(sample, phase) is not None
+                ],
+                0.5,
+            )
+        return report
@@ -0,0 +1,236 @@
+"""A module with timeouts, retries and circuit breakers of outbound calls.
+
+Every backend (GitHub, Jenkins, OpenAI) has a `CircuitBreaker`. After
+`failure_threshold` failed calls in a row (connection errors, timeouts,
+5xx responses) the circuit opens, and calls fail at once with
+`CircuitOpenError` for `reset_timeout` seconds, so a dead backend doesn't
+hold handler threads and isn't requested by every command. Then one call
+is let through (half-open): if it succeeds, the circuit closes, otherwise
+it opens again.
+
+`CircuitOpenError` is a `requests` connection error, so callers fall back
+to cached or degraded answers as if the backend were unreachable.
+
+Requests of a `requests.Session` are protected by `protect_session`, which
+also sets a default timeout and retries idempotent requests which failed
+to connect or got 502/503/504, with a jittered exponential backoff.
+
+Usage:
+    breaker = CircuitBreaker("github")
+    protect_session(session, breaker, timeout=10)
+    with breaker.guard(failures=(TimeoutError,)):
+        call_backend()
+"""
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Type
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+# Statuses of an overloaded or restarting backend, worth a retry
+RETRY_STATUSES = {502, 503, 504}
+# Methods which are safe to send again
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Breakers by names, see `get_breakers`
+_breakers: Dict[str, "CircuitBreaker"] = {}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """A call is rejected, since the backend is considered down."""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Returns seconds to wait before a retry.
+
+    The delay is `base * 2 ** attempt` (`cap` at most) with a random half,
+    so clients which failed together don't retry together.
+    """
+    delay = min(cap, base * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_breakers() -> List["CircuitBreaker"]:
+    return list(_breakers.values())
+
+
+class CircuitBreaker:
+    """Fails calls fast while a backend fails.
+
+    Attrs:
+        state: "closed" (calls are allowed), "open" (calls are rejected) or
+               "half-open" (one probe call is allowed).
+        stats: a number of times the circuit opened and of rejected calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        """
+        Args:
+            name: a name of the backend.
+            failure_threshold: a number of failures in a row after which
+                               the circuit opens.
+            reset_timeout: seconds after which a probe call is allowed.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        # A start of the probe call, a probe which is lost (e.g. its thread
+        # was killed) is replaced after `reset_timeout`
+        self._probe_started = None
+        self._lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+        _breakers[name] = self
+
+    def before_call(self):
+        """Checks if a call is allowed.
+
+        Raises:
+            CircuitOpenError: if the circuit is open.
+        """
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self.state == OPEN
+                and now - self._opened_at >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and (
+                self._probe_started is None
+                or now - self._probe_started >= self.reset_timeout
+            ):
+                self._probe_started = now
+                return
+            if self.state == CLOSED:
+                return
+            self.stats["rejected"] += 1
+            retry_in = max(self._opened_at + self.reset_timeout - now, 0)
+        raise CircuitOpenError(
+            "%s is unavailable, retry in %.0f s" % (self.name, retry_in)
+        )
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            self._probe_started = None
+            if self.state != CLOSED:
+                self.state = CLOSED
+                logger.info("%s circuit is closed", self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED
+                and self.failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.stats["opened"] += 1
+                logger.warning(
+                    "%s circuit is open",
+                    self.name,
+                    extra={"failures": self.failures},
+                )
+
+    @contextmanager
+    def guard(self, failures: Tuple[Type[BaseException], ...] = (Exception,)):
+        """Records a call made in the block.
+
+        Args:
+            failures: exceptions which mean the backend is down, other
+                      exceptions (e.g. a bad request) are successful calls.
+
+        Raises:
+            CircuitOpenError: if the circuit is open.
+        """
+        self.before_call()
+        try:
+            yield
+        except failures:
+            self.record_failure()
+            raise
+        except BaseException:
+            # The backend answered (e.g. a bad request, or a consumer
+            # stopped reading a streamed response)
+            self.record_success()
+            raise
+        self.record_success()
+
+    def get_stats(self) -> dict:
+        return dict(self.stats, state=self.state, failures=self.failures)
+
+
+def protect_session(
+    session: requests.Session,
+    breaker: CircuitBreaker,
+    timeout: float,
+    retries: int = 2,
+    backoff: float = 0.5,
+    max_backoff: float = 5,
+):
+    """Sends requests of a session through a circuit breaker.
+
+    Args:
+        session: a session, its `send` is wrapped.
+        breaker: a breaker of the backend.
+        timeout: seconds to connect and to wait for a response, if
+                 a request has no timeout.
+        retries: a max number of retries of an idempotent request which
+                 failed to connect or got 502/503/504. A read timeout isn't
+                 retried, it would hold the caller much longer.
+        backoff: seconds before the first retry (doubled each retry).
+        max_backoff: max seconds before a retry.
+    """
+    send = session.send
+
+    def protected_send(request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = timeout
+        attempts = 1 + (retries if request.method in IDEMPOTENT_METHODS else 0)
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1, backoff, max_backoff))
+            breaker.before_call()
+            try:
+                response = send(request, **kwargs)
+            except requests.exceptions.ConnectionError:
+                breaker.record_failure()
+                if attempt + 1 == attempts:
+                    raise
+                continue
+            except requests.exceptions.Timeout:
+                breaker.record_failure()
+                raise
+            if response.status_code < 500:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt + 1 == attempts
+            ):
+                return response
+            response.close()
+
+    session.send = protected_send
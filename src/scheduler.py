@@ -0,0 +1,208 @@
+"""A module with a scheduler of Jenkins builds requested from the chat.
+
+A request for a build of a job is:
+    started at once if the job is free,
+    merged with the running or the waiting request for the same commit,
+    put in the queue if the job is busy - a job has at most one waiting
+    request, a newer request replaces an older one, which is dropped.
+
+When the build of a job is finished (see `buildwatch`), the waiting request
+of the job is started. A check and a trigger of a job are done under the
+lock of the job, so concurrent presses of `Build` don't start two builds.
+The scheduler knows which jobs are busy with the builds it started, so
+Jenkins is asked only if the job is busy with a build started elsewhere.
+"""
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Optional
+
+from telebot import types
+
+from buildwatch import BuildWatcher
+
+
+logger = logging.getLogger(__name__)
+
+
+class BuildRequest:
+    """A requested build of a commit and its message in the chat."""
+
+    def __init__(
+        self,
+        job: str,
+        commit_hash: str,
+        chat_id: int,
+        message_id: int,
+        title: str,
+        buttons: Iterable[types.InlineKeyboardButton] = (),
+    ):
+        """
+        Args:
+            job: a job path.
+            commit_hash: a commit to build, passed as `COMMIT_HASH`.
+            chat_id: a chat of the build message.
+            message_id: the build message.
+            title: a title of the build, e.g. "Build for {commit_hash}".
+            buttons: inline buttons kept under the message.
+        """
+        self.job = job
+        self.commit_hash = commit_hash
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.title = title
+        self.buttons = list(buttons)
+
+
+class JobState:
+    """Builds of a job known to the scheduler."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # A commit of the running build (None if it's started elsewhere)
+        self.running_commit = None
+        # An id of the queue item of the running build
+        self.running_id = None
+        self.waiting: Optional[BuildRequest] = None
+
+
+class BuildScheduler:
+    """Starts requested builds, merges duplicates and queues them.
+
+    Attrs:
+        stats: counters - requested, started, queued, merged (duplicate)
+               and dropped (replaced by a newer request) builds.
+    """
+
+    def __init__(
+        self,
+        get_job_status: Callable[[str], Optional[int]],
+        invoke_job: Callable[..., Optional[int]],
+        watcher: BuildWatcher,
+        edit_message: Callable,
+    ):
+        """
+        Args:
+            get_job_status: returns an id of the queue item of the build
+                            which keeps a job busy or None.
+            invoke_job: triggers a build of a job, returns an id of
+                        the queue item.
+            watcher: a watcher of builds, which edits build messages.
+            edit_message: edits a message, has the signature of
+                          `TeleBot.edit_message_text`.
+        """
+        self.get_job_status = get_job_status
+        self.invoke_job = invoke_job
+        self.watcher = watcher
+        self.edit_message = edit_message
+        self.stats = {
+            "requested": 0,
+            "started": 0,
+            "queued": 0,
+            "merged": 0,
+            "dropped": 0,
+        }
+        self._jobs: Dict[str, JobState] = {}
+        self._lock = threading.Lock()
+
+    def _get_job(self, job: str) -> JobState:
+        with self._lock:
+            return self._jobs.setdefault(job, JobState())
+
+    def request(self, request: BuildRequest) -> str:
+        """Starts a build, or merges it with a known one, or queues it.
+
+        Returns:
+            "started", "merged" (the same commit is running or waiting)
+            or "queued" (the job is busy).
+        Raises:
+            UnknownJob, JenkinsAPIException, RequestException: the build
+            can't be started.
+        """
+        state = self._get_job(request.job)
+        with state.lock:
+            self.stats["requested"] += 1
+            if request.commit_hash in (
+                state.running_commit,
+                state.waiting and state.waiting.commit_hash,
+            ):
+                self.stats["merged"] += 1
+                return "merged"
+            if state.running_id is None:
+                busy_id = self.get_job_status(request.job)
+                if busy_id is None:
+                    self._start(state, request)
+                    return "started"
+                # The job is busy with a build started elsewhere
+                self._follow(state, request.job, None, busy_id)
+            if state.waiting is not None:
+                self._drop(state.waiting, "a newer commit is queued")
+            state.waiting = request
+            self.stats["queued"] += 1
+            return "queued"
+
+    def _start(self, state: JobState, request: BuildRequest):
+        """Triggers a build, must be called under the lock of the job."""
+        queue_id = self.invoke_job(
+            request.job, COMMIT_HASH=request.commit_hash
+        )
+        self.stats["started"] += 1
+        if queue_id is None:
+            # Without the queue item the build can't be followed
+            return
+        self._follow(state, request.job, request.commit_hash, queue_id)
+        self.watcher.watch(
+            request.job,
+            queue_id,
+            request.chat_id,
+            request.message_id,
+            request.title + " has requested.",
+            request.buttons,
+            on_finish=lambda: self._on_finish(request.job, queue_id),
+        )
+
+    def _follow(self, state: JobState, job: str, commit_hash, queue_id: int):
+        state.running_commit = commit_hash
+        state.running_id = queue_id
+        if commit_hash is None:
+            self.watcher.watch(
+                job,
+                queue_id,
+                on_finish=lambda: self._on_finish(job, queue_id),
+            )
+
+    def _on_finish(self, job: str, queue_id: int):
+        """Starts the waiting request when the running build is finished."""
+        state = self._get_job(job)
+        with state.lock:
+            if state.running_id != queue_id:
+                return
+            state.running_commit = state.running_id = None
+            request, state.waiting = state.waiting, None
+            if request is None:
+                return
+            try:
+                busy_id = self.get_job_status(job)
+                if busy_id is None:
+                    self._start(state, request)
+                    return
+                self._follow(state, job, None, busy_id)
+                state.waiting = request
+            except Exception as error:
+                logger.warning(
+                    "Checking a job failed: %s", error, extra={"job": job}
+                )
+                self._drop(request, "an error has occurred, try later")
+
+    def _drop(self, request: BuildRequest, reason: str):
+        self.stats["dropped"] += 1
+        kb = types.InlineKeyboardMarkup(row_width=2)
+        kb.add(*request.buttons)
+        try:
+            self.edit_message(
+                "%s is skipped: %s." % (request.title, reason),
+                request.chat_id,
+                request.message_id,
+                reply_markup=kb,
+            )
+        except Exception as error:
+            logger.warning("Editing a dropped build failed: %s", error)
@@ -0,0 +1,148 @@
+"""A module for sending messages within the Telegram flood limits.
+
+All outbound Telegram requests of the bot go through one `Sender`. Before
+a request the sender reserves a token in the global bucket and in the bucket
+of the chat, and sleeps until both tokens are available, so requests are
+spread out instead of failing with `429 Too Many Requests`. If Telegram still
+answers with 429, the request is retried after `retry_after` seconds.
+
+Telegram limits (https://core.telegram.org/bots/faq):
+    30 messages per second overall,
+    1 message per second in a private chat,
+    20 messages per minute in a group chat.
+"""
+import threading
+import time
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+# A number of messages that can be sent to a chat without waiting
+CHAT_BURST = 3
+# A number of retries of a request answered with 429
+MAX_RETRIES = 5
+# A number of chat buckets after which idle buckets are dropped
+MAX_CHAT_BUCKETS = 1000
+
+
+class TokenBucket:
+    """A token bucket with reservations.
+
+    A reservation takes a token even if the bucket is empty, so the number
+    of tokens can be negative - it's a queue of callers waiting for tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: a number of tokens added per second.
+            capacity: a max number of tokens in the bucket.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Takes a token and returns seconds to wait until it's available."""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block(self, now: float, seconds: float):
+        """Makes the next reservation wait at least `seconds`."""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Sender:
+    """Makes Telegram requests of a bot within the flood limits."""
+
+    def __init__(self, bot: TeleBot, global_rate: float = GLOBAL_RATE):
+        self.bot = bot
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def _get_chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {
+                    chat: bucket
+                    for chat, bucket in self._chats.items()
+                    if not bucket.is_full(now)
+                }
+            # Group and channel chat ids are negative
+            rate = GROUP_CHAT_RATE if chat_id < 0 else PRIVATE_CHAT_RATE
+            bucket = self._chats[chat_id] = TokenBucket(rate, CHAT_BURST)
+        return bucket
+
+    def _wait(self, chat_id: int):
+        with self._lock:
+            now = time.monotonic()
+            delay = max(
+                self._global.reserve(now),
+                self._get_chat_bucket(chat_id, now).reserve(now),
+            )
+        if delay:
+            time.sleep(delay)
+
+    def call(self, method: str, chat_id: int, **kwargs):
+        """Calls a bot API method for a chat when the limits allow it.
+
+        Args:
+            method: a name of a `TeleBot` method (e.g. "send_message").
+            chat_id: a chat id argument of the method.
+            kwargs: the rest arguments of the method.
+
+        Returns:
+            The result of the method.
+
+        Raises:
+            ApiTelegramException: if the request failed not because of
+                the flood limits or it was retried `MAX_RETRIES` times.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self._wait(chat_id)
+            try:
+                return getattr(self.bot, method)(chat_id=chat_id, **kwargs)
+            except ApiTelegramException as error:
+                if error.error_code != 429 or attempt == MAX_RETRIES:
+                    raise
+                parameters = error.result_json.get("parameters") or {}
+                retry_after = parameters.get("retry_after", 1)
+                with self._lock:
+                    now = time.monotonic()
+                    bucket = self._get_chat_bucket(chat_id, now)
+                    bucket.block(now, retry_after)
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        return self.call("send_message", chat_id, text=text, **kwargs)
+
+    def send_photo(self, chat_id: int, photo, **kwargs):
+        return self.call("send_photo", chat_id, photo=photo, **kwargs)
+
+    def edit_message_text(
+        self, text: str, chat_id: int, message_id: int, **kwargs
+    ):
+        return self.call(
+            "edit_message_text",
+            chat_id,
+            text=text,
+            message_id=message_id,
+            **kwargs,
+        )
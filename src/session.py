@@ -0,0 +1,117 @@
+"""A module with a pooled HTTP session that makes conditional requests.
+
+The session keeps TCP/TLS connections alive between calls and remembers
+`ETag`/`Last-Modified` validators of GET responses. Repeated requests are
+sent with `If-None-Match`/`If-Modified-Since` headers and a `304 Not Modified`
+answer is served from the local copy of the response. Responses are cached
+by the url and the request headers the content depends on (`VARY_HEADERS`).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+# Request headers which change the response, GitHub answers with
+# `Vary: Accept, Authorization`
+VARY_HEADERS = ("Accept", "Authorization")
+
+
+class ConditionalSession(requests.Session):
+    """A keep-alive `requests.Session` with revalidation of GET responses.
+
+    Callers always receive a full response: if the server answers with
+    `304 Not Modified` the previously cached response is returned instead.
+
+    Attrs:
+        stats: counters of the session - a number of requests, a number of
+               `304` responses served from the cache and latencies in seconds.
+    """
+
+    def __init__(self, pool_maxsize: int = 10, cache_size: int = 256):
+        """
+        Args:
+            pool_maxsize: a number of kept-alive connections per host.
+            cache_size: a number of cached GET responses (LRU eviction).
+        """
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.cache_size = cache_size
+        # (a request url, vary headers) -> the last response with validators
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "not_modified": 0,
+            "latency_last": 0.0,
+            "latency_total": 0.0,
+        }
+
+    def request(self, method, url, *args, **kwargs):
+        if method.upper() != "GET":
+            return self._timed_request(method, url, *args, **kwargs)
+
+        key = self._get_key(method, url, kwargs)
+        with self._lock:
+            cached = self._responses.get(key)
+        if cached is not None:
+            headers = dict(kwargs.get("headers") or {})
+            if "ETag" in cached.headers:
+                headers["If-None-Match"] = cached.headers["ETag"]
+            if "Last-Modified" in cached.headers:
+                headers["If-Modified-Since"] = cached.headers["Last-Modified"]
+            kwargs["headers"] = headers
+
+        response = self._timed_request(method, url, *args, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            with self._lock:
+                self.stats["not_modified"] += 1
+            # The response may have been evicted meanwhile, it's stored again
+            self._store(key, cached)
+            return cached
+        if response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        ):
+            self._store(key, response)
+        return response
+
+    def _get_key(self, method, url, kwargs) -> tuple:
+        """Returns a cache key of a request - the url and vary headers."""
+        url = requests.Request(method, url, params=kwargs.get("params"))
+        headers = CaseInsensitiveDict(self.headers)
+        headers.update(kwargs.get("headers") or {})
+        return (url.prepare().url,) + tuple(
+            headers.get(name) for name in VARY_HEADERS
+        )
+
+    def _store(self, key: tuple, response: requests.Response):
+        with self._lock:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            if len(self._responses) > self.cache_size:
+                self._responses.popitem(last=False)
+
+    def _timed_request(self, method, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        finally:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.stats["requests"] += 1
+                self.stats["latency_last"] = latency
+                self.stats["latency_total"] += latency
+
+    def get_stats(self) -> dict:
+        """Returns a copy of the session counters with an average latency."""
+        with self._lock:
+            stats = dict(self.stats)
+        requests_num = stats["requests"] or 1
+        stats["latency_avg"] = stats["latency_total"] / requests_num
+        return stats
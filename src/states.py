@@ -0,0 +1,230 @@
+"""A module with storages of dialog states of users with a TTL.
+
+The storages implement `telebot` `StateStorageBase`, so they are passed
+to `TeleBot(state_storage=...)` and used by `bot.set_state`, `bot.add_data`,
+`bot.retrieve_data` and the `state` filter of handlers. A state and its data
+are keyed by (chat id, user id) and a lookup is O(1). A dialog which state
+wasn't changed for `ttl` seconds is abandoned and expires.
+
+`StateTTLMemoryStorage` keeps states in the process memory.
+`StateSQLiteStorage` keeps states in an SQLite file: they survive restarts
+and are shared by several bot processes on the host (e.g. webhook workers).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from telebot.storage import StateStorageBase
+from telebot.storage.base_storage import StateContext
+
+
+# A number of state changes between purges of expired states
+PURGE_INTERVAL = 100
+
+
+def _get_name(state) -> str:
+    return state.name if hasattr(state, "name") else state
+
+
+class StateTTLMemoryStorage(StateStorageBase):
+    """An in-memory storage of states which expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float = 3600):
+        super().__init__()
+        self.ttl = ttl
+        # (chat id, user id) -> [an expiration time, a state, data]
+        self.data = {}
+        self._changes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, chat_id, user_id):
+        record = self.data.get((chat_id, user_id))
+        if record is not None and record[0] < time.monotonic():
+            del self.data[(chat_id, user_id)]
+            return None
+        return record
+
+    def _purge(self):
+        self._changes += 1
+        if self._changes % PURGE_INTERVAL == 0:
+            now = time.monotonic()
+            for key in [k for k, r in self.data.items() if r[0] < now]:
+                del self.data[key]
+
+    def set_state(self, chat_id, user_id, state):
+        with self._lock:
+            record = self._get(chat_id, user_id)
+            expires = time.monotonic() + self.ttl
+            data = record[2] if record else {}
+            self.data[(chat_id, user_id)] = [expires, _get_name(state), data]
+            self._purge()
+        return True
+
+    def delete_state(self, chat_id, user_id):
+        with self._lock:
+            return self.data.pop((chat_id, user_id), None) is not None
+
+    def get_state(self, chat_id, user_id):
+        with self._lock:
+            record = self._get(chat_id, user_id)
+        return record[1] if record else None
+
+    def get_data(self, chat_id, user_id):
+        with self._lock:
+            record = self._get(chat_id, user_id)
+        return record[2] if record else None
+
+    def reset_data(self, chat_id, user_id):
+        return self.save(chat_id, user_id, {})
+
+    def set_data(self, chat_id, user_id, key, value):
+        with self._lock:
+            record = self._get(chat_id, user_id)
+            if record is None:
+                raise RuntimeError(
+                    "chat_id {} and user_id {} does not exist".format(
+                        chat_id, user_id
+                    )
+                )
+            record[2][key] = value
+        return True
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        with self._lock:
+            record = self._get(chat_id, user_id)
+            if record is None:
+                return False
+            record[2] = data
+        return True
+
+
+class StateSQLiteStorage(StateStorageBase):
+    """An SQLite storage of states which expire after `ttl` seconds.
+
+    State data should be JSON serializable.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600):
+        """
+        Args:
+            path: a path to the SQLite database file.
+            ttl: seconds a state lives after the last change.
+        """
+        super().__init__()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self._changes = 0
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            # Several processes can use the database at the same time
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS states ("
+                "chat_id INTEGER NOT NULL, "
+                "user_id INTEGER NOT NULL, "
+                "state TEXT NOT NULL, "
+                "data TEXT NOT NULL, "
+                "expires REAL NOT NULL, "
+                "PRIMARY KEY (chat_id, user_id))"
+            )
+
+    def _get(self, chat_id, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, data FROM states "
+                "WHERE chat_id = ? AND user_id = ? AND expires > ?",
+                (chat_id, user_id, time.time()),
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _execute(self, sql: str, params: tuple) -> int:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._changes += 1
+            if self._changes % PURGE_INTERVAL == 0:
+                self._conn.execute(
+                    "DELETE FROM states WHERE expires <= ?", (time.time(),)
+                )
+        return cursor.rowcount
+
+    def set_state(self, chat_id, user_id, state):
+        self._execute(
+            "INSERT INTO states VALUES (?, ?, ?, '{}', ?) "
+            "ON CONFLICT (chat_id, user_id) DO UPDATE SET "
+            "state = excluded.state, expires = excluded.expires, "
+            "data = CASE WHEN states.expires > ? THEN states.data "
+            "ELSE '{}' END",
+            (
+                chat_id,
+                user_id,
+                _get_name(state),
+                time.time() + self.ttl,
+                time.time(),
+            ),
+        )
+        return True
+
+    def delete_state(self, chat_id, user_id):
+        return bool(
+            self._execute(
+                "DELETE FROM states WHERE chat_id = ? AND user_id = ?",
+                (chat_id, user_id),
+            )
+        )
+
+    def get_state(self, chat_id, user_id):
+        record = self._get(chat_id, user_id)
+        return record[0] if record else None
+
+    def get_data(self, chat_id, user_id):
+        record = self._get(chat_id, user_id)
+        return record[1] if record else None
+
+    def reset_data(self, chat_id, user_id):
+        return self.save(chat_id, user_id, {})
+
+    def set_data(self, chat_id, user_id, key, value):
+        data = self.get_data(chat_id, user_id)
+        if data is None:
+            raise RuntimeError(
+                "chat_id {} and user_id {} does not exist".format(
+                    chat_id, user_id
+                )
+            )
+        data[key] = value
+        return self.save(chat_id, user_id, data)
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        return bool(
+            self._execute(
+                "UPDATE states SET data = ? "
+                "WHERE chat_id = ? AND user_id = ? AND expires > ?",
+                (json.dumps(data), chat_id, user_id, time.time()),
+            )
+        )
+
+
+def create_state_storage(kind: str, path: str, ttl: float):
+    """Creates a state storage.
+
+    Args:
+        kind: "memory" or "sqlite".
+        path: a path to the SQLite database file (for "sqlite").
+        ttl: seconds a dialog state lives after the last change.
+    """
+    if kind == "sqlite":
+        return StateSQLiteStorage(path, ttl=ttl)
+    if kind == "memory":
+        return StateTTLMemoryStorage(ttl=ttl)
+    raise ValueError("Unknown state storage: %s" % kind)
@@ -0,0 +1,132 @@
+"""A module with a registry of tenants - team chats of several projects.
+
+A tenant is a team chat with its GitHub repository, Jenkins jobs and
+OpenAI settings. One bot process serves all tenants: they share the
+sessions (connection pools) of GitHub, Jenkins and OpenAI, the caches and
+the worker threads, only a commit index is kept per repository. A tenant
+is found by a chat id with one dict lookup.
+
+Tenants are loaded from a JSON file (`TENANTS_PATH`), a list of objects:
+    [
+        {
+            "name": "noted",
+            "chat_id": -1001234567890,
+            "repo": "welel/noted",
+            "cd_job": "noted/deploy",
+            "ci_job": "noted/test",
+            "blue_ocean_path": "/blue/organizations/jenkins/noted/activity",
+            "openai": {"model": "text-davinci-003", "temperature": 0.5},
+            "preamble": "Marv is a chatbot that ..."
+        }
+    ]
+Only "chat_id" and "repo" are required, jobs default to `CD_JOB` and
+`CI_JOB`. The tenant configured by the environment variables
+(`TELEGRAM_CHAT_ID`, `REPO_OWNER`, `REPO_NAME`, ...) is the default one.
+"""
+import json
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple
+from typing import Optional, Tuple
+
+
+class Tenant(NamedTuple):
+    """A team chat of a project."""
+
+    name: str
+    chat_id: int
+    # (an owner, a name) of the GitHub repository
+    repo: Tuple[str, str]
+    cd_job: str
+    ci_job: str
+    blue_ocean_path: str = ""
+    # Overrides of OpenAI completion parameters (e.g. "model")
+    openai_params: Mapping = MappingProxyType({})
+    preamble: Optional[str] = None
+
+
+def parse_tenant(data: dict, default: Tenant = None) -> Tenant:
+    """Returns a tenant from its JSON representation.
+
+    Args:
+        data: a dict, see the module docstring.
+        default: a tenant which jobs and settings are used if they are
+                 missing in `data`.
+
+    Raises:
+        ValueError: if a chat id or a repository is missing or invalid.
+    """
+    try:
+        chat_id = int(data["chat_id"])
+        owner, name = data["repo"].split("/")
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError(
+            "A tenant should have `chat_id` and `repo` (owner/name): %r"
+            % (data,)
+        )
+    return Tenant(
+        name=data.get("name") or data["repo"],
+        chat_id=chat_id,
+        repo=(owner, name),
+        cd_job=data.get("cd_job", default.cd_job if default else ""),
+        ci_job=data.get("ci_job", default.ci_job if default else ""),
+        blue_ocean_path=data.get(
+            "blue_ocean_path", default.blue_ocean_path if default else ""
+        ),
+        openai_params=MappingProxyType(dict(data.get("openai") or {})),
+        preamble=data.get("preamble"),
+    )
+
+
+def _repo_key(repo: Tuple[str, str]) -> Tuple[str, str]:
+    # GitHub names are case insensitive
+    owner, name = repo
+    return owner.lower(), name.lower()
+
+
+class TenantRegistry:
+    """Tenants by chat ids and by repositories."""
+
+    def __init__(self, tenants: Iterable[Tenant]):
+        """
+        Raises:
+            ValueError: if several tenants have the same chat id.
+        """
+        self._by_chat: Dict[int, Tenant] = {}
+        self._by_repo: Dict[Tuple[str, str], List[Tenant]] = {}
+        for tenant in tenants:
+            if tenant.chat_id in self._by_chat:
+                raise ValueError(
+                    "Several tenants have the chat id %d" % tenant.chat_id
+                )
+            self._by_chat[tenant.chat_id] = tenant
+            self._by_repo.setdefault(_repo_key(tenant.repo), []).append(
+                tenant
+            )
+
+    @classmethod
+    def load(cls, path: str, default: Tenant = None) -> "TenantRegistry":
+        """Loads tenants from a JSON file.
+
+        The default tenant is added if its chat isn't in the file.
+        """
+        with open(path) as file:
+            tenants = [parse_tenant(item, default) for item in json.load(file)]
+        if default is not None and default.chat_id not in {
+            tenant.chat_id for tenant in tenants
+        }:
+            tenants.insert(0, default)
+        return cls(tenants)
+
+    def get(self, chat_id: int) -> Optional[Tenant]:
+        """Returns a tenant of a chat or None if the chat isn't served."""
+        return self._by_chat.get(chat_id)
+
+    def by_repo(self, repo: Tuple[str, str]) -> List[Tenant]:
+        """Returns tenants of a repository."""
+        return self._by_repo.get(_repo_key(repo), [])
+
+    def __iter__(self) -> Iterator[Tenant]:
+        return iter(self._by_chat.values())
+
+    def __len__(self) -> int:
+        return len(self._by_chat)
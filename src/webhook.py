@@ -0,0 +1,341 @@
+"""A module with a webhook server, an alternative to long polling.
+
+Telegram sends updates to the server as POST requests. The server only
+validates an update and puts it into a bounded queue, a pool of workers
+passes updates from the queue to the bot handlers. If the queue is full,
+the server answers with `503`, and Telegram retries the update later
+(backpressure). Telegram may deliver an update more than once, so recently
+seen `update_id`s are skipped.
+
+GitHub `push` events are received by `PushDispatcher` on another route of
+the same server. Signatures of events are verified, and pushes received
+within `delay` seconds are passed to a handler together (a burst).
+
+Usage:
+    server = WebhookServer("0.0.0.0", 8443)
+    server.route("/telegram", UpdateDispatcher(bot, secret_token="..."))
+    server.route("/github", PushDispatcher(handle_pushes, secret="..."))
+    server.serve_forever()
+"""
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from telebot import TeleBot, types
+
+
+logger = logging.getLogger(__name__)
+
+
+# A number of handler latencies kept for percentiles
+LATENCY_SAMPLES = 1000
+
+# A route handler gets request headers and a body and returns a status
+RouteHandler = Callable[[dict, bytes], int]
+
+
+class UpdateDispatcher:
+    """Receives Telegram updates and processes them by a pool of workers.
+
+    Attrs:
+        stats: counters - received, processed, duplicate and rejected
+               (the queue was full) updates.
+    """
+
+    def __init__(
+        self,
+        bot: TeleBot,
+        secret_token: str = None,
+        workers: int = 8,
+        queue_size: int = 100,
+        dedupe_size: int = 10000,
+    ):
+        """
+        Args:
+            bot: a bot with registered handlers (should be not `threaded`,
+                 so handlers are executed by the workers of the dispatcher).
+            secret_token: a value of `X-Telegram-Bot-Api-Secret-Token`,
+                          which was passed to `set_webhook`.
+            workers: a number of worker threads.
+            queue_size: a max number of updates waiting for a worker.
+            dedupe_size: a number of last `update_id`s kept to skip
+                         repeated updates.
+        """
+        self.bot = bot
+        self.secret_token = secret_token
+        self.dedupe_size = dedupe_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._seen_ids = set()
+        self._seen_order = deque()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "processed": 0,
+            "duplicate": 0,
+            "rejected": 0,
+        }
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def __call__(self, headers: dict, body: bytes) -> int:
+        if (
+            self.secret_token
+            and headers.get("X-Telegram-Bot-Api-Secret-Token")
+            != self.secret_token
+        ):
+            return 403
+        try:
+            data = json.loads(body)
+            update_id = data["update_id"]
+        except (ValueError, KeyError, TypeError):
+            return 400
+
+        with self._lock:
+            self.stats["received"] += 1
+            if update_id in self._seen_ids:
+                self.stats["duplicate"] += 1
+                return 200
+            try:
+                self._queue.put_nowait((time.perf_counter(), data))
+            except queue.Full:
+                self.stats["rejected"] += 1
+                return 503
+            self._seen_ids.add(update_id)
+            self._seen_order.append(update_id)
+            if len(self._seen_order) > self.dedupe_size:
+                self._seen_ids.discard(self._seen_order.popleft())
+        return 200
+
+    def _work(self):
+        while True:
+            received_at, data = self._queue.get()
+            try:
+                self.bot.process_new_updates([types.Update.de_json(data)])
+            except Exception:
+                logger.exception("Processing an update failed")
+            latency = time.perf_counter() - received_at
+            with self._lock:
+                self.stats["processed"] += 1
+                self._latencies.append(latency)
+            self._queue.task_done()
+
+    def join(self):
+        """Blocks until all received updates are processed."""
+        self._queue.join()
+
+    def get_stats(self) -> dict:
+        """Returns counters and p50/p99 latencies of updates in seconds.
+
+        A latency is a time from receiving an update to the end of its
+        processing, including waiting in the queue.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            latencies = sorted(self._latencies)
+        stats["queued"] = self._queue.qsize()
+        for name, share in (("p50", 0.5), ("p99", 0.99)):
+            stats[name] = (
+                latencies[int(share * (len(latencies) - 1))]
+                if latencies
+                else None
+            )
+        return stats
+
+
+class Push(NamedTuple):
+    """A push to a branch, commits are dicts with keys "sha", "comment" and
+    "url" ordered from the newest to the oldest."""
+
+    before: str
+    after: str
+    forced: bool
+    pusher: str
+    commits: List[dict]
+    # (an owner, a name) of the repository
+    repo: Optional[Tuple[str, str]] = None
+
+
+def verify_signature(secret: str, body: bytes, signature: str) -> bool:
+    """Checks a `X-Hub-Signature-256` header of a GitHub event."""
+    expected = "sha256=" + hmac.new(
+        secret.encode(), body, hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+
+def parse_push(data: dict) -> Optional[Push]:
+    """Returns a push to the default branch from a `push` event payload.
+
+    Returns:
+        A push or None if it's a push to another branch or a tag.
+    """
+    branch = data["repository"]["default_branch"]
+    if data["ref"] != "refs/heads/" + branch or data.get("deleted"):
+        return None
+    return Push(
+        data["before"],
+        data["after"],
+        bool(data.get("forced")),
+        (data.get("pusher") or {}).get("name", ""),
+        [
+            {
+                "sha": commit["id"],
+                "comment": commit["message"],
+                "url": commit["url"],
+            }
+            for commit in reversed(data["commits"])
+        ],
+        tuple(data["repository"]["full_name"].split("/", 1)),
+    )
+
+
+class PushDispatcher:
+    """Receives GitHub `push` events and passes them to a handler in bursts.
+
+    The first push starts a burst, all pushes received in `delay` seconds
+    after it are passed to the handler in one call from a timer thread.
+
+    Attrs:
+        stats: counters - received events, pushes to the default branch,
+               duplicate and rejected (a wrong signature) events, bursts.
+    """
+
+    def __init__(
+        self,
+        handle_pushes: Callable[[List[Push]], None],
+        secret: str,
+        delay: float = 5,
+        dedupe_size: int = 1000,
+    ):
+        """
+        Args:
+            handle_pushes: gets a list of pushes of a burst, from the first.
+            secret: a secret of the GitHub webhook.
+            delay: seconds pushes are collected into a burst.
+            dedupe_size: a number of last delivery ids kept to skip
+                         redelivered events.
+        """
+        self.handle_pushes = handle_pushes
+        self.secret = secret
+        self.delay = delay
+        self.dedupe_size = dedupe_size
+        self._pushes = []
+        self._timer = None
+        self._seen_ids = set()
+        self._seen_order = deque()
+        self._lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "pushes": 0,
+            "duplicate": 0,
+            "rejected": 0,
+            "bursts": 0,
+        }
+
+    def __call__(self, headers: dict, body: bytes) -> int:
+        if not verify_signature(
+            self.secret, body, headers.get("X-Hub-Signature-256")
+        ):
+            with self._lock:
+                self.stats["rejected"] += 1
+            return 403
+        event = headers.get("X-GitHub-Event")
+        delivery = headers.get("X-GitHub-Delivery")
+        with self._lock:
+            self.stats["received"] += 1
+        if event != "push":
+            # E.g. `ping` after the webhook is created
+            return 200
+        try:
+            push = parse_push(json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return 400
+        # Redeliveries may arrive at once, a delivery id is checked and
+        # remembered under one lock
+        with self._lock:
+            if delivery in self._seen_ids:
+                self.stats["duplicate"] += 1
+                return 200
+            if delivery:
+                self._seen_ids.add(delivery)
+                self._seen_order.append(delivery)
+                if len(self._seen_order) > self.dedupe_size:
+                    self._seen_ids.discard(self._seen_order.popleft())
+            if push is None:
+                return 200
+            self.stats["pushes"] += 1
+            self._pushes.append(push)
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return 200
+
+    def flush(self):
+        """Passes collected pushes to the handler at once."""
+        with self._lock:
+            pushes, self._pushes = self._pushes, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if pushes:
+                self.stats["bursts"] += 1
+        if not pushes:
+            return
+        try:
+            self.handle_pushes(pushes)
+        except Exception:
+            logger.exception("Handling pushes failed")
+
+
+class WebhookServer:
+    """A threaded HTTP server which routes POST requests by a path."""
+
+    def __init__(self, host: str, port: int):
+        self.routes: Dict[str, RouteHandler] = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                route = server.routes.get(self.path.split("?")[0])
+                status = route(self.headers, body) if route else 404
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._httpd.server_address
+
+    def route(self, path: str, handler: RouteHandler):
+        """Registers a handler of POST requests to the path."""
+        self.routes[path] = handler
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def start(self):
+        """Starts serving in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
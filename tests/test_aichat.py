@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+# Databases are created in a temporary directory, answers aren't saved
+os.environ.setdefault("RESOURCES_PATH", tempfile.mkdtemp() + "/")
+os.environ["CHAT_CACHE_PATH"] = ""
+
+import aichat  # noqa: E402
+import conversation  # noqa: E402
+from cache import TTLCache  # noqa: E402
+
+CHAT_ID = -100
+TTL = 600
+
+
+class ChatCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.prompts = []
+        patches = [
+            mock.patch.object(
+                aichat.openai.Completion, "create", self.create
+            ),
+            mock.patch.object(
+                aichat, "answers_cache", TTLCache(maxsize=16, ttl=60)
+            ),
+            mock.patch.object(
+                aichat,
+                "_memory",
+                conversation.ConversationMemory(":memory:", ttl=TTL),
+            ),
+            mock.patch.dict(
+                aichat._cache_stats,
+                {"hits": 0, "coalesced": 0, "misses": 0, "tokens_saved": 0},
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def create(self, prompt, stream=False, **kwargs):
+        self.prompts.append(prompt)
+        text = " answer %d" % len(self.prompts)
+        if stream:
+            return iter([{"choices": [{"text": text}]}])
+        return {"choices": [{"text": text}], "usage": {"total_tokens": 10}}
+
+    def later(self, seconds: float):
+        """Moves the clock of conversations forward."""
+        now = conversation.time.time() + seconds
+        patch = mock.patch.object(
+            conversation, "time", types.SimpleNamespace(time=lambda: now)
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_follow_up_isnt_cached(self):
+        first = aichat.get_answer("question", CHAT_ID)
+        second = aichat.get_answer("question", CHAT_ID)
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.prompts), 2)
+        self.assertIn(first.strip(), self.prompts[1])
+
+    def test_repeated_question_after_idle_conversation(self):
+        answer = aichat.get_answer("question", CHAT_ID)
+        self.assertTrue(aichat.get_memory().has_history(CHAT_ID))
+        self.later(TTL + 1)
+        self.assertFalse(aichat.get_memory().has_history(CHAT_ID))
+        self.assertEqual(aichat.get_answer("question", CHAT_ID), answer)
+        self.assertEqual(len(self.prompts), 1)
+        self.assertEqual(aichat.get_cache_stats()["hits"], 1)
+
+    def test_repeated_question_after_reset(self):
+        aichat.get_answer("question", CHAT_ID)
+        aichat.get_answer("other question", CHAT_ID)
+        aichat.get_memory().clear(CHAT_ID)
+        answer = aichat.get_answer("Question ", CHAT_ID)
+        self.assertEqual(answer, " answer 1")
+        self.assertEqual(len(self.prompts), 2)
+
+    def test_streamed_answer_in_chat_with_history(self):
+        # The way the team chat asks: streamed, the chat has older turns
+        aichat.get_answer("first question", CHAT_ID)
+        answer = "".join(aichat.stream_answer("question", CHAT_ID + 1))
+        self.later(TTL + 1)
+        self.assertTrue(aichat.get_memory()._get_history(CHAT_ID))
+        chunks = list(aichat.stream_answer(" QUESTION", CHAT_ID))
+        self.assertEqual(chunks, [answer])
+        self.assertEqual(len(self.prompts), 2)
+        stats = aichat.get_cache_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["hit_ratio"], 1 / 3)
+        self.assertGreater(stats["tokens_saved"], 0)
+
+    def test_new_answers_are_dumped_once(self):
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, "chat_cache.json")
+            with mock.patch.object(aichat, "CHAT_CACHE_PATH", path):
+                aichat.get_answer("question", CHAT_ID)
+                aichat.get_answer("other question", CHAT_ID + 1)
+                self.assertFalse(os.path.exists(path))
+                aichat.dump_cache()
+            with open(path) as file:
+                self.assertEqual(len(json.load(file)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from buildwatch import MISSING_POLLS, BuildWatcher  # noqa: E402
+
+
+class BuildWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.builds = {"job": []}
+        self.queue = {7}
+        self.finished = []
+        self.watcher = BuildWatcher(
+            lambda num: self.builds,
+            lambda *args, **kwargs: None,
+            fetch_queue=lambda: self.queue,
+        )
+        # Watches are added directly, so polling threads aren't started
+        self.watcher._started = True
+        self.watcher.watch(
+            "job", 7, on_finish=lambda: self.finished.append(7)
+        )
+
+    def test_ends_watch_of_cancelled_queue_item(self):
+        self.watcher.poll()
+        self.assertEqual(len(self.watcher), 1)
+        self.queue = set()
+        for _ in range(MISSING_POLLS):
+            self.watcher.poll()
+        self.assertEqual(len(self.watcher), 0)
+        self.assertEqual(self.finished, [7])
+
+    def test_keeps_watch_of_started_build(self):
+        self.queue = set()
+        self.builds = {"job": [{"queueId": 7, "number": 1, "building": True}]}
+        for _ in range(MISSING_POLLS):
+            self.watcher.poll()
+        self.assertEqual(len(self.watcher), 1)
+        self.assertEqual(self.finished, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from commitindex import CommitIndex  # noqa: E402
+
+
+def make_commits(*numbers) -> list:
+    return [
+        {"sha": "s%d" % n, "comment": "c%d" % n, "url": "u%d" % n}
+        for n in numbers
+    ]
+
+
+class CommitIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = CommitIndex(":memory:")
+
+    def shas(self) -> list:
+        return [commit["sha"] for commit in self.index.latest(100)]
+
+    def test_backfills_crossing_seq_zero(self):
+        self.index.add_newer(make_commits(10, 9, 8))
+        self.index.add_older(make_commits(7))
+        self.index.add_older(make_commits(6, 5))
+        self.index.add_older(make_commits(4))
+        self.assertEqual(
+            self.shas(), ["s10", "s9", "s8", "s7", "s6", "s5", "s4"]
+        )
+
+    def test_newer_after_backfill_below_zero(self):
+        self.index.add_older(make_commits(3, 2, 1))
+        self.index.add_newer(make_commits(5, 4))
+        self.assertEqual(self.shas(), ["s5", "s4", "s3", "s2", "s1"])
+        self.assertEqual(self.index.oldest_sha(), "s1")
+        self.assertEqual(self.index.newest_sha(), "s5")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+# Databases of the bot are created in a temporary directory
+os.environ.setdefault("RESOURCES_PATH", tempfile.mkdtemp() + "/")
+os.environ["STATE_STORAGE"] = "memory"
+
+import bot  # noqa: E402
+from callback import get_data  # noqa: E402
+
+PAGE = bot.COMMITS_PER_MESSAGE
+
+
+class CommitsPagingTest(unittest.TestCase):
+    def setUp(self):
+        self.history = [
+            {"sha": "%040x" % i, "comment": "Commit %d" % i, "url": "u"}
+            for i in range(3 * PAGE)
+        ]
+        self.indexed = []
+        self.sent = []
+        patches = [
+            mock.patch.object(bot.sender, "send_message", self.send),
+            mock.patch.object(bot.sender, "edit_message_text", self.edit),
+            mock.patch.object(bot, "get_commits", self.get_commits),
+            mock.patch.object(
+                bot, "get_indexed_commits", self.get_indexed_commits
+            ),
+            mock.patch.object(
+                bot, "get_commit_details", lambda shas, repo=None: {}
+            ),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def send(self, chat_id, text, reply_markup=None, **kwargs):
+        self.sent.append((text, reply_markup))
+
+    def edit(self, text, chat_id, message_id, reply_markup=None, **kwargs):
+        self.sent.append((text, reply_markup))
+
+    def get_commits(self, num, repo=None):
+        # Commits are backfilled one by one, as they are read
+        for commit in self.history[:num]:
+            if commit not in self.indexed:
+                self.indexed.append(commit)
+            yield commit
+
+    def get_indexed_commits(self, offset, num, repo=None):
+        return self.indexed[offset : offset + num]
+
+    def next_data(self):
+        """Returns callback data of the Next button of the last message."""
+        for button in self.sent[-1][1].keyboard[-1]:
+            if button.text.startswith("Next"):
+                return get_data(button.callback_data)
+        return None
+
+    def show_next_page(self):
+        callback = types.SimpleNamespace(
+            message=types.SimpleNamespace(
+                chat=types.SimpleNamespace(id=bot.CHAT_ID),
+                message_id=1,
+            )
+        )
+        bot.commits_page_handler(callback, self.next_data())
+
+    def test_first_page_is_sent_before_backfill(self):
+        commits = bot.get_commits(num=len(self.history))
+        bot.send_paged_commits(
+            commits, len(self.history), bot.DEFAULT_TENANT
+        )
+        # A page and one more commit to know there is the next page
+        self.assertEqual(len(self.indexed), PAGE + 1)
+        self.assertIn("of %d" % len(self.history), self.sent[-1][0])
+        self.assertIsNotNone(self.next_data())
+
+    def test_next_page_is_backfilled(self):
+        commits = bot.get_commits(num=len(self.history))
+        bot.send_paged_commits(
+            commits, len(self.history), bot.DEFAULT_TENANT
+        )
+        self.show_next_page()
+        self.assertEqual(len(self.indexed), 2 * PAGE + 1)
+        self.assertIn("Commit %d" % PAGE, self.sent[-1][0])
+
+    def test_short_history_has_no_next_page(self):
+        # The history ends with a full page
+        number = len(self.history) + PAGE
+        commits = bot.get_commits(num=number)
+        bot.send_paged_commits(commits, number, bot.DEFAULT_TENANT)
+        self.show_next_page()
+        self.show_next_page()
+        self.assertIn("of %d" % len(self.history), self.sent[-1][0])
+        self.assertIsNone(self.next_data())
+
+
+if __name__ == "__main__":
+    unittest.main()
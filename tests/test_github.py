@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+# Databases are created in a temporary directory
+os.environ.setdefault("RESOURCES_PATH", tempfile.mkdtemp() + "/")
+
+import github  # noqa: E402
+
+
+class RepoStateTest(unittest.TestCase):
+    def test_repo_names_are_case_insensitive(self):
+        state = github._get_repo(("Owner", "Repo"))
+        self.assertIs(github._get_repo(("owner", "REPO")), state)
+        self.assertTrue(state.path.endswith("commits-owner-repo.sqlite3"))
+
+    def test_default_repo_in_other_case(self):
+        owner, name = github.DEFAULT_REPO
+        state = github._get_repo((owner.upper(), name.upper()))
+        self.assertIs(state, github._get_repo())
+        self.assertEqual(state.path, github.COMMITS_DB_PATH)
+
+
+if __name__ == "__main__":
+    unittest.main()
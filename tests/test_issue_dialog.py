@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+# Databases of the bot are created in a temporary directory
+os.environ.setdefault("RESOURCES_PATH", tempfile.mkdtemp() + "/")
+os.environ["STATE_STORAGE"] = "memory"
+
+import bot  # noqa: E402
+
+CHAT_ID, USER_ID = -100, 1
+
+
+def make_message(text: str):
+    return types.SimpleNamespace(
+        text=text,
+        message_id=1,
+        chat=types.SimpleNamespace(id=CHAT_ID),
+        from_user=types.SimpleNamespace(id=USER_ID),
+    )
+
+
+class IssueDialogTest(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        patches = [
+            mock.patch.object(bot.sender, "send_message", self.send),
+            mock.patch.object(bot, "create_issue_api", self.create_issue),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.issues = []
+
+    def send(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+    def create_issue(self, title, body, labels, repo=None):
+        self.issues.append((title, body, labels))
+        return "https://github.com/o/r/issues/1"
+
+    def start_dialog(self):
+        bot.bot.set_state(USER_ID, bot.IssueStates.title, CHAT_ID)
+        bot.process_issue_title_step(make_message("Title"))
+        bot.process_issue_body_step(make_message("Body"))
+
+    def test_creates_issue(self):
+        self.start_dialog()
+        bot.process_issue_label_step(make_message("bug"))
+        self.assertEqual(self.issues, [("Title", "Body", ["bug"])])
+
+    def test_expired_dialog(self):
+        self.start_dialog()
+        storage = bot.bot.current_states
+        # The dialog expires after the label step was dispatched
+        for record in storage.data.values():
+            record[0] = 0
+        bot.process_issue_label_step(make_message("bug"))
+        self.assertEqual(self.issues, [])
+        self.assertIn("expired", self.sent[-1])
+        self.assertIsNone(bot.bot.get_state(USER_ID, CHAT_ID))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+from session import ConditionalSession  # noqa: E402
+
+
+class StubAdapter(BaseAdapter):
+    """Answers with the `Accept` header as a body, the resource is never
+    modified, so its `ETag` doesn't depend on the header."""
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        if request.headers.get("If-None-Match") == "v1":
+            response.status_code = 304
+        else:
+            response.status_code = 200
+            response.headers["ETag"] = "v1"
+            response._content = request.headers["Accept"].encode()
+        return response
+
+    def close(self):
+        pass
+
+
+class ConditionalSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.session = ConditionalSession(cache_size=1)
+        self.session.mount("http://", StubAdapter())
+
+    def get(self, url, accept):
+        return self.session.get(url, headers={"Accept": accept})
+
+    def test_caches_by_accept_header(self):
+        self.assertEqual(self.get("http://x/a", "json").text, "json")
+        self.assertEqual(self.get("http://x/a", "raw").text, "raw")
+        self.assertEqual(self.get("http://x/a", "raw").text, "raw")
+        self.assertEqual(self.session.stats["not_modified"], 1)
+
+    def test_not_modified_after_eviction(self):
+        self.get("http://x/a", "json")
+        cached = self.session._responses
+        key = next(iter(cached))
+        original_get = cached.get
+
+        def get_and_evict(key_):
+            # Another request evicts the entry while this one is sent
+            response = original_get(key_)
+            cached.pop(key, None)
+            return response
+
+        cached.get = get_and_evict
+        self.assertEqual(self.get("http://x/a", "json").text, "json")
+        self.assertIn(key, cached)
+
+
+if __name__ == "__main__":
+    unittest.main()